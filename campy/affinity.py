@@ -0,0 +1,178 @@
+"""
+CPU placement of camera workers (Linux). Pins grab threads and writers to CPUs (grabCores, writerCores),
+planned from the NUMA topology with "auto", and optionally raises grab thread priority (grabNice).
+"""
+
+import os, glob, logging, threading
+
+SYSFS_NODES = "/sys/devices/system/node/node[0-9]*"
+SYSFS_CPU = "/sys/devices/system/cpu/cpu{}/topology/thread_siblings_list"
+
+
+def Supported():
+
+	return hasattr(os, "sched_setaffinity")
+
+
+def ParseCpuList(cpus):
+	# "0-3,8" / 3 / [0, 1] / "None" to a sorted list of CPU ids (empty for "None")
+	if cpus is None or cpus == "None" or cpus == "auto":
+		return []
+	if isinstance(cpus, int):
+		return [cpus]
+	if isinstance(cpus, (list, tuple)):
+		return sorted(set(c for item in cpus for c in ParseCpuList(item)))
+	result = set()
+	for part in str(cpus).replace(" ", "").split(","):
+		if part == "":
+			continue
+		if "-" in part:
+			first, last = part.split("-")
+			result.update(range(int(first), int(last) + 1))
+		else:
+			result.add(int(part))
+	return sorted(result)
+
+
+def FormatCpuList(cpus):
+	# Sorted list of CPU ids to "0-3,8"
+	ranges = []
+	for c in sorted(cpus):
+		if ranges and c == ranges[-1][1] + 1:
+			ranges[-1][1] = c
+		else:
+			ranges.append([c, c])
+	return ",".join(str(a) if a == b else "{}-{}".format(a, b) for a, b in ranges)
+
+
+def ReadCpuList(file_name):
+	try:
+		with open(file_name) as f:
+			return ParseCpuList(f.read().strip())
+	except (OSError, ValueError):
+		return []
+
+
+def NumaNodes(available):
+	# CPUs of each NUMA node, limited to available CPUs. One node if topology is unknown
+	nodes = []
+	for node in sorted(glob.glob(SYSFS_NODES), key=lambda n: int(n.rsplit("node", 1)[1])):
+		cpus = [c for c in ReadCpuList(os.path.join(node, "cpulist")) if c in available]
+		if len(cpus) > 0:
+			nodes.append((int(node.rsplit("node", 1)[1]), cpus))
+	if len(nodes) == 0:
+		nodes = [(0, sorted(available))]
+	return nodes
+
+
+def PhysicalCores(cpus):
+	# Group CPUs into physical cores (SMT siblings together), in CPU order
+	cores, seen = [], set()
+	for c in cpus:
+		if c in seen:
+			continue
+		siblings = [s for s in ReadCpuList(SYSFS_CPU.format(c)) if s in cpus] or [c]
+		seen.update(siblings)
+		cores.append(siblings)
+	return cores
+
+
+def AutoPlacement(n_cam, numCams, available):
+	# Returns (numa node, grab CPUs, writer CPUs) for camera n_cam
+	nodes = NumaNodes(available)
+	node, node_cpus = nodes[n_cam % len(nodes)]
+	node_cams = [n for n in range(numCams) if n % len(nodes) == n_cam % len(nodes)]
+	k, m = node_cams.index(n_cam), len(node_cams)
+	cores = PhysicalCores(node_cpus)
+
+	if len(cores) >= 2*m:
+		# One physical core per grab thread, remaining cores split between writers
+		grab = cores[k]
+		rest = cores[m:]
+		writer = [c for core in rest[k*len(rest)//m:(k + 1)*len(rest)//m] for c in core]
+	else:
+		# Too few cores on this node: grab threads share cores, writers use the rest of the node
+		grab = cores[k % len(cores)]
+		writer = [c for c in node_cpus if c not in grab] or list(node_cpus)
+	return node, sorted(grab), sorted(writer)
+
+
+def PlaceCamera(cam_params):
+	# Plan this camera's placement, and pin the camera process to it before buffers are allocated
+	cam_params["numaNode"] = "None"
+	cam_params["grabCpus"] = "None"
+	cam_params["writerCpus"] = "None"
+	grab_cores, writer_cores = cam_params["grabCores"], cam_params["writerCores"]
+	if grab_cores == "None" and writer_cores == "None":
+		return cam_params
+	if not Supported():
+		print("CPU placement (grabCores, writerCores) is only supported on Linux. Ignoring it.")
+		return cam_params
+
+	try:
+		available = os.sched_getaffinity(0)
+		grab, writer = ParseCpuList(grab_cores), ParseCpuList(writer_cores)
+		process_cpus = []
+		if grab_cores == "auto" or writer_cores == "auto":
+			node, auto_grab, auto_writer = AutoPlacement(cam_params["n_cam"], cam_params["numCams"], available)
+			grab = auto_grab if grab_cores == "auto" else grab
+			writer = auto_writer if writer_cores == "auto" else writer
+			cam_params["numaNode"] = node
+			process_cpus = [c for n, cpus in NumaNodes(available) if n == node for c in cpus]
+		elif len(grab) > 0 and len(writer) > 0:
+			process_cpus = sorted(set(grab + writer))
+
+		missing = [c for c in grab + writer if c not in available]
+		if len(missing) > 0:
+			raise ValueError("CPUs {} are not available to campy.".format(FormatCpuList(missing)))
+
+		if len(grab) > 0:
+			cam_params["grabCpus"] = FormatCpuList(grab)
+		if len(writer) > 0:
+			cam_params["writerCpus"] = FormatCpuList(writer)
+		if len(process_cpus) > 0:
+			os.sched_setaffinity(0, process_cpus)
+
+		print("{} placement: NUMA node {}, grab CPUs {}, writer CPUs {}.".format(cam_params["cameraName"],
+			cam_params["numaNode"], cam_params["grabCpus"], cam_params["writerCpus"]))
+
+	except Exception as e:
+		logging.error("Caught exception at affinity.py PlaceCamera: {}".format(e))
+
+	return cam_params
+
+
+def PinThread(cpus):
+	# Pin the calling thread (and threads/processes it starts later) to cpus
+	cpus = ParseCpuList(cpus)
+	if len(cpus) == 0 or not Supported():
+		return False
+	try:
+		os.sched_setaffinity(0, cpus)
+		return True
+	except OSError as e:
+		logging.warning("Could not pin thread to CPUs {}: {}".format(FormatCpuList(cpus), e))
+		return False
+
+
+def PinGrabThread(cam_params):
+	# Pin the grab thread and optionally raise its priority. Records the niceness it runs at
+	PinThread(cam_params["grabCpus"])
+	if not Supported():
+		return cam_params
+	nice = int(cam_params["grabNice"])
+	tid = threading.get_native_id()
+	if nice != 0:
+		try:
+			# Niceness is per thread on Linux
+			os.setpriority(os.PRIO_PROCESS, tid, nice)
+		except OSError as e:
+			logging.warning("Could not set grab thread niceness to {} (needs root or CAP_SYS_NICE): {}"\
+				.format(nice, e))
+	cam_params["grabThreadNice"] = os.getpriority(os.PRIO_PROCESS, tid)
+	return cam_params
+
+
+def PinWriterThread(cam_params):
+	# Pin the writer thread. ffmpeg encoders started from it inherit its CPUs
+	PinThread(cam_params["writerCpus"])
@@ -0,0 +1,298 @@
+"""
+End-to-end acquisition benchmark ("campy-bench"). Records from synthetic cameras with the real pipeline
+for every camera count x resolution x frame rate x encoder, and reports fps, drops, CPU, memory and disk rate.
+
+Usage:
+campy-bench ./configs/campy_config.yaml --benchCams "[1,2,4]" --resolutions "['640x480','1152x1024']" \
+	--frameRates "[100,200]" --encoders "['libx264','h264_nvenc']" --durationInSec 20 --benchOutput bench.json
+"""
+
+import os, ast, csv, sys, json, time, shutil, tempfile, logging, subprocess, urllib.request
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import yaml
+import numpy as np
+from scipy import io as sio
+from campy import configurator, encoders
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# Base port of the metrics endpoints if the config does not set metricsPort
+METRICS_PORT = 9400
+SCRAPE_INTERVAL = 1.0
+
+# A run is not sustained if grabbing falls further behind the camera than this, in frame periods
+MAX_LAG_GROWTH = 5
+
+# Keys that are not camera parameters
+BENCH_KEYS = ["benchCams", "resolutions", "frameRates", "encoders", "durationInSec", "benchOutput"]
+
+
+def ChildrenCPUTime():
+	if resource is None:
+		return float('nan')
+	r = resource.getrusage(resource.RUSAGE_CHILDREN)
+	return r.ru_utime + r.ru_stime
+
+
+def EncoderSettings(name):
+	# Encoder name (e.g. "libx264", "h264_nvenc") to (codec, gpuMake or "cpu")
+	for codec, makes in encoders.ENCODERS.items():
+		for make, encoder in makes.items():
+			if encoder == name:
+				return codec, make
+	raise ValueError("Unknown encoder '{}'. Choose from {}.".format(name,
+		", ".join(e for makes in encoders.ENCODERS.values() for e in makes.values())))
+
+
+def ParseResolution(resolution):
+	# "1152x1024" to (1152, 1024)
+	width, height = str(resolution).lower().split("x")
+	return int(width), int(height)
+
+
+def Combinations(args):
+	# (numCams, width, height, frameRate, encoder)
+	return [(n, w, h, fps, encoder)
+		for encoder in args.encoders
+		for (w, h) in [ParseResolution(r) for r in args.resolutions]
+		for fps in args.frameRates
+		for n in args.benchCams]
+
+
+def RunConfig(params, combo, args, folder_name):
+	# Camera parameters of one run, as a campy config
+	num_cams, width, height, frame_rate, encoder = combo
+	codec, make = EncoderSettings(encoder)
+	# Only settings that differ from the defaults, so the config reads like a user's
+	default_params = configurator.DefaultParams()
+	run_params = {key: value for key, value in params.items()
+		if key not in default_params or value != default_params[key]}
+	run_params.update({
+		"cameraMake": "synthetic",
+		"numCams": num_cams,
+		"cameraNames": ["Camera%s" % n for n in range(num_cams)],
+		"cameraSelection": [n for n in range(num_cams)],
+		"frameWidth": width,
+		"frameHeight": height,
+		"frameRate": frame_rate,
+		"recTimeInSec": args.durationInSec,
+		"codec": codec,
+		"gpuID": -1 if make == "cpu" else max(0, params["gpuID"]),
+		"gpuMake": params["gpuMake"] if make == "cpu" else make,
+		"videoFolder": folder_name,
+		"metricsPort": params["metricsPort"] if params["metricsPort"] > 0 else METRICS_PORT,
+		"startArduino": False,
+		# Record without a viewer process or display windows
+		"displayMode": "none",
+		})
+	run_params.pop("config", None)
+	return run_params
+
+
+def Scrape(port):
+	# Metrics of one camera process as {name: value}, or None if it is not serving (yet)
+	try:
+		with urllib.request.urlopen("http://127.0.0.1:{}/metrics".format(port), timeout=0.5) as r:
+			text = r.read().decode()
+	except Exception:
+		return None
+	values = {}
+	for line in text.splitlines():
+		if line.startswith("#") or " " not in line:
+			continue
+		name, value = line.rsplit(" ", 1)
+		values[name.split("{")[0]] = float(value)
+	return values
+
+
+def ReadMetadata(file_name):
+	# metadata.csv rows of (key, value) to a dict, with numbers parsed
+	meta = {}
+	with open(file_name, newline="") as f:
+		for row in csv.reader(f):
+			if len(row) < 2:
+				continue
+			try:
+				meta[row[0]] = ast.literal_eval(row[1])
+			except (ValueError, SyntaxError):
+				meta[row[0]] = row[1]
+	return meta
+
+
+def GrabRate(cam_folder):
+	# Frames grabbed per second of host (wall-clock) time, and how much further grabbing fell behind the
+	# camera clock from the first to the last tenth of the recording (s). Camera timestamps alone cannot
+	# show overload, since late frames keep their exposure times
+	mat = sio.loadmat(os.path.join(cam_folder, "frametimes.mat"), variable_names=["frameNumber", "timeStamp", "hostTime"])
+	frameNumber, timeStamp, hostTime = (mat[k].ravel().astype(np.float64) for k in ["frameNumber", "timeStamp", "hostTime"])
+	if len(frameNumber) < 2 or hostTime[-1] <= 0:
+		return 0.0, 0.0
+	lag = hostTime - timeStamp
+	tenth = max(1, len(lag) // 10)
+	return (frameNumber[-1] - frameNumber[0]) / hostTime[-1], float(np.median(lag[-tenth:]) - np.median(lag[:tenth]))
+
+
+def RunOne(params, combo, args, folder_name):
+	run_params = RunConfig(params, combo, args, folder_name)
+	num_cams, frame_rate = run_params["numCams"], run_params["frameRate"]
+	config_file = os.path.join(folder_name, "bench_config.yaml")
+	with open(config_file, "w") as f:
+		yaml.safe_dump(run_params, f)
+
+	cmd = [sys.executable, "-c", "from campy.campy import Main; Main()", config_file]
+	ports = [run_params["metricsPort"] + n for n in range(num_cams)]
+	samples = [[] for n in range(num_cams)]
+
+	cpu0, t0 = ChildrenCPUTime(), time.perf_counter()
+	with open(os.path.join(folder_name, "campy.log"), "w") as log:
+		proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT)
+		timeout = t0 + 3*args.durationInSec + 120
+		while proc.poll() is None:
+			if time.perf_counter() > timeout:
+				proc.kill()
+				proc.wait()
+				raise TimeoutError("campy-acquire did not stop (log: {}).".format(log.name))
+			for n, port in enumerate(ports):
+				values = Scrape(port)
+				if values is not None:
+					samples[n].append((time.perf_counter(), values))
+			time.sleep(SCRAPE_INTERVAL)
+	elapsed = time.perf_counter() - t0
+	cpu = ChildrenCPUTime() - cpu0
+	if proc.returncode != 0:
+		raise RuntimeError("campy-acquire exited with code {} (log: {}).".format(proc.returncode, log.name))
+
+	# Per camera: metadata of the recording, video size and scraped process metrics
+	fps, camera_dropped, buffer_dropped, high_water, video_bytes, rec_time = [], 0, 0, 0, 0, 0.0
+	lag_growth, cam_cpu, rss = 0.0, [], []
+	video_ext = os.path.splitext(params["videoFilename"])[1]
+	for n, camera_name in enumerate(run_params["cameraNames"]):
+		cam_folder = os.path.join(folder_name, camera_name)
+		meta = ReadMetadata(os.path.join(cam_folder, "metadata.csv"))
+		rate, lag = GrabRate(cam_folder)
+		fps.append(rate)
+		lag_growth = max(lag_growth, lag)
+		rec_time = max(rec_time, meta["totalTime"])
+		camera_dropped += meta.get("cameraDroppedFrames", 0)
+		buffer_dropped += meta.get("bufferDroppedFrames", 0)
+		high_water = max(high_water, meta.get("bufferHighWaterMark", 0))
+		video_bytes += sum(os.path.getsize(os.path.join(cam_folder, f))
+			for f in os.listdir(cam_folder) if f.endswith(video_ext))
+
+		if len(samples[n]) >= 2:
+			(ta, first), (tb, last) = samples[n][0], samples[n][-1]
+			cam_cpu.append((last["campy_process_cpu_seconds_total"] - first["campy_process_cpu_seconds_total"])
+				/ max(tb - ta, 1e-9))
+		if len(samples[n]) >= 1:
+			rss.append(max(s["campy_process_resident_memory_bytes"] for t, s in samples[n]))
+	shutil.rmtree(folder_name, ignore_errors=True)
+
+	return {
+		"numCams": num_cams,
+		"resolution": "{}x{}".format(run_params["frameWidth"], run_params["frameHeight"]),
+		"frameRate": frame_rate,
+		"encoder": combo[4],
+		"fpsMin": round(min(fps), 2),
+		"fpsMean": round(sum(fps) / len(fps), 2),
+		# A buffer that filled up, or grabbing that kept falling behind, would not last a longer recording
+		"sustained": min(fps) >= 0.99*frame_rate and camera_dropped + buffer_dropped == 0 \
+			and high_water < params["bufferSize"] - 1 and lag_growth <= MAX_LAG_GROWTH / frame_rate,
+		"grabLagGrowthMs": round(1e3*lag_growth, 1),
+		"cameraDroppedFrames": camera_dropped,
+		"bufferDroppedFrames": buffer_dropped,
+		"bufferHighWaterMark": high_water,
+		"bufferSize": params["bufferSize"],
+		# Busiest camera process (grab and, without writerProcess, write threads) and everything campy started
+		"cpuCoresPerCamera": round(max(cam_cpu), 2) if len(cam_cpu) > 0 else float('nan'),
+		"cpuCoresTotal": round(cpu / elapsed, 2),
+		"peakRssMBPerCamera": round(max(rss) / 2**20, 1) if len(rss) > 0 else float('nan'),
+		"diskWriteMBps": round(video_bytes / max(rec_time, 1e-9) / 2**20, 2),
+		}
+
+
+def SaveResults(file_name, results):
+	# JSON (with machine info) if the file name ends with .json, CSV otherwise
+	if file_name.lower().endswith(".json"):
+		with open(file_name, "w") as f:
+			json.dump({"cpuCount": os.cpu_count(), "platform": sys.platform, "runs": results}, f, indent=2)
+	else:
+		with open(file_name, "w", newline="") as f:
+			w = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+			w.writeheader()
+			w.writerows(results)
+	print("Saved results to {}.".format(file_name))
+
+
+def Main():
+	parser = ArgumentParser(description="Campy end-to-end acquisition benchmark",
+						formatter_class=ArgumentDefaultsHelpFormatter,)
+	parser.add_argument("--benchCams", dest="benchCams", type=ast.literal_eval, default=None,
+		help="Numbers of cameras to test, e.g. [1,2,4] (default: numCams).")
+	parser.add_argument("--resolutions", dest="resolutions", type=ast.literal_eval, default=None,
+		help="Frame sizes to test, e.g. ['640x480','1152x1024'] (default: frameWidth x frameHeight).")
+	parser.add_argument("--frameRates", dest="frameRates", type=ast.literal_eval, default=None,
+		help="Frame rates to test (default: frameRate).")
+	parser.add_argument("--encoders", dest="encoders", type=ast.literal_eval, default=None,
+		help="Encoders to test, e.g. ['libx264','h264_nvenc'] (default: configured codec and gpuID).")
+	parser.add_argument("--durationInSec", dest="durationInSec", type=float, default=10,
+		help="Recording time of each run.")
+	parser.add_argument("--benchOutput", dest="benchOutput", default=None,
+		help="Optional json or csv file for the results.")
+	params = configurator.ConfigureParams(parser)
+
+	# Keep benchmark arguments out of the camera parameters
+	args = parser.parse_args()
+	for key in BENCH_KEYS:
+		params.pop(key, None)
+	if args.benchCams is None:
+		args.benchCams = [params["numCams"]]
+	elif type(args.benchCams) is int:
+		args.benchCams = [args.benchCams]
+	if args.resolutions is None:
+		args.resolutions = ["{}x{}".format(params["frameWidth"], params["frameHeight"])]
+	if args.frameRates is None:
+		args.frameRates = [params["frameRate"]]
+	if args.encoders is None:
+		make = "cpu" if params["gpuID"] == -1 else params["gpuMake"]
+		args.encoders = [encoders.ENCODERS[str(params["codec"])].get(make, encoders.ENCODERS[str(params["codec"])]["cpu"])]
+
+	# Skip encoders this ffmpeg cannot use
+	if params["writerBackend"] != "raw":
+		caps = encoders.GetCapabilities()
+		for encoder in list(args.encoders):
+			EncoderSettings(encoder)
+			if not encoders.IsUsable(caps, encoder):
+				print("Encoder {} is not usable with this ffmpeg. Skipping it.".format(encoder))
+				args.encoders.remove(encoder)
+
+	combos = Combinations(args)
+	print("Benchmarking {} runs of {} s, {} CPU cores.".format(len(combos), args.durationInSec, os.cpu_count()))
+	header = "{:>4} {:>10} {:>5} {:>11} {:>8} {:>8} {:>9} {:>8} {:>8} {:>8} {:>9} {:>9} {:>8} {:>8}".format(
+		"cams", "size", "fps", "encoder", "fps min", "fps mean", "sustained", "lag ms", "cam drop", "buf drop",
+		"buf peak", "cores/cam", "cores", "MB/s")
+	print(header)
+
+	results = []
+	for combo in combos:
+		folder_name = tempfile.mkdtemp(prefix="campy_bench_")
+		try:
+			r = RunOne(params, combo, args, folder_name)
+		except Exception as e:
+			logging.error("Caught exception at bench/acquire.py {}: {}".format(combo, e))
+			continue
+		results.append(r)
+		print("{:>4} {:>10} {:>5} {:>11} {:>8.1f} {:>8.1f} {:>9} {:>8.1f} {:>8} {:>8} {:>9} {:>9.2f} {:>8.2f} {:>8.1f}".format(
+			r["numCams"], r["resolution"], r["frameRate"], r["encoder"], r["fpsMin"], r["fpsMean"],
+			"yes" if r["sustained"] else "no", r["grabLagGrowthMs"], r["cameraDroppedFrames"], r["bufferDroppedFrames"],
+			"{}/{}".format(r["bufferHighWaterMark"], r["bufferSize"]), r["cpuCoresPerCamera"],
+			r["cpuCoresTotal"], r["diskWriteMBps"]))
+
+	if args.benchOutput is not None and len(results) > 0:
+		SaveResults(args.benchOutput, results)
+
+
+if __name__ == "__main__":
+	Main()
@@ -0,0 +1,172 @@
+"""
+Encoder throughput benchmark ("campy-bench-encode") over codec x preset x quality x pixel format,
+with numCams simultaneous streams per combination.
+
+Usage:
+campy-bench-encode ./configs/campy_config.yaml --presets "['ultrafast','veryfast','fast']" \
+	--qualities "[17,21]" --pixelFormats "['rgb24','bayer_rggb8']" --benchCams 6 --numFrames 300
+"""
+
+import os, ast, csv, time, shutil, tempfile, threading, logging
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import numpy as np
+from campy import configurator, encoders, ringbuffer, writer
+from campy.cameras.synthetic import SyntheticFrames, MaxValue
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+
+def ChildrenCPUTime():
+	if resource is None:
+		return float('nan')
+	r = resource.getrusage(resource.RUSAGE_CHILDREN)
+	return r.ru_utime + r.ru_stime
+
+
+def Combinations(params, args, caps):
+	# (gpuMake or 'cpu', codec, preset, quality, pixelFormatInput) available on this machine
+	combos = []
+	for codec in encoders.ENCODERS:
+		for make in ["cpu"] + encoders.GPU_MAKES:
+			if not encoders.IsUsable(caps, encoders.ENCODERS[codec][make]):
+				continue
+			presets = args.presets if make == "cpu" else [params["preset"]]
+			for preset in presets:
+				for quality in args.qualities:
+					for pix_fmt in args.pixelFormats:
+						if pix_fmt in caps["pixelFormats"]["input"]:
+							combos.append((make, codec, str(preset), quality, pix_fmt))
+	return combos
+
+
+def RunOne(params, combo, args, folder_name):
+	make, codec, preset, quality, pix_fmt = combo
+	streams = []
+	for n in range(args.benchCams):
+		cam_params = configurator.ConfigureStreamParams(params, n % params["numCams"])
+		cam_params["codec"] = codec
+		cam_params["preset"] = preset
+		cam_params["quality"] = quality
+		cam_params["pixelFormatInput"] = pix_fmt
+		cam_params["gpuID"] = -1 if make == "cpu" else max(0, cam_params["gpuID"])
+		cam_params["gpuMake"] = cam_params["gpuMake"] if make == "cpu" else make
+		cam_params["variableFrameRate"] = False
+		if cam_params["writerBackend"] == "raw":
+			cam_params["writerBackend"] = "pipe"
+		streams.append(cam_params)
+
+	shape, dtype = ringbuffer.FrameShape(streams[0])
+	frames = SyntheticFrames(shape, dtype, max_value=MaxValue(pix_fmt, dtype))
+	fps = [0.0]*len(streams)
+	files = []
+
+	def Feed(n, video_writer):
+		t0 = time.perf_counter()
+		for i in range(args.numFrames):
+			video_writer.send(frames[i % len(frames)])
+		video_writer.close()
+		fps[n] = args.numFrames / (time.perf_counter() - t0)
+
+	cpu0, t0 = ChildrenCPUTime(), time.perf_counter()
+	threads = []
+	for n, cam_params in enumerate(streams):
+		file_name = os.path.join(folder_name, "bench{}.mp4".format(n))
+		files.append(file_name)
+		video_writer = writer.OpenEncoder(cam_params, file_name)
+		threads.append(threading.Thread(target=Feed, args=(n, video_writer)))
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	elapsed = time.perf_counter() - t0
+	cpu = ChildrenCPUTime() - cpu0
+
+	size = np.mean([os.path.getsize(f) for f in files if os.path.isfile(f)])
+	for f in files:
+		if os.path.isfile(f):
+			os.remove(f)
+
+	frame_rate = params["frameRate"]
+	cpu_per_frame = cpu / (args.numFrames*len(streams))
+	return {
+		"encoder": encoders.ENCODERS[codec][make],
+		"preset": preset,
+		"quality": quality,
+		"pixelFormatInput": pix_fmt,
+		"streams": len(streams),
+		"fpsPerStream": min(fps),
+		"cpuCores": cpu / elapsed,
+		"mbpsPerStream": size*8 / (args.numFrames / frame_rate) / 1e6,
+		"sustained": min(fps) >= frame_rate,
+		# Estimate of cameras this machine can encode at frameRate from CPU cost alone
+		"maxCamsByCPU": int((os.cpu_count() or 1) / max(cpu_per_frame*frame_rate, 1e-9)),
+		}
+
+
+def Main():
+	parser = ArgumentParser(description="Campy encoder benchmark",
+						formatter_class=ArgumentDefaultsHelpFormatter,)
+	parser.add_argument("--presets", dest="presets", type=ast.literal_eval,
+		default=["ultrafast", "superfast", "veryfast", "faster", "fast"],
+		help="CPU encoder presets to test. GPU encoders use the configured preset.")
+	parser.add_argument("--qualities", dest="qualities", type=ast.literal_eval, default=[17, 21, 25],
+		help="Quality values (crf/qp) to test.")
+	parser.add_argument("--pixelFormats", dest="pixelFormats", type=ast.literal_eval, default=None,
+		help="Input pixel formats to test (default: configured pixelFormatInput).")
+	parser.add_argument("--benchCams", dest="benchCams", type=int, default=None,
+		help="Number of simultaneous streams (default: numCams).")
+	parser.add_argument("--numFrames", dest="numFrames", type=int, default=300,
+		help="Frames encoded per stream for each combination.")
+	parser.add_argument("--benchOutput", dest="benchOutput", default=None,
+		help="Optional csv file for the results table.")
+	params = configurator.ConfigureParams(parser)
+
+	# Keep benchmark arguments out of the camera parameters
+	args = parser.parse_args()
+	for key in ["presets", "qualities", "pixelFormats", "benchCams", "numFrames", "benchOutput"]:
+		params.pop(key, None)
+	if args.pixelFormats is None:
+		args.pixelFormats = [params["pixelFormatInput"]] if type(params["pixelFormatInput"]) is str \
+			else list(set(params["pixelFormatInput"]))
+	if args.benchCams is None:
+		args.benchCams = params["numCams"]
+
+	caps = encoders.GetCapabilities()
+	combos = Combinations(params, args, caps)
+	print("Benchmarking {} combinations, {} streams of {}x{} at {} fps target, {} CPU cores."\
+		.format(len(combos), args.benchCams, params["frameWidth"], params["frameHeight"],
+			params["frameRate"], os.cpu_count()))
+
+	header = "{:>11} {:>10} {:>4} {:>12} {:>10} {:>6} {:>9} {:>9} {:>8}".format(
+		"encoder", "preset", "q", "pix_fmt", "fps/stream", "cores", "Mbps/strm", "sustained", "max cams")
+	print(header)
+
+	folder_name = tempfile.mkdtemp(prefix="campy_bench_")
+	results = []
+	try:
+		for combo in combos:
+			try:
+				r = RunOne(params, combo, args, folder_name)
+			except Exception as e:
+				logging.error("Caught exception at bench/encode.py {}: {}".format(combo, e))
+				continue
+			results.append(r)
+			print("{:>11} {:>10} {:>4} {:>12} {:>10.1f} {:>6.1f} {:>9.2f} {:>9} {:>8}".format(
+				r["encoder"], r["preset"], r["quality"], r["pixelFormatInput"], r["fpsPerStream"],
+				r["cpuCores"], r["mbpsPerStream"], "yes" if r["sustained"] else "no", r["maxCamsByCPU"]))
+	finally:
+		shutil.rmtree(folder_name, ignore_errors=True)
+
+	if args.benchOutput is not None and len(results) > 0:
+		with open(args.benchOutput, "w", newline="") as f:
+			w = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+			w.writeheader()
+			w.writerows(results)
+		print("Saved results to {}.".format(args.benchOutput))
+
+
+if __name__ == "__main__":
+	Main()
@@ -0,0 +1,127 @@
+"""
+Benchmark of the grab loop: polling (grabTimeoutInMs 0) vs. blocking grab with timeout, with unicam.GrabFrames
+and synthetic cameras (or emulated cameras replaying --emuVideo). Reports CPU time per grab thread and grab latency.
+
+Usage:
+python -m campy.bench.grab --numCams 6 --frameRate 100 --durationInSec 10
+"""
+
+import os, shutil, tempfile, threading, time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import numpy as np
+from campy import configurator, ringbuffer, affinity
+from campy.cameras import unicam
+
+
+def CamParams(args, n_cam, mode, folder_name):
+	# Camera parameters of one grab thread, from campy's defaults
+	params = configurator.DefaultParams()
+	params.update({
+		"cameraMake": "emu" if args.emuVideo else "synthetic",
+		"numCams": args.numCams,
+		"cameraNames": ["Camera%s" % n for n in range(args.numCams)],
+		"frameWidth": args.frameWidth,
+		"frameHeight": args.frameHeight,
+		"frameRate": args.frameRate,
+		"recTimeInSec": args.durationInSec,
+		"videoFolder": folder_name,
+		"displayFrameRate": 0,
+		"frameJournal": False,
+		"grabTimeoutInMs": 0 if mode == "poll" else args.grabTimeoutInMs,
+		})
+	cam_params = configurator.ConfigureStreamParams(params, n_cam)
+	cam_params["cameraSerialNo"] = "SYN{:04d}".format(n_cam)
+	cam_params = affinity.PlaceCamera(cam_params)
+
+	# Frame times are saved to the camera folder (made by the writer in campy).
+	# Emulated cameras replay the video from there
+	camera_folder = os.path.join(folder_name, cam_params["cameraName"])
+	os.makedirs(camera_folder, exist_ok=True)
+	if args.emuVideo:
+		shutil.copy(args.emuVideo, os.path.join(camera_folder, "0.mp4"))
+		cam_params["videoFilename"] = "em_0.mp4"
+	return cam_params
+
+
+def GrabThread(cam_params, writeQueue, opened, cpu):
+	# Run the grab loop as campy does, and record this thread's CPU time
+	t0 = time.thread_time()
+	try:
+		unicam.GrabFrames(cam_params, writeQueue, [], [], [], opened=opened)
+	finally:
+		writeQueue.close()
+	cpu.append(time.thread_time() - t0)
+
+
+def WriteThread(writeQueue, latencies):
+	# Release frames as soon as they are queued, recording the time from exposure to host receive
+	while(True):
+		img = writeQueue.get(timeout=0.5)
+		if img is None:
+			if writeQueue.closed:
+				break
+			continue
+		latencies.append(writeQueue.hostTime - writeQueue.timeStamp)
+		writeQueue.release()
+
+
+def RunOne(mode, args):
+	folder_name = tempfile.mkdtemp(prefix="campy_grab_")
+	latencies, cpu, cameraDropped, threads = [], [], [], []
+	try:
+		cams = [CamParams(args, n, mode, folder_name) for n in range(args.numCams)]
+		for cam_params in cams:
+			# Open the camera first, as campy does, so the frame buffer fits the emulated video
+			opened = unicam.OpenCamera(cam_params, [])
+			shape, dtype = ringbuffer.FrameShape(opened[2])
+			writeQueue = ringbuffer.FrameRing(shape, dtype, cam_params["bufferSize"], "dropNewest")
+			threads.append(threading.Thread(target=GrabThread, args=(cam_params, writeQueue, opened, cpu),
+				daemon=True))
+			threads.append(threading.Thread(target=WriteThread, args=(writeQueue, latencies), daemon=True))
+		start = time.perf_counter()
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		wallTime = time.perf_counter() - start
+		cameraDropped = [cam_params.get("cameraDroppedFrames", 0) for cam_params in cams]
+	finally:
+		shutil.rmtree(folder_name, ignore_errors=True)
+
+	latencies = np.array(latencies) * 1e3
+	return {
+		"mode": mode,
+		"grabTimeoutInMs": cams[0]["grabTimeoutInMs"],
+		"framesGrabbed": len(latencies),
+		"cameraDroppedFrames": int(np.sum(cameraDropped)),
+		"latencyMedianMs": np.median(latencies) if len(latencies) else float('nan'),
+		"latency99Ms": np.percentile(latencies, 99) if len(latencies) else float('nan'),
+		"cpuPerGrabThreadPercent": 100 * np.mean(cpu) / wallTime,
+		}
+
+
+def Main():
+	parser = ArgumentParser(description="Campy grab loop benchmark",
+						formatter_class=ArgumentDefaultsHelpFormatter,)
+	parser.add_argument("--numCams", type=int, default=6, help="Number of cameras.")
+	parser.add_argument("--frameRate", type=float, default=100, help="Frame rate of each camera.")
+	parser.add_argument("--frameWidth", type=int, default=640, help="Width of synthetic frames.")
+	parser.add_argument("--frameHeight", type=int, default=480, help="Height of synthetic frames.")
+	parser.add_argument("--durationInSec", type=float, default=10, help="Duration of each run.")
+	parser.add_argument("--grabTimeoutInMs", type=int, default=100, help="Timeout of the blocking grab.")
+	parser.add_argument("--emuVideo", default=None, help="Replay this video with emulated cameras instead.")
+	args = parser.parse_args()
+
+	print("{} {} cameras at {} fps for {} s.".format(args.numCams, "emulated" if args.emuVideo else "synthetic",
+		args.frameRate, args.durationInSec))
+	print("{:>6} {:>12} {:>8} {:>10} {:>14} {:>12} {:>18}".format(
+		"mode", "timeout (ms)", "frames", "cam drop", "median (ms)", "p99 (ms)", "CPU/grab thread (%)"))
+	for mode in ["poll", "block"]:
+		r = RunOne(mode, args)
+		print("{:>6} {:>12} {:>8} {:>10} {:>14.3f} {:>12.3f} {:>18.2f}".format(
+			r["mode"], r["grabTimeoutInMs"], r["framesGrabbed"], r["cameraDroppedFrames"],
+			r["latencyMedianMs"], r["latency99Ms"], r["cpuPerGrabThreadPercent"]))
+
+
+if __name__ == "__main__":
+	Main()
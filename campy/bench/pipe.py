@@ -0,0 +1,93 @@
+"""
+Benchmark of the writer backends ('imageio' vs 'pipe'): sustained fps and CPU time per frame.
+
+Usage:
+python -m campy.bench.pipe --frameWidth 1152 --frameHeight 1024 --pixelFormatInput rgb24 --numFrames 1000
+"""
+
+import os, time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import numpy as np
+from imageio_ffmpeg import write_frames
+from campy import pipewriter, ringbuffer
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+
+def ChildrenCPUTime():
+	if resource is None:
+		return float('nan')
+	r = resource.getrusage(resource.RUSAGE_CHILDREN)
+	return r.ru_utime + r.ru_stime
+
+
+def OpenBackend(backend, args, frames_per_write):
+	size = [args.frameWidth, args.frameHeight]
+	output_params = ["-f", "null"]
+	if backend == "imageio":
+		writer = write_frames(os.devnull, size, fps=args.frameRate, quality=None, codec=args.codec,
+				pix_fmt_in=args.pixelFormatInput, pix_fmt_out=args.pixelFormatOutput,
+				ffmpeg_log_level="error", input_params=["-an"], output_params=output_params,
+				macro_block_size=1)
+		writer.send(None)
+	else:
+		writer = pipewriter.OpenPipeWriter(os.devnull, size, args.frameRate, args.codec,
+				args.pixelFormatInput, args.pixelFormatOutput, "error", [], output_params,
+				pipe_size=int(args.pipeBufferSizeInMB*1e6), frames_per_write=frames_per_write)
+	return writer
+
+
+def RunOne(backend, args, frames_per_write=1):
+	shape, dtype = ringbuffer.FrameShape({
+		"pixelFormatInput": args.pixelFormatInput,
+		"frameWidth": args.frameWidth,
+		"frameHeight": args.frameHeight})
+	frames = np.random.randint(0, 255, (8,) + shape).astype(dtype)
+
+	writer = OpenBackend(backend, args, frames_per_write)
+	cpu0, child0, t0 = time.process_time(), ChildrenCPUTime(), time.perf_counter()
+	for f in range(args.numFrames):
+		writer.send(frames[f % len(frames)])
+	writer.close()
+	t1, cpu1, child1 = time.perf_counter(), time.process_time(), ChildrenCPUTime()
+
+	return {
+		"backend": backend if backend == "imageio" else "pipe x{}".format(frames_per_write),
+		"fps": args.numFrames / (t1 - t0),
+		"pythonCPUPerFrameMs": 1e3 * (cpu1 - cpu0) / args.numFrames,
+		"ffmpegCPUPerFrameMs": 1e3 * (child1 - child0) / args.numFrames,
+		}
+
+
+def Main():
+	parser = ArgumentParser(description="Campy writer backend benchmark",
+						formatter_class=ArgumentDefaultsHelpFormatter,)
+	parser.add_argument("--frameWidth", type=int, default=1152)
+	parser.add_argument("--frameHeight", type=int, default=1024)
+	parser.add_argument("--pixelFormatInput", default="rgb24")
+	parser.add_argument("--pixelFormatOutput", default="rgb24")
+	parser.add_argument("--codec", default="rawvideo")
+	parser.add_argument("--frameRate", type=float, default=100)
+	parser.add_argument("--numFrames", type=int, default=1000)
+	parser.add_argument("--pipeBufferSizeInMB", type=float, default=8)
+	parser.add_argument("--framesPerWrite", type=int, default=4,
+		help="Coalescing factor tested in addition to 1.")
+	args = parser.parse_args()
+
+	print("{} frames of {}x{} {}, codec {}.".format(
+		args.numFrames, args.frameWidth, args.frameHeight, args.pixelFormatInput, args.codec))
+	print("{:>10} {:>10} {:>18} {:>18}".format("backend", "fps", "Python CPU/frame", "ffmpeg CPU/frame"))
+	runs = [("imageio", 1), ("pipe", 1)]
+	if args.framesPerWrite > 1:
+		runs.append(("pipe", args.framesPerWrite))
+	for backend, frames_per_write in runs:
+		r = RunOne(backend, args, frames_per_write)
+		print("{:>10} {:>10.1f} {:>15.3f} ms {:>15.3f} ms".format(
+			r["backend"], r["fps"], r["pythonCPUPerFrameMs"], r["ffmpegCPUPerFrameMs"]))
+
+
+if __name__ == "__main__":
+	Main()
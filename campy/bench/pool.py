@@ -0,0 +1,103 @@
+"""
+Benchmark of per-frame memory allocation in the grab path: new array per frame vs. copy into a reserved slot.
+
+Usage:
+python -m campy.bench.pool --frameWidth 1152 --frameHeight 1024 --numFrames 2000
+"""
+
+import time, threading, tracemalloc
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import deque
+import numpy as np
+from campy import ringbuffer
+
+
+def Consumer(mode, writeQueue, stop):
+	# Writer stand-in, releasing frames as soon as they arrive
+	while True:
+		if mode == "alloc":
+			if writeQueue:
+				writeQueue.popleft()
+			elif stop:
+				break
+			else:
+				time.sleep(0.0005)
+		else:
+			img = writeQueue.get(timeout=0.1)
+			if img is not None:
+				writeQueue.release()
+			elif writeQueue.closed:
+				break
+
+
+def RunOne(mode, shape, numFrames, warmupFrames=100):
+	# Camera API buffers, reused by the "driver" like a real grab engine
+	sdk_buffers = [np.full(shape, i, dtype=np.uint8) for i in range(8)]
+	stop = deque([], 1)
+	if mode == "alloc":
+		writeQueue = deque()
+	else:
+		writeQueue = ringbuffer.FrameRing(shape, np.uint8, 32, "block")
+	t = threading.Thread(target=Consumer, args=(mode, writeQueue, stop), daemon=True)
+	t.start()
+
+	def Grab(f):
+		sdk_img = sdk_buffers[f % len(sdk_buffers)]
+		if mode == "alloc":
+			writeQueue.append(sdk_img.copy())
+		else:
+			buf = writeQueue.reserve()
+			if buf is not None:
+				np.copyto(buf, sdk_img)
+				writeQueue.commit(float(f), f)
+
+	for f in range(warmupFrames):
+		Grab(f)
+
+	# Time per frame, without tracing
+	t0 = time.perf_counter()
+	for f in range(numFrames):
+		Grab(f)
+	elapsed = time.perf_counter() - t0
+
+	# Count frames whose grab allocated a frame-sized block (traced peak jumps by >= half a frame)
+	frame_bytes = int(np.prod(shape))
+	num_allocating = 0
+	tracemalloc.start()
+	for f in range(numFrames):
+		tracemalloc.reset_peak()
+		current = tracemalloc.get_traced_memory()[0]
+		Grab(f)
+		if tracemalloc.get_traced_memory()[1] - current >= frame_bytes // 2:
+			num_allocating += 1
+	tracemalloc.stop()
+
+	stop.append("STOP")
+	if mode != "alloc":
+		writeQueue.close()
+	t.join()
+	return {
+		"mode": mode,
+		"frameAllocationsPerFrame": num_allocating / numFrames,
+		"usPerFrame": 1e6*elapsed / numFrames,
+		}
+
+
+def Main():
+	parser = ArgumentParser(description="Campy frame buffer allocation benchmark",
+						formatter_class=ArgumentDefaultsHelpFormatter,)
+	parser.add_argument("--frameWidth", type=int, default=1152, help="Frame width in pixels.")
+	parser.add_argument("--frameHeight", type=int, default=1024, help="Frame height in pixels.")
+	parser.add_argument("--numFrames", type=int, default=2000, help="Frames grabbed per run.")
+	args = parser.parse_args()
+
+	shape = (args.frameHeight, args.frameWidth, 3)
+	print("{} frames of {}.".format(args.numFrames, shape))
+	print("{:>6} {:>22} {:>14}".format("mode", "frame allocs/frame", "us/frame"))
+	for mode in ["alloc", "pool"]:
+		r = RunOne(mode, shape, args.numFrames)
+		print("{:>6} {:>22.3f} {:>14.1f}".format(r["mode"], r["frameAllocationsPerFrame"], r["usPerFrame"]))
+
+
+if __name__ == "__main__":
+	Main()
@@ -0,0 +1,111 @@
+"""
+Benchmark of the grab -> write handoff: polling loop vs. blocking frame buffer (wake-up latency, idle CPU time).
+
+Usage:
+python -m campy.bench.wakeup --frameRate 100 --numFrames 500 --idleTimeInSec 5 --numCams 6
+"""
+
+import time, threading
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from collections import deque
+import numpy as np
+from campy import ringbuffer
+
+
+def PollConsumer(writeQueue, stopWriteQueue, latencies, cpu):
+	# Copy of the writer loop before the blocking frame buffer
+	t0 = time.thread_time()
+	while(True):
+		if writeQueue:
+			timeQueued, img = writeQueue.popleft()
+			latencies.append(time.perf_counter() - timeQueued)
+		else:
+			if stopWriteQueue:
+				break
+			time.sleep(0.01)
+	cpu.append(time.thread_time() - t0)
+
+
+def RingConsumer(writeQueue, stopWriteQueue, latencies, cpu):
+	t0 = time.thread_time()
+	while(True):
+		img = writeQueue.get(timeout=0.5)
+		if img is not None:
+			latencies.append(time.perf_counter() - img[0])
+			writeQueue.release()
+		elif stopWriteQueue or writeQueue.closed:
+			break
+	cpu.append(time.thread_time() - t0)
+
+
+def RunOne(mode, numCams, frameRate, numFrames, idleTimeInSec):
+	shape = (16,)
+	queues, stops, threads = [], [], []
+	latencies, cpu = [], []
+	for n in range(numCams):
+		stop = deque([], 1)
+		if mode == "poll":
+			q = deque()
+			target = PollConsumer
+		else:
+			q = ringbuffer.FrameRing(shape, "float64", 64, "block")
+			target = RingConsumer
+		t = threading.Thread(target=target, args=(q, stop, latencies, cpu), daemon=True)
+		t.start()
+		queues.append(q); stops.append(stop); threads.append(t)
+
+	# Idle phase: consumers wait with nothing to do
+	time.sleep(idleTimeInSec)
+
+	# Active phase: send timestamped frames at frameRate to every camera queue
+	img = np.zeros(shape)
+	nextTime = time.perf_counter()
+	for f in range(numFrames):
+		nextTime += 1 / frameRate
+		while time.perf_counter() < nextTime:
+			time.sleep(max(0, nextTime - time.perf_counter() - 0.001))
+		for q in queues:
+			img[0] = time.perf_counter()
+			if mode == "poll":
+				q.append((img[0], img))
+			else:
+				q.put(img)
+
+	for q, stop in zip(queues, stops):
+		stop.append("STOP")
+		if mode != "poll":
+			q.close()
+	for t in threads:
+		t.join()
+
+	latencies = np.array(latencies) * 1e3
+	return {
+		"mode": mode,
+		"latencyMedianMs": np.median(latencies),
+		"latency99Ms": np.percentile(latencies, 99),
+		"latencyMaxMs": latencies.max(),
+		"cpuPerCamMs": 1e3 * np.sum(cpu) / numCams,
+		}
+
+
+def Main():
+	parser = ArgumentParser(description="Campy writer wake-up benchmark",
+						formatter_class=ArgumentDefaultsHelpFormatter,)
+	parser.add_argument("--numCams", type=int, default=6, help="Number of simulated camera streams.")
+	parser.add_argument("--frameRate", type=float, default=100, help="Frame rate of each stream.")
+	parser.add_argument("--numFrames", type=int, default=500, help="Frames sent to each stream.")
+	parser.add_argument("--idleTimeInSec", type=float, default=5, help="Idle time before frames are sent.")
+	args = parser.parse_args()
+
+	print("{} streams at {} fps, {} frames, {} s idle.".format(
+		args.numCams, args.frameRate, args.numFrames, args.idleTimeInSec))
+	print("{:>6} {:>14} {:>12} {:>12} {:>14}".format(
+		"mode", "median (ms)", "p99 (ms)", "max (ms)", "CPU/cam (ms)"))
+	for mode in ["poll", "block"]:
+		r = RunOne(mode, args.numCams, args.frameRate, args.numFrames, args.idleTimeInSec)
+		print("{:>6} {:>14.3f} {:>12.3f} {:>12.3f} {:>14.1f}".format(
+			r["mode"], r["latencyMedianMs"], r["latency99Ms"], r["latencyMaxMs"], r["cpuPerCamMs"]))
+
+
+if __name__ == "__main__":
+	Main()
@@ -73,9 +73,22 @@ def StartGrabbing(camera):
 		return False
 
 
-def GrabFrame(camera, frameNumber):
+class ImageNotCompleteException(Exception):
+	def __init__(self, error_code, message):
+		self.error_code = error_code
+		self.message = message
 
-	return camera.RetrieveResult(0, pylon.TimeoutHandling_ThrowException)
+
+def GrabFrame(camera, frameNumber, timeout):
+	# Wait up to timeout (ms) for the next frame. Returns None on timeout
+	grabResult = camera.RetrieveResult(int(timeout), pylon.TimeoutHandling_Return)
+	if not grabResult.IsValid():
+		return None
+	if not grabResult.GrabSucceeded():
+		error_code, message = grabResult.GetErrorCode(), grabResult.GetErrorDescription()
+		grabResult.Release()
+		raise ImageNotCompleteException(error_code, message)
+	return grabResult
 
 
 def GetImageArray(grabResult):
@@ -83,11 +96,24 @@ def GetImageArray(grabResult):
 	return grabResult.Array
 
 
+def CopyImageArray(grabResult, out):
+	# Copy frame from the grab buffer into out, without an intermediate numpy array
+	with grabResult.GetArrayZeroCopy() as img:
+		out[...] = img
+
+
 def GetTimeStamp(grabResult):
 
 	return grabResult.TimeStamp*1e-9
 
 
+def GetFrameID(grabResult):
+	# Frame counter of the camera stream (GigE cameras wrap around at 65535)
+	# -1 if the transport layer does not provide block IDs
+	block_id = grabResult.BlockID
+	return block_id if block_id < 2**63 else -1
+
+
 def DisplayImage(cam_params, dispQueue, grabResult):
 	# Basler display window is more performant than generic matplot figure
 	if sys.platform == 'win32':
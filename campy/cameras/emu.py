@@ -1,30 +1,141 @@
 """
-
+Camera emulation from recorded videos (cameraMake: "emu").
+Replays "<videoFolder>/<cameraName>/<videoFilename without its first 3 characters>", e.g.
+videoFilename "em_0.mp4" replays "0.mp4". The video is decoded sequentially in a background
+thread into a buffer of emuPrefetchFrames frames, so long files replay without seeking, and
+frames are released according to emuTiming:
+	* "rate": at frameRate (default)
+	* "timestamps": at the original camera timestamps from frametimes.npy next to the video
+	* "fast": as fast as they are decoded, for offline re-processing (use overflowPolicy "block")
+Acquisition stops at the end of the video.
 """
 
-from campy.cameras import unicam
-import os
-import time
-import logging
-import sys
+import os, time, queue, threading, logging
 import numpy as np
-from collections import deque
-import csv
 import imageio
 
+TIMING_MODES = ["rate", "timestamps", "fast"]
+
+
+class EmuCamera(object):
+	'''
+	Usage:
+	camera = EmuCamera(file_name, frameRate, timing, timeStamps, prefetch)
+	camera.Start()
+	grabResult = camera.Grab(timeout) # GrabResult, or None on timeout or end of video
+	camera.ended # True once all frames were released
+	camera.close()
+	'''
+	def __init__(self, file_name, frame_rate, timing="rate", time_stamps=None, prefetch=16):
+		if timing not in TIMING_MODES:
+			raise ValueError("emuTiming must be one of {}.".format(TIMING_MODES))
+		self.reader = imageio.get_reader(file_name)
+		self.size = self.reader.get_meta_data()["size"]
+		self.period = 1 / frame_rate
+		self.timing = timing
+		self.timeStamps = time_stamps
+
+		self.frames = queue.Queue(max(1, int(prefetch)))
+		self.stopping = threading.Event()
+		self.next = None
+		self.ended = False
+		self.startTime = None
+		self.frameID = 0
+
+		# Start decoding now, so the buffer is full when grabbing starts
+		self.thread = threading.Thread(target=self.Decode, daemon=True)
+		self.thread.start()
+
+	def Decode(self):
+		# Decode frames in order into the bounded buffer. None marks the end of the video
+		try:
+			for img in self.reader:
+				if not self.Put(img):
+					return
+		except Exception as e:
+			logging.error("Caught exception at cameras/emu.py Decode: {}".format(e))
+		self.Put(None)
+
+	def Put(self, img):
+		while not self.stopping.is_set():
+			try:
+				self.frames.put(img, timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def Start(self):
+		self.startTime = time.perf_counter()
+
+	def DueTime(self, frameID):
+		# Host time at which frame frameID (1-based) is released
+		if self.timing == "timestamps":
+			n = len(self.timeStamps)
+			if frameID <= n:
+				return self.startTime + self.timeStamps[frameID - 1]
+			# Past the recorded timestamps, continue at the recorded mean rate
+			period = self.timeStamps[-1] / max(n - 1, 1) if n > 1 else self.period
+			return self.startTime + self.timeStamps[-1] + (frameID - n)*period
+		return self.startTime + (frameID - 1)*self.period
+
+	def Grab(self, timeout):
+		if self.startTime is None:
+			self.Start()
+		deadline = time.perf_counter() + timeout
+		if self.next is None:
+			if self.ended:
+				time.sleep(timeout)
+				return None
+			try:
+				self.next = self.frames.get(timeout=timeout)
+			except queue.Empty:
+				return None
+			if self.next is None:
+				self.ended = True
+				return None
+
+		if self.timing == "fast":
+			timeStamp = time.perf_counter()
+		else:
+			timeStamp = self.DueTime(self.frameID + 1)
+			if timeStamp > deadline:
+				time.sleep(max(0.0, deadline - time.perf_counter()))
+				return None
+			time.sleep(max(0.0, timeStamp - time.perf_counter()))
+
+		self.frameID += 1
+		grabResult = GrabResult(self.next, timeStamp, self.frameID)
+		self.next = None
+		return grabResult
+
+	def close(self):
+		self.stopping.set()
+		self.thread.join()
+		self.reader.close()
+
+
+class GrabResult(object):
+
+	def __init__(self, image, timeStamp, frameID):
+		self.image = image
+		self.timeStamp = timeStamp
+		self.frameID = frameID
+
+
 def LoadSystem(params):
 
 	return params["cameraMake"]
 
 
 def GetDeviceList(system):
-
-	return system
+	# Enough devices for any cameraSelection
+	return ["EMU{:04d}".format(n) for n in range(64)]
 
 
-def LoadDevice(cam_params):
+def LoadDevice(systems, params, cam_params):
 
-	return cam_params["device"]
+	return cam_params
 
 
 def GetSerialNumber(device):
@@ -37,18 +148,39 @@ def GetModelName(camera):
 	return "Emulated_Camera"
 
 
-def OpenCamera(cam_params, device):
+def LoadTimeStamps(folder_name):
+	# Recorded camera timestamps (seconds from the first frame), from frametimes.npy
+	file_name = os.path.join(folder_name, "frametimes.npy")
+	if not os.path.isfile(file_name):
+		raise FileNotFoundError("emuTiming 'timestamps' needs {}.".format(file_name))
+	timeStamps = np.load(file_name)[1].astype(np.float64)
+	return timeStamps - timeStamps[0]
+
+
+def OpenCamera(cam_params):
 	# Open video reader for emulation
+	folder_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"])
 	videoFileName = cam_params["videoFilename"][3:len(cam_params["videoFilename"])]
-	full_file_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"], videoFileName)
-	camera = imageio.get_reader(full_file_name)
+	full_file_name = os.path.join(folder_name, videoFileName)
+
+	# Load the recording's timestamps now, before this recording saves its own frametimes.npy
+	timeStamps = None
+	if cam_params["emuTiming"] == "timestamps":
+		timeStamps = LoadTimeStamps(folder_name)
+
+	camera = EmuCamera(
+		full_file_name,
+		cam_params["frameRate"],
+		cam_params["emuTiming"],
+		timeStamps,
+		cam_params["emuPrefetchFrames"])
 
 	# Set features manually or automatically, depending on configuration
-	frame_size = camera.get_meta_data()['size']
-	cam_params['frameWidth'] = frame_size[0]
-	cam_params['frameHeight'] = frame_size[1]
+	cam_params['frameWidth'] = camera.size[0]
+	cam_params['frameHeight'] = camera.size[1]
+	cam_params["cameraModel"] = GetModelName(camera)
 
-	print("Opened {} emulation.".format(cam_params["cameraName"]))
+	print("Opened {} emulation ({} timing).".format(cam_params["cameraName"], cam_params["emuTiming"]))
 	return camera, cam_params
 
 
@@ -58,28 +190,43 @@ def LoadSettings(cam_params, camera):
 
 
 def StartGrabbing(camera):
-
+	camera.Start()
 	return True
 
 
-def GrabFrame(camera, frameNumber):
+def GrabFrame(camera, frameNumber, timeout):
+	# Wait up to timeout (ms) for the next frame. Returns None on timeout and at the end of the video
+	return camera.Grab(timeout*1e-3)
 
-	return camera.get_data(frameNumber)
+
+def EndOfStream(camera):
+	# All frames of the video were released
+	return camera.ended
 
 
 def GetImageArray(grabResult):
 
-	return grabResult
+	return grabResult.image
+
+
+def CopyImageArray(grabResult, out):
+
+	out[...] = grabResult.image
 
 
 def GetTimeStamp(grabResult):
 
-	return time.perf_counter()
+	return grabResult.timeStamp
+
+
+def GetFrameID(grabResult):
+	# Frame index in the video + 1, never has gaps
+	return grabResult.frameID
 
 
 def DisplayImage(cam_params, dispQueue, grabResult):
 	# Downsample image
-	img = grabResult[::cam_params["displayDownsample"],::cam_params["displayDownsample"],:]
+	img = grabResult.image[::cam_params["displayDownsample"],::cam_params["displayDownsample"]]
 
 	# Send to display queue
 	dispQueue.append(img)
@@ -93,7 +240,7 @@ def ReleaseFrame(grabResult):
 def CloseCamera(cam_params, camera):
 	print('Closing {}... Please wait.'.format(cam_params["cameraName"]))
 	# Close camera after acquisition stops
-	del camera
+	camera.close()
 
 
 def CloseSystem(system, device_list):
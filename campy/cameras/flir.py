@@ -109,8 +109,14 @@ def StartGrabbing(camera):
 		return False
 
 
-def GrabFrame(camera, frameNumber):
-	image_result = camera.GetNextImage()
+def GrabFrame(camera, frameNumber, timeout):
+	# Wait up to timeout (ms) for the next frame. Returns None on timeout
+	try:
+		image_result = camera.GetNextImage(int(timeout))
+	except PySpin.SpinnakerException as e:
+		if getattr(e, "errorcode", None) == PySpin.SPINNAKER_ERR_TIMEOUT:
+			return None
+		raise
 
 	#  Ensure image completion
 	if image_result.IsIncomplete():
@@ -126,14 +132,19 @@ def GetImageArray(grabResult):
 	return grabResult.GetNDArray()
 
 
+def CopyImageArray(grabResult, out):
+	# GetNDArray is a view of the image buffer, so this is the only copy of the frame
+	out[...] = grabResult.GetNDArray()
+
+
 def GetTimeStamp(grabResult):
 
 	return grabResult.GetChunkData().GetTimestamp() * 1e-9
 
 
-def GetFrameID(chunkData):
-
-	return chunkData.GetFrameID()
+def GetFrameID(grabResult):
+	# Frame counter of the camera (FrameID chunk, enabled in ConfigureChunkData)
+	return grabResult.GetChunkData().GetFrameID()
 
 
 def DisplayImage(cam_params, dispQueue, grabResult):
@@ -0,0 +1,226 @@
+"""
+Synthetic camera for hardware-free load testing (cameraMake: "synthetic"), with optional delivery jitter
+(syntheticJitterInUs), dropped frames (syntheticDropRate) and a finite on-camera buffer (syntheticBufferFrames).
+"""
+
+import time, logging
+import numpy as np
+from campy import ringbuffer
+
+# Bit depth of >8-bit formats stored in uint16 (values in the low bits)
+BIT_DEPTHS = {"gray10le": 10, "gray12le": 12}
+
+# Frames rendered at startup and cycled through
+NUM_FRAMES = 32
+
+
+def SyntheticFrames(shape, dtype, num_frames=16, seed=0, max_value=None):
+	# Smooth gradient with a moving bright square and mild sensor noise (compressible, not trivial)
+	rng = np.random.default_rng(seed)
+	h, w = shape[0], shape[1]
+	maxval = np.iinfo(dtype).max if max_value is None else max_value
+	y, x = np.mgrid[0:h, 0:w]
+	base = (x / max(w - 1, 1) * 0.5 + y / max(h - 1, 1) * 0.3) * maxval
+	frames = np.empty((num_frames,) + tuple(shape), dtype=dtype)
+	for i in range(num_frames):
+		img = base + rng.normal(0, 0.02*maxval, (h, w))
+		x0 = int((w // 4) + (w // 2) * i / num_frames)
+		img[h//3:h//3 + h//6, x0:x0 + w//8] = 0.9*maxval
+		img = np.clip(img, 0, maxval).astype(dtype)
+		if len(shape) == 3:
+			img = np.repeat(img[:, :, None], shape[2], axis=2)
+		frames[i] = img
+	return frames
+
+
+def MaxValue(pix_fmt, dtype):
+
+	return (1 << BIT_DEPTHS[pix_fmt]) - 1 if pix_fmt in BIT_DEPTHS else np.iinfo(dtype).max
+
+
+class SyntheticCamera(object):
+	'''
+	Usage:
+	camera = SyntheticCamera(frames, frameRate, jitterInUs, dropRate, seed, bufferFrames)
+	camera.Start()
+	grabResult = camera.Grab(timeout) # GrabResult, or None on timeout
+	'''
+	def __init__(self, frames, frame_rate, jitter_in_us=0, drop_rate=0.0, seed=0, buffer_frames=0):
+		self.frames = frames
+		self.period = 1 / frame_rate
+		self.jitter = jitter_in_us*1e-6
+		self.dropRate = drop_rate
+		self.bufferFrames = int(buffer_frames)
+		self.rng = np.random.default_rng(seed)
+
+		self.startTime = None
+		self.frameID = 0
+		self.nextDelivery = None
+		self.numDropped = 0
+		self.numOverwritten = 0
+
+	def Start(self):
+		self.startTime = time.perf_counter()
+		self.Schedule()
+
+	def Schedule(self):
+		# Next frame that reaches the host, skipping frames dropped on the camera
+		self.frameID += 1
+		while self.dropRate > 0 and self.rng.random() < self.dropRate:
+			self.numDropped += 1
+			self.frameID += 1
+		delay = abs(self.rng.normal(0, self.jitter)) if self.jitter > 0 else 0.0
+		self.nextDelivery = self.ExposureTime(self.frameID) + delay
+
+	def ExposureTime(self, frameID):
+
+		return self.startTime + (frameID - 1)*self.period
+
+	def Grab(self, timeout):
+		if self.startTime is None:
+			self.Start()
+
+		# Like a camera's frame buffers, only the newest bufferFrames frames are kept. Frames the host
+		# did not grab in time are overwritten, leaving a gap in frame IDs
+		if self.bufferFrames > 0:
+			newest = int((time.perf_counter() - self.startTime) / self.period) + 1
+			oldest = newest - self.bufferFrames + 1
+			if self.frameID < oldest:
+				self.numOverwritten += oldest - self.frameID
+				self.frameID = oldest - 1
+				self.Schedule()
+
+		wait = self.nextDelivery - time.perf_counter()
+		if wait > timeout:
+			time.sleep(timeout)
+			return None
+		elif wait > 0:
+			time.sleep(wait)
+
+		grabResult = GrabResult(
+			self.frames[(self.frameID - 1) % len(self.frames)],
+			self.ExposureTime(self.frameID),
+			self.frameID)
+		self.Schedule()
+		return grabResult
+
+
+class GrabResult(object):
+
+	def __init__(self, image, timeStamp, frameID):
+		self.image = image
+		self.timeStamp = timeStamp
+		self.frameID = frameID
+
+
+def LoadSystem(params):
+
+	return "synthetic"
+
+
+def GetDeviceList(system):
+	# Enough devices for any cameraSelection
+	return ["SYN{:04d}".format(n) for n in range(64)]
+
+
+def LoadDevice(systems, params, cam_params):
+
+	return cam_params
+
+
+def GetSerialNumber(device):
+
+	return device
+
+
+def GetModelName(camera):
+
+	return "Synthetic_Camera"
+
+
+def OpenCamera(cam_params):
+	# Render the frame bank at the configured size and pixel format
+	shape, dtype = ringbuffer.FrameShape(cam_params)
+	frames = SyntheticFrames(shape, dtype, NUM_FRAMES, seed=cam_params["n_cam"],
+		max_value=MaxValue(cam_params["pixelFormatInput"], dtype))
+	camera = SyntheticCamera(
+		frames,
+		cam_params["frameRate"],
+		cam_params["syntheticJitterInUs"],
+		cam_params["syntheticDropRate"],
+		seed=cam_params["n_cam"],
+		buffer_frames=cam_params["syntheticBufferFrames"])
+
+	cam_params["cameraModel"] = GetModelName(camera)
+	return camera, cam_params
+
+
+def LoadSettings(cam_params, camera):
+
+	return cam_params
+
+
+def StartGrabbing(camera):
+	camera.Start()
+	return True
+
+
+def GrabFrame(camera, frameNumber, timeout):
+	# Wait up to timeout (ms) for the next frame. Returns None on timeout
+	return camera.Grab(timeout*1e-3)
+
+
+def GetImageArray(grabResult):
+
+	return grabResult.image
+
+
+def CopyImageArray(grabResult, out):
+
+	np.copyto(out, grabResult.image)
+
+
+def GetTimeStamp(grabResult):
+
+	return grabResult.timeStamp
+
+
+def GetFrameID(grabResult):
+
+	return grabResult.frameID
+
+
+def DisplayImage(cam_params, dispQueue, grabResult):
+	try:
+		# Downsample image, and scale >8-bit images to 8 bits
+		img = grabResult.image[::cam_params["displayDownsample"], ::cam_params["displayDownsample"]]
+		if img.dtype != np.uint8:
+			shift = BIT_DEPTHS.get(cam_params["pixelFormatInput"], 16) - 8
+			img = (img >> shift).astype(np.uint8)
+
+		# Send to display queue
+		dispQueue.append(img)
+
+	except Exception as e:
+		logging.error('Caught exception at cameras/synthetic.py DisplayImage: {}.'.format(e))
+
+
+def ReleaseFrame(grabResult):
+
+	del grabResult
+
+
+def CloseCamera(cam_params, camera):
+	print('Closing {}... Please wait.'.format(cam_params["cameraName"]))
+	if camera.numDropped > 0:
+		print('{} synthetic camera dropped {} frames (syntheticDropRate).'.format(
+			cam_params["cameraName"], camera.numDropped))
+	if camera.numOverwritten > 0:
+		print('{} synthetic camera overwrote {} frames that were not grabbed in time (syntheticBufferFrames).'\
+			.format(cam_params["cameraName"], camera.numOverwritten))
+	del camera
+
+
+def CloseSystem(system, device_list):
+	del system
+	del device_list
@@ -7,6 +7,7 @@
 import numpy as np
 from collections import deque
 from scipy import io as sio
+from campy import journal, affinity, ringbuffer
 
 
 def ImportCam(make):
@@ -16,6 +17,8 @@ def ImportCam(make):
 		from campy.cameras import flir as cam
 	elif make == "emu":
 		from campy.cameras import emu as cam
+	elif make == "synthetic":
+		from campy.cameras import synthetic as cam
 	else:
 		print('Camera make is not supported by CamPy. Check config.', flush=True)
 	return cam
@@ -49,6 +52,7 @@ def OpenCamera(cam_params, stopWriteQueue):
 	# Import the cam module
 	cam = ImportCam(cam_params["cameraMake"])
 
+	camera = None
 	try:
 		camera, cam_params = cam.OpenCamera(cam_params)
 
@@ -86,10 +90,17 @@ def GetMakeList(params):
 	return makes
 
 
+# Per-frame metadata columns, held in preallocated arrays during grabbing
+FRAME_COLUMNS = {
+	"frameNumber": np.int64, # first frame = 1
+	"timeStamp": np.float64, # camera timestamp (s)
+	"hostTime": np.float64, # host time the frame was received (s, time.perf_counter)
+	"frameID": np.int64, # frame counter of the camera (FrameID/BlockID), for detecting drops
+	}
+
+
 def GrabData(cam_params):
 	grabdata = {}
-	grabdata["timeStamp"] = []
-	grabdata["frameNumber"] = []
 	grabdata["cameraName"] = cam_params["cameraName"]
 
 	# Calculate display rate
@@ -104,9 +115,46 @@ def GrabData(cam_params):
 	grabdata["numImagesToGrab"] = int(round(cam_params["recTimeInSec"]*cam_params["frameRate"]))
 	grabdata["chunkLengthInFrames"] = int(round(cam_params["chunkLengthInSec"]*cam_params["frameRate"]))
 
+	# Preallocate per-frame metadata for the whole recording (grown if more frames arrive)
+	grabdata["numFrames"] = 0
+	grabdata["cameraDroppedFrames"] = 0
+	grabdata["numFramesChecked"] = 0
+	for key, dtype in FRAME_COLUMNS.items():
+		grabdata[key] = np.zeros(max(grabdata["numImagesToGrab"], 1), dtype=dtype)
+
 	return grabdata
 
 
+def AppendFrameData(grabdata, frameNumber, timeStamp, hostTime, frameID):
+	# Store one frame's metadata without allocating (except when doubling the arrays)
+	n = grabdata["numFrames"]
+	if n == len(grabdata["frameNumber"]):
+		for key in FRAME_COLUMNS:
+			grabdata[key] = np.concatenate((grabdata[key], np.zeros_like(grabdata[key])))
+	grabdata["frameNumber"][n] = frameNumber
+	grabdata["timeStamp"][n] = timeStamp
+	grabdata["hostTime"][n] = hostTime
+	grabdata["frameID"][n] = frameID
+	grabdata["numFrames"] = n + 1
+
+
+def CountDroppedFrames(frameID):
+	# Frames missing between consecutive camera frame IDs. Decreasing IDs (counter wrap-around
+	# or reset) cannot be accounted for and count as no drop
+	gaps = np.diff(frameID) - 1
+	return int(gaps[gaps > 0].sum())
+
+
+def CheckFrameIDs(grabdata):
+	# Count camera-side drops in frames grabbed since the last check. Returns new drops
+	n = grabdata["numFrames"]
+	start = max(grabdata["numFramesChecked"] - 1, 0)
+	dropped = CountDroppedFrames(grabdata["frameID"][start:n])
+	grabdata["numFramesChecked"] = n
+	grabdata["cameraDroppedFrames"] += dropped
+	return dropped
+
+
 def StartGrabbing(camera, cam_params, cam):
 	grabbing = cam.StartGrabbing(camera)
 	if grabbing:
@@ -121,10 +169,32 @@ def CountFPS(grabdata, frameNumber, timeStamp):
 		print('{} collected {} frames at {} fps for {} sec.'\
 			.format(grabdata["cameraName"], frameNumber, fpsCount, round(timeElapsed)))
 
+		# Check camera frame IDs of this chunk for frames lost before reaching the host
+		dropped = CheckFrameIDs(grabdata)
+		if dropped > 0:
+			print('{} camera dropped {} frames since the last check ({} total).'\
+				.format(grabdata["cameraName"], dropped, grabdata["cameraDroppedFrames"]))
 
-def GrabFrames(cam_params, writeQueue, dispQueue, stopReadQueue, stopWriteQueue):
-	# Open the camera object
-	cam, camera, cam_params = OpenCamera(cam_params, stopWriteQueue)
+
+def GrabFrames(cam_params, writeQueue, dispQueue, stopReadQueue, stopWriteQueue, metrics=None, tracer=None,
+	opened=None):
+	# Optionally, keep the grab thread on its own CPUs, at higher priority
+	cam_params = affinity.PinGrabThread(cam_params)
+
+	# Open the camera object, unless it was opened before writeQueue was sized (opened = OpenCamera output)
+	if opened is None:
+		opened = OpenCamera(cam_params, stopWriteQueue)
+	cam, camera, cam_params = opened
+
+	# Opening may change the frame size (settings files, size increments, video size)
+	try:
+		ringbuffer.CheckFrameShape(cam_params, writeQueue)
+	except ValueError as e:
+		logging.error("Caught exception at cameras/unicam.py GrabFrames: {}".format(e))
+		if camera is not None:
+			cam.CloseCamera(cam_params, camera)
+		stopWriteQueue.append('STOP')
+		raise
 
 	# Use Basler's default display window on Windows. Not supported on Linux
 	if sys.platform=='win32' and cam_params["cameraMake"] == 'basler':
@@ -133,46 +203,104 @@ def GrabFrames(cam_params, writeQueue, dispQueue, stopReadQueue, stopWriteQueue)
 	# Create dictionary for appending frame number and timestamp information
 	grabdata = GrabData(cam_params)
 
+	# Journal frame metadata to disk in the background, in case recording does not end cleanly
+	frame_journal = journal.OpenJournal(cam_params, grabdata)
+
 	# Start grabbing frames from the camera
 	grabbing = StartGrabbing(camera, cam_params, cam)
 
+	# Wait for frames in the camera API instead of polling. Timeout only serves to re-check stop
+	grabTimeout = cam_params["grabTimeoutInMs"]
+
 	frameNumber = 0
 	while(not stopReadQueue):
 		try:
-			# Grab image from camera buffer if available
-			grabResult = cam.GrabFrame(camera, frameNumber)
-
-			# Append numpy array to writeQueue for writer to append to file
-			img = cam.GetImageArray(grabResult)
-			writeQueue.append(img)
-
-			# Append timeStamp and frameNumber to grabdata
-			frameNumber += 1
-			grabdata['frameNumber'].append(frameNumber) # first frame = 1
+			# Grab next image from camera buffer, waiting up to grabTimeout
+			grabResult = cam.GrabFrame(camera, frameNumber, grabTimeout)
+			if grabResult is None:
+				# Replayed videos (emu) stop at their last frame
+				if hasattr(cam, "EndOfStream") and cam.EndOfStream(camera):
+					print("{} reached the end of the emulated video.".format(cam_params["cameraName"]))
+					break
+				continue
+			hostTime = time.perf_counter()
+
+			# Copy frame from the camera API straight into a free slot of writeQueue (no allocation),
+			# and queue it with its timestamp and frame number for the writer
 			timeStamp = cam.GetTimeStamp(grabResult)
-			grabdata['timeStamp'].append(timeStamp)
+			frameNumber += 1
+			buf = writeQueue.reserve(frameNumber)
+			if buf is not None:
+				try:
+					cam.CopyImageArray(grabResult, buf)
+				except ValueError as e:
+					writeQueue.abort()
+					raise ringbuffer.FrameShapeError("{} frame does not fit the frame buffer {}: {}"\
+						.format(cam_params["cameraName"], writeQueue.shape, e))
+				except Exception:
+					writeQueue.abort()
+					raise
+				writeQueue.commit(timeStamp, frameNumber, hostTime)
+				if tracer is not None:
+					tracer.Record("hostToQueue", time.perf_counter() - hostTime)
+			if tracer is not None:
+				tracer.RecordDevice(timeStamp, hostTime)
+				tracer.Report()
+
+			# Append frameNumber, timeStamp, host receive time and camera frame ID to grabdata
+			AppendFrameData(grabdata, frameNumber, timeStamp, hostTime, cam.GetFrameID(grabResult))
+			if metrics is not None:
+				metrics.framesGrabbed = frameNumber
 
 			# Display converted, downsampled image in the Window
 			if frameNumber % grabdata["frameRatio"] == 0:
+				if hasattr(dispQueue, "update"):
+					# Frame count and drops (camera and write buffer) for the viewer's overlay
+					dispQueue.update(frameNumber, grabdata["cameraDroppedFrames"] + writeQueue.dropped)
 				img = cam.DisplayImage(cam_params, dispQueue, grabResult)
+				if tracer is not None and hasattr(dispQueue, "displayed"):
+					# Latency of the newest image the viewer process drew
+					displayed = dispQueue.displayed()
+					if displayed is not None:
+						tracer.Record("displayed", displayed)
 
 			CountFPS(grabdata, frameNumber, timeStamp)
+			if metrics is not None:
+				metrics.cameraDroppedFrames = grabdata["cameraDroppedFrames"]
 
 			cam.ReleaseFrame(grabResult)
 
 			if frameNumber >= grabdata["numImagesToGrab"]:
 				break
 
+		except ringbuffer.FrameShapeError as e:
+			# Every following frame would fail the same way
+			logging.error('Caught exception at cameras/unicam.py GrabFrames: {}'.format(e))
+			break
+
 		except Exception as e:
+			# Count incomplete frames reported by the camera API (e.g. flir ImageNotCompleteException)
+			if metrics is not None and isinstance(e, getattr(cam, "ImageNotCompleteException", ())):
+				metrics.grabErrors += 1
 			if cam_params["cameraDebug"]:
 				logging.error('Caught exception at cameras/unicam.py GrabFrames: {}'.format(e))
+			# Grab errors are not expected while waiting for frames. Avoid spinning on repeated errors
 			time.sleep(0.001)
 
 	# Close the camaera, save metadata, and tell writer and display to close
 	cam.CloseCamera(cam_params, camera)
+	if frame_journal is not None:
+		frame_journal.close()
+	grabdata["bufferStats"] = writeQueue.stats()
+	grabdata["bufferDroppedFrameNumbers"] = writeQueue.droppedFrameNumbers
+	if tracer is not None:
+		grabdata["latencyStats"] = tracer.Summary()
 	SaveMetadata(cam_params, grabdata)
+	if tracer is not None:
+		tracer.Save(os.path.join(cam_params["videoFolder"], cam_params["cameraName"], "latency.csv"))
 	if not sys.platform=='win32' or not cam_params['cameraMake'] == 'basler':
 		dispQueue.append('STOP')
+	writeQueue.close()
 	stopWriteQueue.append('STOP')
 
 
@@ -180,34 +308,71 @@ def SaveMetadata(cam_params, grabdata):
 	full_folder_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"])
 
 	try:
-		# Zero timeStamps
-		timeFirstGrab = grabdata["timeStamp"][0]
-		grabdata["timeStamp"] = [i - timeFirstGrab for i in grabdata["timeStamp"]]
+		# Trim preallocated arrays to the frames grabbed, and zero timeStamps
+		n = grabdata["numFrames"]
+		frameNumber = grabdata["frameNumber"][:n]
+		timeStamp = grabdata["timeStamp"][:n] - grabdata["timeStamp"][0]
+		hostTime = grabdata["hostTime"][:n] - grabdata["hostTime"][0]
+		frameID = grabdata["frameID"][:n]
+		cameraDroppedFrames = CountDroppedFrames(frameID)
 
 		# Get the frame and time counts to save into metadata
-		frame_count = grabdata['frameNumber'][-1]
-		time_count = grabdata['timeStamp'][-1]
+		frame_count = int(frameNumber[-1])
+		time_count = float(timeStamp[-1])
 		fps_count = int(round(frame_count/time_count))
 		print('{} saved {} frames at {} fps.'.format(cam_params["cameraName"], frame_count, fps_count))
 
+		# Frames dropped by the write buffer are not in the video. Keep them out of the frame times,
+		# and list their frame numbers in dropped_frames.npy (as degrade's decimated_frames.npy)
+		bufferDropped = np.array(grabdata.get("bufferDroppedFrameNumbers", []), dtype=np.int64)
+		if len(bufferDropped) > 0:
+			np.save(os.path.join(full_folder_name, 'dropped_frames.npy'), np.sort(bufferDropped))
+			written = ~np.isin(frameNumber, bufferDropped)
+			frameNumber, timeStamp = frameNumber[written], timeStamp[written]
+			hostTime, frameID = hostTime[written], frameID[written]
+		elif os.path.isfile(os.path.join(full_folder_name, 'dropped_frames.npy')):
+			os.remove(os.path.join(full_folder_name, 'dropped_frames.npy'))
+
 		meta = cam_params
 
 		# Save frame data to numpy file
 		npy_filename = os.path.join(full_folder_name, 'frametimes.npy')
-		x = np.array([grabdata['frameNumber'], grabdata['timeStamp']])
+		x = np.array([frameNumber, timeStamp])
 		np.save(npy_filename,x)
 
 		# Also save frame data to MATLAB file
 		mat_filename = os.path.join(full_folder_name, 'frametimes.mat')
 		matdata = {};
-		matdata['frameNumber'] = grabdata['frameNumber']
-		matdata['timeStamp'] = grabdata['timeStamp']
+		matdata['frameNumber'] = frameNumber
+		matdata['timeStamp'] = timeStamp
+		matdata['hostTime'] = hostTime
+		matdata['frameID'] = frameID
 		sio.savemat(mat_filename, matdata, do_compression=True)
 
 		# Save parameters and recording metadata to csv spreadsheet
 		csv_filename = os.path.join(full_folder_name, 'metadata.csv')
-		meta['totalFrames'] = grabdata['frameNumber'][-1]
-		meta['totalTime'] = grabdata['timeStamp'][-1]
+		meta['totalFrames'] = frame_count
+		meta['totalTime'] = time_count
+		meta['cameraDroppedFrames'] = cameraDroppedFrames
+		# Host time of the first frame, on the clock shared by all camera processes (for utils/align.py)
+		meta['hostTimeStart'] = float(grabdata["hostTime"][0])
+		if cameraDroppedFrames > 0:
+			print('{} camera dropped {} frames (gaps in camera frame IDs).'.format(
+				cam_params['cameraName'], cameraDroppedFrames))
+
+		# Frame buffer counters (dropped frames and high-water mark between grabber and writer)
+		if "bufferStats" in grabdata.keys():
+			meta.update(grabdata["bufferStats"])
+			if grabdata["bufferStats"]["bufferDroppedFrames"] > 0:
+				print('{} dropped {} frames in the write buffer (high-water mark {}/{} frames).'.format(
+					cam_params['cameraName'],
+					grabdata["bufferStats"]["bufferDroppedFrames"],
+					grabdata["bufferStats"]["bufferHighWaterMark"],
+					grabdata["bufferStats"]["bufferCapacity"]))
+
+		# Grab-side latency percentiles (writer-side percentiles are appended by the writer)
+		if "latencyStats" in grabdata.keys():
+			meta.update(grabdata["latencyStats"])
 		
 		with open(csv_filename, 'w', newline='') as f:
 			w = csv.writer(f, delimiter=',', quoting=csv.QUOTE_ALL)
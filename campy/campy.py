@@ -11,6 +11,8 @@
 	* If param is string, it is applied to all cameras.
 	* If param is list of strings, it is assigned to each camera, ordered by camera index.
 Camera streams are acquired and encoded in parallel using multiprocessing.
+With writerProcess: True, each camera is grabbed and encoded in two processes sharing frame memory.
+Live display runs in a separate viewer process reading the newest images from shared memory.
 
 Usage: 
 campy-acquire ./configs/campy_config.yaml
@@ -19,15 +21,21 @@
 import os, time, sys, logging, threading, queue
 from collections import deque
 import multiprocessing as mp
-from campy import writer, display, configurator
+from campy import writer, display, configurator, ringbuffer, encoders, metrics, affinity, latency
 from campy.trigger import trigger
 from campy.cameras import unicam
-from campy.utils.utils import HandleKeyboardInterrupt
+from campy.utils.utils import HandleKeyboardInterrupt, QueueKeyboardInterrupt
+
+# Name prefix of writer processes (writerProcess: True), which do not open camera systems
+WRITER_PROCESS_NAME = "CampyWriter"
 
 def OpenSystems():
 	# Configure parameters
 	params = configurator.ConfigureParams()
 
+	# Check encoders before opening cameras, so broken configs fail early
+	encoders.CheckEncoders(params)
+
 	# Load Camera Systems and Devices
 	systems = unicam.LoadSystems(params)
 	systems = unicam.GetDeviceList(systems, params)
@@ -43,41 +51,119 @@ def CloseSystems(systems, params):
 	unicam.CloseSystems(systems, params)
 
 
-def AcquireOneCamera(n_cam):
+def AcquireOneCamera(n_cam, viewerName=None):
 	# Initialize param dictionary for this camera stream
 	cam_params = configurator.ConfigureCamParams(systems, params, n_cam)
+	cam_params = encoders.SelectEncoder(cam_params)
+	if "encoder" in cam_params.keys():
+		print("{} will be encoded with {}.".format(cam_params["cameraName"], cam_params["encoder"]))
 
-	# Initialize queues for display, video writer, and stop messages
-	dispQueue = deque([], 2)
-	writeQueue = deque()
+	# Optionally, pin this camera to CPUs (and its NUMA node) before its buffers are allocated
+	cam_params = affinity.PlaceCamera(cam_params)
+
+	# Initialize queues for video writer and stop messages
 	stopReadQueue = deque([],1)
 	stopWriteQueue = deque([],1)
 
-	# Start image window display thread
-	threading.Thread(
-		target = display.DisplayFrames,
-		daemon = True,
-		args = (cam_params, dispQueue,),
-		).start()
+	# Open the camera first, since opening may change the frame size (settings files, size increments)
+	opened = unicam.OpenCamera(cam_params, stopWriteQueue)
+	cam, camera, cam_params = opened
+	if camera is None:
+		return
+
+	# Frames are handed to the writer through a bounded buffer of preallocated slots
+	writeQueue = ringbuffer.OpenFrameRing(cam_params)
+
+	# Optionally, publish live pipeline metrics for this camera (Prometheus text format)
+	cam_metrics = metrics.OpenMetrics(cam_params, writeQueue)
+
+	# Optionally, trace per-frame latency of grabbing and display (the writer traces its own stages)
+	tracer = latency.OpenTracer(cam_params, latency.GRAB_STAGES)
+
+	# Send display images to the viewer process (shared memory) or to a display thread
+	dispQueue = display.OpenDisplay(cam_params, viewerName, tracer)
+
+	# Optionally, encode in a separate process, so encoding does not delay grabbing
+	if cam_params["writerProcess"]:
+		GrabAndWriteProcess(cam_params, writeQueue, dispQueue, stopReadQueue, stopWriteQueue, cam_metrics, tracer,
+			opened)
+	else:
+		# Start grabbing frames ("producer" thread)
+		threading.Thread(
+			target = unicam.GrabFrames,
+			daemon = True,
+			args = (cam_params, writeQueue, dispQueue, stopReadQueue, stopWriteQueue, cam_metrics, tracer, opened,),
+			).start()
+
+		# Start video file writer (main "consumer" process)
+		writer.WriteFrames(cam_params, writeQueue, stopReadQueue, stopWriteQueue, cam_metrics)
+
+	dispQueue.close()
+
+
+def GrabAndWriteProcess(cam_params, writeQueue, dispQueue, stopReadQueue, stopWriteQueue, cam_metrics, tracer,
+	opened=None):
+	# Start video file writer ("consumer" process), reading frames from writeQueue's shared memory
+	writerProcess = mp.get_context("spawn").Process(
+		target = writer.WriteFramesProcess,
+		name = "{}-{}".format(WRITER_PROCESS_NAME, cam_params["n_cam"]),
+		args = (configurator.PortableParams(cam_params), writeQueue,
+			cam_metrics.counters if cam_metrics is not None else None,),
+		)
+	writerProcess.start()
 
 	# Start grabbing frames ("producer" thread)
-	threading.Thread(
+	grabThread = threading.Thread(
 		target = unicam.GrabFrames,
 		daemon = True,
-		args = (cam_params, writeQueue, dispQueue, stopReadQueue, stopWriteQueue,),
-		).start()
+		args = (cam_params, writeQueue, dispQueue, stopReadQueue, stopWriteQueue, cam_metrics, tracer, opened,),
+		)
+	grabThread.start()
 
-	# Start video file writer (main "consumer" process)
-	writer.WriteFrames(cam_params, writeQueue, stopReadQueue, stopWriteQueue)
+	# Wait for the grabber. Stop it on interrupt, or if the writer process exits early
+	readQueue = {"queue": stopReadQueue, "message": "STOP"}
+	with QueueKeyboardInterrupt(readQueue):
+		while grabThread.is_alive():
+			grabThread.join(0.5)
+			if not writerProcess.is_alive() and not stopReadQueue:
+				logging.error("Writer process for {} exited (code {}). Stopping acquisition."\
+					.format(cam_params["cameraName"], writerProcess.exitcode))
+				stopReadQueue.append("STOP")
+				writeQueue.close()
+
+		# Writer drains the frames left in writeQueue, then closes the video file
+		writerProcess.join()
+
+	writeQueue.unlink()
+	if cam_metrics is not None:
+		cam_metrics.close()
 
 
 def Main():
-	with HandleKeyboardInterrupt():
-		# Acquire cameras in parallel with Windows- and Linux-compatible pool
-		p = mp.get_context("spawn").Pool(params["numCams"])
-		p.map_async(AcquireOneCamera,range(params["numCams"])).get()
+	# Show all cameras from one viewer process, outside the camera processes
+	viewer = display.Viewer(params) if display.UsesViewer(params) else None
+	viewerName = viewer.name if viewer is not None else None
 
+	with HandleKeyboardInterrupt():
+		if params["writerProcess"]:
+			# Pool workers cannot start writer processes, so each camera gets its own process
+			ctx = mp.get_context("spawn")
+			cams = [ctx.Process(target=AcquireOneCamera, args=(n_cam, viewerName,)) \
+				for n_cam in range(params["numCams"])]
+			for p in cams:
+				p.start()
+			for p in cams:
+				p.join()
+		else:
+			# Acquire cameras in parallel with Windows- and Linux-compatible pool
+			p = mp.get_context("spawn").Pool(params["numCams"])
+			p.starmap_async(AcquireOneCamera, [(n_cam, viewerName) for n_cam in range(params["numCams"])]).get()
+
+	if viewer is not None:
+		viewer.close()
 	CloseSystems(systems, params)
 
 # Open systems, creates global 'systems' and 'params' variables
-systems, params = OpenSystems()
\ No newline at end of file
+# Writer and viewer processes only read frames from shared memory and leave camera systems alone
+if not mp.current_process().name.startswith((WRITER_PROCESS_NAME, display.VIEWER_PROCESS_NAME)):
+	systems, params = OpenSystems()
\ No newline at end of file
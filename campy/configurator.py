@@ -1,7 +1,7 @@
 """
 """
 
-import os, ast, yaml, time, logging
+import os, ast, copy, yaml, time, logging
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from campy.cameras import unicam
 
@@ -19,6 +19,9 @@ def DefaultParams():
 	params["videoFilename"] = "0.mp4"
 	params["frameRate"] = 100
 	params["recTimeInSec"] = 10
+	params["segmentLengthInSec"] = 0
+	params["segmentLengthInFrames"] = 0
+	params["frameJournal"] = True
 
 	# Camera default parameters
 	params["cameraMake"] = "basler"
@@ -26,12 +29,23 @@ def DefaultParams():
 	params["frameWidth"] = 1152
 	params["frameHeight"] = 1024
 	params["cameraDebug"] = False
+	params["grabTimeoutInMs"] = 100
+
+	# Emulated camera parameters (cameraMake: "emu")
+	params["emuTiming"] = "rate" # "rate", "timestamps", "fast"
+	params["emuPrefetchFrames"] = 16
+
+	# Synthetic camera parameters (cameraMake: "synthetic")
+	params["syntheticJitterInUs"] = 0
+	params["syntheticDropRate"] = 0.0
+	params["syntheticBufferFrames"] = 10
 
 	# Flir camera default parameters
 	params["cameraTrigger"] = "None" # "Line3"
 	params["cameraOut"] = 2
 	params["bufferMode"] = "OldestFirst"
 	params["bufferSize"] = 100
+	params["overflowPolicy"] = "block"
 	params["cameraExposureTimeInUs"] = 1500
 	params["cameraGain"] = 1
 	params["disableGamma"] = True
@@ -43,14 +57,34 @@ def DefaultParams():
 	params["pixelFormatOutput"] = "rgb0"
 	params["gpuID"] = -1
 	params["gpuMake"] = "nvidia"
+	params["encoderProbe"] = True
 	params["codec"] = "h264"  
 	params["quality"] = 21
 	params["preset"] = "None"
+	params["writerBackend"] = "imageio"
+	params["writerProcess"] = False
+	params["numEncoders"] = 1
+	params["gopLengthInFrames"] = 100
+	params["pipeBufferSizeInMB"] = 8
+	params["framesPerWrite"] = 1
+	params["variableFrameRate"] = False
+	params["adaptiveDegrade"] = False
+	params["degradeThresholds"] = [0.5, 0.7, 0.9]
+	params["degradeHoldInSec"] = 5
+	params["degradeDecimation"] = 2
 
 	# Display parameters
 	params["chunkLengthInSec"] = 5
 	params["displayFrameRate"] = 10
 	params["displayDownsample"] = 2
+	params["displayMode"] = "process" # "process", "mosaic", "thread", "none"
+	params["metricsPort"] = 0
+	params["traceLatency"] = False
+
+	# CPU placement parameters (Linux)
+	params["grabCores"] = "None" # "auto", or per camera e.g. ["0", "1"]
+	params["writerCores"] = "None" # "auto", or per camera e.g. ["2-7", "8-13"]
+	params["grabNice"] = 0
 
 	# Trigger parameters
 	params["triggerController"] = "arduino"
@@ -76,6 +110,11 @@ def AutoParams(params, default_params):
 		"chunkLengthInSec",
 		"displayFrameRate",
 		"displayDownsample",
+		"grabTimeoutInMs",
+		"pipeBufferSizeInMB",
+		"framesPerWrite",
+		"numEncoders",
+		"gopLengthInFrames",
 		]
 
 	for i in range(len(range_params)):
@@ -98,9 +137,11 @@ def AutoParams(params, default_params):
 	return params
 
 
-def ConfigureParams():
-	parser = ArgumentParser(description="Campy CLI", 
-						formatter_class=ArgumentDefaultsHelpFormatter,)
+def ConfigureParams(parser=None):
+	# Tools may pass a parser with their own arguments added (e.g. campy/bench)
+	if parser is None:
+		parser = ArgumentParser(description="Campy CLI", 
+							formatter_class=ArgumentDefaultsHelpFormatter,)
 	clargs = ParseClargs(parser)
 	params = CombineConfigAndClargs(clargs)
 
@@ -130,15 +171,31 @@ def ConfigureCamParams(systems, params, n_cam):
 	return cam_params
 
 
+def ConfigureStreamParams(params, n_cam):
+	# Camera-specific parameters without opening the camera device (e.g. for offline tools)
+	cam_params = copy.deepcopy(params)
+	cam_params["n_cam"] = n_cam
+	cam_params["baseFolder"] = os.getcwd()
+	cam_params["cameraName"] = params["cameraNames"][n_cam]
+	cam_params = OptParams(cam_params)
+	return cam_params
+
+
+def PortableParams(cam_params):
+	# Copy of cam_params without camera API objects, e.g. to pass to another process
+	return {k: copy.deepcopy(v) for k, v in cam_params.items()
+		if isinstance(v, (list, dict, str, int, float, type(None)))}
+
+
 def OptParams(cam_params):
 	# Optionally, user provides a single string or a list of strings, equal in size to numCams
 	# String is passed to all cameras. Else, each list item is passed to its respective camera
 	for key in cam_params:
 		if type(cam_params[key]) is list:
-			if len(cam_params[key]) == cam_params["numCams"]:
-				cam_params[key] = cam_params[key][cam_params["n_cam"]]
-			elif key == "digitalPins":
+			if key in ["digitalPins", "degradeThresholds"]:
 				continue
+			elif len(cam_params[key]) == cam_params["numCams"]:
+				cam_params[key] = cam_params[key][cam_params["n_cam"]]
 			else:
 				logging.warning("{} size mismatch with numCams. Using list idx {}."\
 						.format(key,cam_params["n_cam"]))
@@ -216,6 +273,26 @@ def ParseClargs(parser):
 		type=float,
 		help="Recording time in seconds.",
 	)    
+	parser.add_argument(
+		"--segmentLengthInSec",
+		dest="segmentLengthInSec",
+		type=float,
+		help="Rotate the video file every segment of this many seconds. \
+			Segments are named by frame range ('start_end.mp4'). 0 records a single file.",
+	)
+	parser.add_argument(
+		"--segmentLengthInFrames",
+		dest="segmentLengthInFrames",
+		type=int,
+		help="Rotate the video file every segment of this many frames. Overrides segmentLengthInSec.",
+	)
+	parser.add_argument(
+		"--frameJournal",
+		dest="frameJournal",
+		type=bool,
+		help="If True, append frame numbers and timestamps to 'frametimes.journal' during recording, \
+			so metadata can be rebuilt with campy-recover if recording does not end cleanly.",
+	)
 	parser.add_argument(
 		"--numCams", 
 		dest="numCams", 
@@ -241,7 +318,8 @@ def ParseClargs(parser):
 		"--cameraMake", 
 		dest="cameraMake", 
 		type=ast.literal_eval,
-		help="Company that produced the camera. Currently supported: 'basler', 'flir'.",
+		help="Company that produced the camera. Currently supported: 'basler', 'flir'. \
+			'emu' replays recorded videos, 'synthetic' generates frames for testing without cameras.",
 	)
 	parser.add_argument(
 		"--cameraSettings", 
@@ -267,6 +345,45 @@ def ParseClargs(parser):
 		type=bool, 
 		help="Flag to turn on camera debug mode.",
 	)
+	parser.add_argument(
+		"--grabTimeoutInMs", 
+		dest="grabTimeoutInMs",
+		type=int, 
+		help="Longest time the grabber waits in the camera API for the next frame before \
+			re-checking for a stop message.",
+	)
+	parser.add_argument(
+		"--emuTiming",
+		dest="emuTiming",
+		type=ast.literal_eval,
+		help="Emulated camera: release frames at frameRate ('rate'), at the recorded timestamps \
+			from frametimes.npy ('timestamps'), or as fast as they are decoded ('fast').",
+	)
+	parser.add_argument(
+		"--emuPrefetchFrames",
+		dest="emuPrefetchFrames",
+		type=int,
+		help="Emulated camera: number of frames decoded ahead of grabbing.",
+	)
+	parser.add_argument(
+		"--syntheticJitterInUs",
+		dest="syntheticJitterInUs",
+		type=float,
+		help="Synthetic camera: standard deviation of the frame delivery delay in microseconds.",
+	)
+	parser.add_argument(
+		"--syntheticDropRate",
+		dest="syntheticDropRate",
+		type=float,
+		help="Synthetic camera: fraction of frames dropped before reaching the host (gaps in frame IDs).",
+	)
+	parser.add_argument(
+		"--syntheticBufferFrames",
+		dest="syntheticBufferFrames",
+		type=int,
+		help="Synthetic camera: frames held on the camera. Older frames not grabbed in time are overwritten \
+			(gaps in frame IDs). 0 keeps every frame.",
+	)
 	parser.add_argument(
 		"--cameraTrigger", 
 		dest="cameraTrigger",
@@ -307,7 +424,15 @@ def ParseClargs(parser):
 		"--bufferSize", 
 		dest="bufferSize",
 		type=int, 
-		help="Size of buffer to use in camera in frames (default: 100).",
+		help="Size of buffer to use in camera in frames (default: 100). \
+			Also sets the number of preallocated frame slots between grabber and writer.",
+	)
+	parser.add_argument(
+		"--overflowPolicy", 
+		dest="overflowPolicy",
+		type=ast.literal_eval, 
+		help="What to do when the frame buffer between grabber and writer is full: \
+			'block' (wait for writer), 'dropNewest', or 'dropOldest'.",
 	)
 
 	# ffmpeg arguments
@@ -346,7 +471,15 @@ def ParseClargs(parser):
 		"--gpuMake",
 		dest="gpuMake",
 		type=ast.literal_eval,
-		help="Company that produced the GPU. Currently supported: 'nvidia', 'amd', 'intel' (QuickSync).",
+		help="Company that produced the GPU. Currently supported: 'nvidia', 'amd', 'intel' (QuickSync), \
+			or 'auto' to pick the fastest usable GPU encoder.",
+	)
+	parser.add_argument(
+		"--encoderProbe",
+		dest="encoderProbe",
+		type=bool,
+		help="If True, check the configured encoders against the ffmpeg binary at startup \
+			(cached on disk) and fall back to CPU encoding if a GPU encoder is not usable.",
 	)
 	parser.add_argument(
 		"--codec",
@@ -368,6 +501,83 @@ def ParseClargs(parser):
 		help="Compression preset (e.g. 'slow', 'fast', 'veryfast'). \
 				Incorrect settings may break the pipe. Test with ffmpegLogLevel 'warning' or 'info'.",
 	)
+	parser.add_argument(
+		"--numEncoders",
+		dest="numEncoders",
+		type=int,
+		help="Number of parallel CPU encoder processes per camera (gpuID: -1 only). \
+			Frames are dealt to encoders in GOP-aligned blocks and stitched into one video on close.",
+	)
+	parser.add_argument(
+		"--gopLengthInFrames",
+		dest="gopLengthInFrames",
+		type=int,
+		help="Length of the keyframe-aligned blocks used with numEncoders > 1.",
+	)
+	parser.add_argument(
+		"--writerBackend",
+		dest="writerBackend",
+		type=ast.literal_eval,
+		help="How frames are sent to ffmpeg: 'imageio' (imageio-ffmpeg write_frames), \
+			'pipe' (direct ffmpeg pipe with large pipe buffer and zero-copy frame writes), or \
+			'raw' (uncompressed memory-mapped capture, transcode later with campy-transcode).",
+	)
+	parser.add_argument(
+		"--writerProcess",
+		dest="writerProcess",
+		type=bool,
+		help="If True, grab and encode each camera in separate processes, passing frames through \
+			shared memory, so grab timing is not affected by encoding or display.",
+	)
+	parser.add_argument(
+		"--pipeBufferSizeInMB",
+		dest="pipeBufferSizeInMB",
+		type=float,
+		help="Requested ffmpeg pipe buffer size for the 'pipe' backend (Linux only). \
+			Capped by /proc/sys/fs/pipe-max-size.",
+	)
+	parser.add_argument(
+		"--framesPerWrite",
+		dest="framesPerWrite",
+		type=int,
+		help="Number of frames coalesced into one pipe write by the 'pipe' backend. \
+			Values >1 help for small frames.",
+	)
+
+	parser.add_argument(
+		"--variableFrameRate",
+		dest="variableFrameRate",
+		type=bool,
+		help="If True, use camera timestamps as video presentation timestamps, so dropped or late \
+			frames do not shift the video timeline. Writes '<video>.timestamps.txt' and muxes it \
+			with mp4fpsmod (mp4) or mkvmerge (mkv) if installed.",
+	)
+
+	parser.add_argument(
+		"--adaptiveDegrade",
+		dest="adaptiveDegrade",
+		type=bool,
+		help="If True, when the write buffer fills up, step to a faster preset, then lower quality \
+			(both at a new segment), then decimate frames. Transitions are logged to degradation.csv.",
+	)
+	parser.add_argument(
+		"--degradeThresholds",
+		dest="degradeThresholds",
+		type=ast.literal_eval,
+		help="Write buffer fill (fraction of bufferSize) at which degradation levels 1-3 start.",
+	)
+	parser.add_argument(
+		"--degradeHoldInSec",
+		dest="degradeHoldInSec",
+		type=float,
+		help="Minimum time between degradation steps up, and time the buffer must stay below half of the current threshold before stepping back.",
+	)
+	parser.add_argument(
+		"--degradeDecimation",
+		dest="degradeDecimation",
+		type=int,
+		help="At the last degradation level, encode 1 of every this many frames.",
+	)
 
 	# Display and CLI feedback arguments
 	parser.add_argument(
@@ -388,6 +598,50 @@ def ParseClargs(parser):
 		type=int,
 		help="Downsampling factor for displaying images.",
 	)
+	parser.add_argument(
+		"--displayMode",
+		dest="displayMode",
+		type=ast.literal_eval,
+		help="Show images in one viewer process reading shared memory, one window per camera \
+			('process') or all cameras tiled in one window ('mosaic'), in a thread of each camera \
+			process ('thread'), or not at all ('none').",
+	)
+
+	parser.add_argument(
+		"--metricsPort",
+		dest="metricsPort",
+		type=int,
+		help="If >0, each camera serves live pipeline metrics (Prometheus text format) at \
+			http://localhost:<metricsPort + camera index>/metrics. 0 disables metrics.",
+	)
+	parser.add_argument(
+		"--traceLatency",
+		dest="traceLatency",
+		type=bool,
+		help="If True, time each frame from camera to encoder and display, print latency percentiles \
+			every chunkLengthInSec, and save them to metadata.csv and latency.csv.",
+	)
+	parser.add_argument(
+		"--grabCores",
+		dest="grabCores",
+		type=ast.literal_eval,
+		help="CPUs for each camera's grab thread (Linux), e.g. ['0', '1'] or ['0-1', '2-3'], \
+			or 'auto' to plan from the CPU and NUMA topology.",
+	)
+	parser.add_argument(
+		"--writerCores",
+		dest="writerCores",
+		type=ast.literal_eval,
+		help="CPUs for each camera's writer and its ffmpeg encoders (Linux), e.g. ['2-7', '8-13'], \
+			or 'auto' to plan from the CPU and NUMA topology.",
+	)
+	parser.add_argument(
+		"--grabNice",
+		dest="grabNice",
+		type=int,
+		help="Niceness of grab threads (Linux). Negative values raise their scheduling priority \
+			and need root or CAP_SYS_NICE. 0 leaves it unchanged.",
+	)
 
 	# Microcontroller triggering arguments
 	parser.add_argument(
@@ -0,0 +1,195 @@
+"""
+Adaptive degradation (adaptiveDegrade: True). Steps to a faster preset, lower quality, then frame decimation
+as the write buffer fills, and back once it drains. Transitions are logged to degradation.csv.
+"""
+
+import os, csv, copy, time, logging
+import numpy as np
+from campy import segments
+
+# Preset and quality changes need a new encoder, so they only apply with segments
+LEVELS = ["normal", "fasterPreset", "lowerQuality", "decimate"]
+
+# Encoder presets from slowest to fastest, stepped by PRESET_STEP
+PRESETS = ["veryslow", "slower", "slow", "medium", "fast", "faster", "veryfast", "superfast", "ultrafast"]
+PRESET_STEP = 2
+
+# Legacy NVENC presets from slowest to fastest ("veryfast" etc. are not valid for NVENC)
+NVENC_PRESETS = ["slow", "medium", "fast", "hp"]
+NVENC_ALIASES = {"default": "medium", "hq": "medium", "llhq": "llhp", "bd": "medium"}
+QUALITY_STEP = 4
+
+
+def OpenDegradePolicy(cam_params, writeQueue):
+	# Returns None if adaptive degradation is disabled
+	if not cam_params["adaptiveDegrade"]:
+		return None
+	segmented = segments.SegmentLength(cam_params) > 0 and cam_params["writerBackend"] != "raw"
+	if not segmented:
+		print("{}: adaptive degradation without segments only decimates frames. "\
+			"Set segmentLengthInSec to also change encoder settings.".format(cam_params["cameraName"]))
+	return DegradePolicy(cam_params, writeQueue, segmented)
+
+
+def FasterPreset(cam_params, steps=PRESET_STEP):
+	# Faster preset for the configured encoder. Unknown presets are left unchanged
+	preset = str(cam_params["preset"])
+	gpu = cam_params["gpuMake"] if cam_params["gpuID"] != -1 else None
+	if gpu == "amd":
+		return preset
+	if preset == "None":
+		preset = "faster" if gpu == "intel" else "fast"
+
+	if gpu == "nvidia":
+		# p1 (fastest) ... p7 (slowest), or the legacy ladder up to "hp"
+		if len(preset) == 2 and preset[0] == "p" and preset[1].isdigit():
+			return "p{}".format(max(1, int(preset[1]) - steps))
+		preset = NVENC_ALIASES.get(preset, preset)
+		if preset in NVENC_PRESETS:
+			return NVENC_PRESETS[min(NVENC_PRESETS.index(preset) + steps, len(NVENC_PRESETS) - 1)]
+		return preset
+
+	if preset in PRESETS:
+		# Intel QSV presets stop at "veryfast"
+		fastest = "veryfast" if gpu == "intel" else "ultrafast"
+		i = min(PRESETS.index(preset) + steps, PRESETS.index(fastest))
+		return PRESETS[max(i, PRESETS.index(preset))]
+	return preset
+
+
+class DegradePolicy(object):
+	'''
+	Usage:
+	policy = DegradePolicy(cam_params, writeQueue, segmented)
+	open_encoder(policy.EncoderParams(), file_name)
+
+	# For each frame taken from writeQueue
+	if policy.Update(frameNumber, timeStamp): <start new segment>
+	if policy.Skip(frameNumber): <release frame without writing>
+
+	policy.close()
+	'''
+	def __init__(self, cam_params, writeQueue, segmented):
+		self.cam_params = cam_params
+		self.writeQueue = writeQueue
+		self.segmented = segmented
+		self.levels = [0, 1, 2, 3] if segmented else [0, 3]
+		self.thresholds = [0.0] + [float(t) for t in cam_params["degradeThresholds"]]
+		if len(self.thresholds) != 4:
+			raise ValueError("degradeThresholds needs 3 values (buffer fill for levels 1-3).")
+		self.holdInSec = cam_params["degradeHoldInSec"]
+		self.decimation = max(2, int(cam_params["degradeDecimation"]))
+
+		self.level = 0
+		self.belowSince = None
+		self.changedAt = None
+		self.decimateCount = 0
+		self.framesWritten = 0
+
+		# Accounting
+		self.transitions = []
+		self.decimated = []
+		self.framesAtLevel = [0]*len(LEVELS)
+		self.maxLevel = 0
+
+	def EncoderParams(self):
+		# Copy of cam_params with encoder settings for the current level
+		cam_params = copy.copy(self.cam_params)
+		if self.level >= 1:
+			cam_params["preset"] = FasterPreset(cam_params)
+		if self.level >= 2:
+			cam_params["quality"] = int(cam_params["quality"]) + QUALITY_STEP
+		return cam_params
+
+	def Update(self, frameNumber, timeStamp):
+		# Step level up or down from buffer fill. Returns True if a new segment must start
+		fill = len(self.writeQueue) / self.writeQueue.capacity
+		i = self.levels.index(self.level)
+		new_level = self.level
+		now = time.perf_counter()
+
+		if i + 1 < len(self.levels) and fill >= self.thresholds[self.levels[i + 1]]:
+			# Give the last change holdInSec to drain the buffer before stepping up again
+			if self.changedAt is None or now - self.changedAt >= self.holdInSec:
+				new_level = self.levels[i + 1]
+			self.belowSince = None
+		elif self.level > 0 and fill < self.thresholds[self.level] / 2:
+			if self.belowSince is None:
+				self.belowSince = now
+			elif now - self.belowSince >= self.holdInSec:
+				new_level = self.levels[i - 1]
+				self.belowSince = None
+		else:
+			self.belowSince = None
+
+		self.framesAtLevel[self.level] += 1
+		if new_level == self.level:
+			return False
+
+		old_level = self.level
+		self.level = new_level
+		self.changedAt = now
+		self.maxLevel = max(self.maxLevel, new_level)
+		self.decimateCount = 0
+		params = self.EncoderParams()
+		self.transitions.append({
+			"frameNumber": frameNumber,
+			"videoFrame": self.framesWritten,
+			"timeStamp": timeStamp,
+			"fromLevel": LEVELS[old_level],
+			"toLevel": LEVELS[new_level],
+			"bufferFill": round(fill, 3),
+			"preset": params["preset"],
+			"quality": params["quality"],
+			"decimation": self.decimation if new_level >= 3 else 1,
+			})
+		print("{} {} degradation at frame {} (buffer {:.0f}% full): {} -> {}.".format(
+			self.cam_params["cameraName"], "increased" if new_level > old_level else "reduced",
+			frameNumber, 100*fill, LEVELS[old_level], LEVELS[new_level]))
+
+		# Encoder settings differ between levels 0-2 only, and change with a new segment
+		return self.segmented and min(old_level, 2) != min(new_level, 2)
+
+	def Skip(self, frameNumber):
+		# Decimation keeps the first of every self.decimation frames
+		skip = False
+		if self.level >= 3:
+			skip = self.decimateCount % self.decimation != 0
+			self.decimateCount += 1
+		if skip:
+			self.decimated.append(frameNumber)
+		else:
+			self.framesWritten += 1
+		return skip
+
+	def Summary(self):
+		return {
+			"degradeTransitions": len(self.transitions),
+			"degradeMaxLevel": LEVELS[self.maxLevel],
+			"degradeFramesAtLevel": self.framesAtLevel,
+			"degradeDecimatedFrames": len(self.decimated),
+			}
+
+	def close(self):
+		if len(self.transitions) == 0:
+			return
+		folder_name = os.path.join(self.cam_params["videoFolder"], self.cam_params["cameraName"])
+		try:
+			with open(os.path.join(folder_name, "degradation.csv"), "w", newline="") as f:
+				w = csv.DictWriter(f, fieldnames=list(self.transitions[0].keys()))
+				w.writeheader()
+				w.writerows(self.transitions)
+			if len(self.decimated) > 0:
+				np.save(os.path.join(folder_name, "decimated_frames.npy"), np.array(self.decimated, dtype=np.int64))
+
+			# Add summary to metadata.csv (written by the grabber when it stops)
+			with open(os.path.join(folder_name, "metadata.csv"), "a", newline="") as f:
+				w = csv.writer(f, delimiter=",", quoting=csv.QUOTE_ALL)
+				for row in self.Summary().items():
+					w.writerow(row)
+
+			print("{} was degraded {} times (max level '{}', {} frames decimated). See degradation.csv."\
+				.format(self.cam_params["cameraName"], len(self.transitions), LEVELS[self.maxLevel], len(self.decimated)))
+
+		except Exception as e:
+			logging.error("Caught exception at degrade.py close: {}".format(e))
@@ -1,12 +1,23 @@
 """
-
+Live display (displayMode): one viewer process for all cameras ("process", or "mosaic" in one window),
+a display thread per camera ("thread"), or "none".
 """
-import sys, time, logging, warnings
+import os, sys, time, logging, warnings, threading
+import multiprocessing as mp
 import numpy as np
 import matplotlib as mpl
 warnings.filterwarnings("ignore")
 mpl.use('Qt5Agg') # ignore qtapp warning...
 import matplotlib.pyplot as plt
+from campy import ringbuffer
+
+DISPLAY_MODES = ["process", "mosaic", "thread", "none"]
+
+# Modes shown by the viewer process
+VIEWER_MODES = ["process", "mosaic"]
+
+# Name of the viewer process, which does not open camera systems
+VIEWER_PROCESS_NAME = "CampyViewer"
 
 
 def DrawFigure(num):
@@ -28,7 +39,7 @@ def DrawFigure(num):
 	return figure, imageWindow
 
 
-def DisplayFrames(cam_params, dispQueue):
+def DisplayFrames(cam_params, dispQueue, tracer=None):
 	n_cam = cam_params['n_cam']
 	
 	if sys.platform == "win32" and cam_params['cameraMake'] == 'basler':
@@ -38,17 +49,247 @@ def DisplayFrames(cam_params, dispQueue):
 		figure, imageWindow = DrawFigure(n_cam+1)
 		while(True):
 			try:
-				if dispQueue:
-					img = dispQueue.popleft()
-					try:
-						imageWindow.set_data(img)
-						figure.canvas.draw()
-						figure.canvas.flush_events()
-					except Exception as e:
-						# logging.error('Caught exception at display.py DisplayFrames: {}'.format(e))
-						pass
-				else:
-					time.sleep(0.01)
+				# Block until the grabber sends the next image
+				img = dispQueue.get(timeout=0.5)
+				if img is None:
+					continue
+				if isinstance(img, str) and img == 'STOP':
+					break
+				try:
+					imageWindow.set_data(img)
+					figure.canvas.draw()
+					figure.canvas.flush_events()
+					if tracer is not None:
+						tracer.Record("displayed", time.perf_counter() - dispQueue.queueTime)
+				except Exception as e:
+					# logging.error('Caught exception at display.py DisplayFrames: {}'.format(e))
+					pass
 			except KeyboardInterrupt:
 				break
-		plt.close(figure)
\ No newline at end of file
+		plt.close(figure)
+
+
+def UsesViewer(params):
+	# Basler cameras on Windows show images in the Pylon image window instead
+	if params["displayMode"] not in VIEWER_MODES:
+		return False
+	makes = np.atleast_1d(params["cameraMake"])
+	return not (sys.platform == "win32" and all(make == "basler" for make in makes))
+
+
+def SlotName(viewer_name, n_cam):
+
+	return "{}_{}".format(viewer_name, n_cam)
+
+
+def OpenDisplay(cam_params, viewer_name=None, tracer=None):
+	# Where the grabber sends display images (dispQueue). Starts the display thread in "thread" mode
+	mode = cam_params["displayMode"]
+	if mode not in DISPLAY_MODES:
+		raise ValueError("displayMode must be one of {}.".format(DISPLAY_MODES))
+	if mode in VIEWER_MODES and viewer_name is not None:
+		return ringbuffer.DisplaySlot(SlotName(viewer_name, cam_params["n_cam"]))
+
+	dispQueue = ringbuffer.DisplayQueue(2)
+	if mode == "thread":
+		threading.Thread(
+			target = DisplayFrames,
+			daemon = True,
+			args = (cam_params, dispQueue, tracer,),
+			).start()
+	return dispQueue
+
+
+class Viewer(object):
+	'''
+	Usage:
+	viewer = Viewer(params) # starts the viewer process
+	dispQueue = OpenDisplay(cam_params, viewer.name) # in each camera process
+	viewer.close() # after the cameras stopped
+	'''
+	def __init__(self, params):
+		ctx = mp.get_context("spawn")
+		self.name = "campy{}".format(os.getpid())
+		self.stop = ctx.Event()
+		self.process = ctx.Process(
+			target = ViewerProcess,
+			name = VIEWER_PROCESS_NAME,
+			daemon = True,
+			args = (self.name, list(params["cameraNames"]), params["displayFrameRate"], self.stop,
+				TileShape(params) if params["displayMode"] == "mosaic" else None,),
+			)
+		self.process.start()
+
+	def close(self):
+		self.stop.set()
+		self.process.join(5)
+		if self.process.is_alive():
+			self.process.terminate()
+
+
+def ViewerProcess(viewer_name, camera_names, display_frame_rate, stop, tile_shape=None):
+	# Draw the newest image of each camera at displayFrameRate, until all cameras stopped.
+	# One window per camera, or all cameras in one mosaic window of tile_shape tiles
+	num_cams = len(camera_names)
+	slots = [None]*num_cams
+	windows = [None]*num_cams
+	done = [False]*num_cams
+	period = 1 / max(np.atleast_1d(display_frame_rate))
+	try:
+		mosaic = Mosaic(camera_names, tile_shape) if tile_shape is not None else None
+		while not stop.is_set() and not all(done):
+			t0 = time.perf_counter()
+			updated = []
+			for n in range(num_cams):
+				if done[n]:
+					continue
+				if slots[n] is None:
+					# Camera sends its first image when it starts grabbing
+					slots[n] = ringbuffer.DisplaySlot.attach(SlotName(viewer_name, n))
+					if slots[n] is None:
+						continue
+				if slots[n].stopped:
+					done[n] = True
+					slots[n].close()
+					if mosaic is not None:
+						mosaic.Stopped(n)
+					elif windows[n] is not None:
+						plt.close(windows[n][0])
+					continue
+
+				img = slots[n].get()
+				if img is None:
+					continue
+				if mosaic is not None:
+					mosaic.Update(n, img, slots[n].frameNumber, slots[n].droppedFrames, slots[n].queueTime)
+					updated.append(n)
+					continue
+				if windows[n] is None:
+					windows[n] = DrawFigure(n+1)
+					windows[n][0].canvas.manager.set_window_title(camera_names[n])
+				elif not plt.fignum_exists(n+1):
+					# Window was closed. Keep recording without it
+					done[n] = True
+					slots[n].close()
+					continue
+				try:
+					figure, imageWindow = windows[n]
+					imageWindow.set_data(img)
+					figure.canvas.draw()
+					# Display latency is traced by the camera process (traceLatency)
+					slots[n].drawn(time.perf_counter() - slots[n].queueTime)
+				except Exception as e:
+					pass
+
+			if mosaic is not None:
+				if not mosaic.IsOpen():
+					# Window was closed. Keep recording without it
+					break
+				mosaic.Draw()
+				for n in updated:
+					slots[n].drawn(time.perf_counter() - slots[n].queueTime)
+
+			# Keep open windows responsive, also between images
+			for n in range(num_cams):
+				if windows[n] is not None and not done[n]:
+					windows[n][0].canvas.flush_events()
+			time.sleep(max(0.0, period - (time.perf_counter() - t0)))
+	except KeyboardInterrupt:
+		pass
+	except Exception as e:
+		logging.error('Caught exception at display.py ViewerProcess: {}'.format(e))
+	finally:
+		for slot in slots:
+			if slot is not None:
+				slot.close()
+		plt.close('all')
+
+
+def TileShape(params):
+	# (height, width) of the largest downsampled camera image
+	downsample = int(np.min(np.atleast_1d(params["displayDownsample"])))
+	height = int(np.max(np.atleast_1d(params["frameHeight"])))
+	width = int(np.max(np.atleast_1d(params["frameWidth"])))
+	return -(-height // downsample), -(-width // downsample)
+
+
+class Mosaic(object):
+	'''
+	All cameras tiled in one window. Images are copied into their tile of a preallocated canvas,
+	and the window is redrawn once per refresh, so drawing cost hardly grows with the number of cameras.
+
+	Usage:
+	mosaic = Mosaic(cameraNames, tileShape)
+	mosaic.Update(n_cam, img, frameNumber, droppedFrames, queueTime)
+	mosaic.Draw() # once per refresh
+	mosaic.IsOpen() # False once the window was closed
+	'''
+	def __init__(self, camera_names, tile_shape, num=1):
+		self.names = list(camera_names)
+		self.num = num
+		self.tileHeight, self.tileWidth = tile_shape
+		self.cols = int(np.ceil(np.sqrt(len(self.names))))
+		self.rows = int(np.ceil(len(self.names) / self.cols))
+		self.canvas = np.zeros((self.rows*self.tileHeight, self.cols*self.tileWidth, 3), dtype=np.uint8)
+
+		# (frameNumber, queueTime, fps) at the last rate update of each camera
+		self.rates = [(0, 0.0, 0.0)]*len(self.names)
+
+		mpl.rcParams['toolbar'] = 'None'
+		self.figure = plt.figure(num)
+		self.figure.canvas.manager.set_window_title("campy")
+		ax = plt.axes([0,0,1,1], frameon=False)
+		plt.axis('off')
+		plt.ion()
+		self.imageWindow = ax.imshow(self.canvas, interpolation='none')
+
+		# Overlay with name, fps and drops at the top left of each tile
+		self.labels = []
+		for n, name in enumerate(self.names):
+			y0, x0 = self.Origin(n)
+			self.labels.append(ax.text(x0 + 4, y0 + 4, name, color="white", fontsize=9,
+				va="top", ha="left", backgroundcolor="black"))
+
+		self.changed = True
+		self.figure.canvas.draw()
+		plt.show(block=False)
+
+	def Origin(self, n):
+		# Top left pixel of camera n's tile, in row-major order
+		return (n // self.cols)*self.tileHeight, (n % self.cols)*self.tileWidth
+
+	def Update(self, n, img, frameNumber, droppedFrames, queueTime):
+		# Copy the image into its tile in place (cropped to the tile, gray images broadcast to RGB)
+		y0, x0 = self.Origin(n)
+		h, w = min(img.shape[0], self.tileHeight), min(img.shape[1], self.tileWidth)
+		if img.ndim == 2:
+			self.canvas[y0:y0+h, x0:x0+w] = img[:h, :w, None]
+		else:
+			self.canvas[y0:y0+h, x0:x0+w] = img[:h, :w, :3]
+
+		# Grab rate from frame numbers over at least 1 s
+		frame0, time0, fps = self.rates[n]
+		if queueTime - time0 >= 1.0:
+			if time0 > 0:
+				fps = (frameNumber - frame0) / (queueTime - time0)
+			self.rates[n] = (frameNumber, queueTime, fps)
+
+		self.labels[n].set_text("{}  {:.1f} fps  {} dropped".format(self.names[n], fps, droppedFrames))
+		self.labels[n].set_color("red" if droppedFrames > 0 else "white")
+		self.changed = True
+
+	def Stopped(self, n):
+		self.labels[n].set_text(self.labels[n].get_text() + "  (stopped)")
+		self.changed = True
+
+	def Draw(self):
+		# Redraw the whole window if any tile changed, and keep it responsive
+		if self.changed:
+			self.imageWindow.set_data(self.canvas)
+			self.figure.canvas.draw()
+			self.changed = False
+		self.figure.canvas.flush_events()
+
+	def IsOpen(self):
+
+		return plt.fignum_exists(self.num)
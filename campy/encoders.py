@@ -0,0 +1,202 @@
+"""
+Encoder capability probe. Checks which ffmpeg encoders actually work on this machine (cached on disk)
+and picks the fastest usable one for each camera.
+"""
+
+import os, sys, json, subprocess, logging
+from imageio_ffmpeg import get_ffmpeg_exe
+from campy import writer, configurator
+
+# Encoder names by codec and GPU make, and GPU makes in order of preference for "auto"
+ENCODERS = {
+	"h264": {"nvidia": "h264_nvenc", "intel": "h264_qsv", "amd": "h264_amf", "cpu": "libx264"},
+	"h265": {"nvidia": "hevc_nvenc", "intel": "hevc_qsv", "amd": "hevc_amf", "cpu": "libx265"},
+	}
+GPU_MAKES = ["nvidia", "intel", "amd"]
+
+
+def CacheFileName():
+	if sys.platform == "win32":
+		base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+	else:
+		base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+	return os.path.join(base, "campy", "encoders.json")
+
+
+def LoadCache():
+	try:
+		with open(CacheFileName(), "r") as f:
+			return json.load(f)
+	except Exception:
+		return {"versions": {}, "probes": {}}
+
+
+def SaveCache(cache):
+	try:
+		file_name = CacheFileName()
+		os.makedirs(os.path.dirname(file_name), exist_ok=True)
+		with open(file_name + ".tmp", "w") as f:
+			json.dump(cache, f, indent=1)
+		os.replace(file_name + ".tmp", file_name)
+	except Exception as e:
+		logging.warning("Could not save encoder cache: {}".format(e))
+
+
+def RunFFmpeg(exe, args, timeout=20):
+	result = subprocess.run([exe, "-hide_banner"] + args,
+		stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+	return result.returncode, result.stdout.decode(errors="ignore") + result.stderr.decode(errors="ignore")
+
+
+def FFmpegVersion(exe, cache):
+	# Remember version by file size and modification time, so it is only queried after an update
+	stat = os.stat(exe)
+	stamp = "{}|{}|{}".format(os.path.realpath(exe), stat.st_size, int(stat.st_mtime))
+	if stamp not in cache["versions"]:
+		returncode, out = RunFFmpeg(exe, ["-version"])
+		cache["versions"][stamp] = out.splitlines()[0] if out else "unknown"
+	return cache["versions"][stamp]
+
+
+def ParseEncoders(out):
+	# Lines look like " V....D libx264              libx264 H.264 / AVC ..."
+	encoders = []
+	for line in out.splitlines():
+		fields = line.split()
+		if len(fields) >= 2 and len(fields[0]) == 6 and fields[0][0] == "V" and fields[1] != "=":
+			encoders.append(fields[1])
+	return encoders
+
+
+def ParsePixelFormats(out):
+	# Lines look like "IO... yuv420p                3            12      8-8-8", after the "-----" line
+	# that ends the header (whose flag legend, e.g. "I.... = Supported Input", is not a format)
+	pix_fmts = {"input": [], "output": []}
+	lines = out.splitlines()
+	header = [n for n, line in enumerate(lines) if line.startswith("-----")]
+	for line in lines[header[0] + 1 if header else 0:]:
+		fields = line.split()
+		if len(fields) >= 2 and fields[1] != "=" and len(fields[0]) == 5 and fields[0][:2] in ["IO", "I.", ".O"]:
+			if fields[0][0] == "I":
+				pix_fmts["input"].append(fields[1])
+			if fields[0][1] == "O":
+				pix_fmts["output"].append(fields[1])
+	return pix_fmts
+
+
+def ParseEncoderPixelFormats(out):
+	# "Supported pixel formats: yuv420p yuvj420p ..." from "ffmpeg -h encoder=<name>"
+	for line in out.splitlines():
+		if "Supported pixel formats:" in line:
+			return line.split(":", 1)[1].split()
+	return []
+
+
+def TestEncoder(exe, encoder):
+	# Encode one small frame to the null muxer. Fails if the encoder's hardware/driver is missing
+	try:
+		returncode, out = RunFFmpeg(exe, [
+			"-v", "error",
+			"-f", "lavfi", "-i", "color=c=gray:size=256x256:rate=10",
+			"-frames:v", "1",
+			"-c:v", encoder,
+			"-f", "null", "-"])
+		return returncode == 0
+	except Exception:
+		return False
+
+
+def ProbeFFmpeg(exe):
+	returncode, out = RunFFmpeg(exe, ["-encoders"])
+	available = ParseEncoders(out)
+	returncode, out = RunFFmpeg(exe, ["-pix_fmts"])
+	pix_fmts = ParsePixelFormats(out)
+
+	encoders = {}
+	for codec in ENCODERS:
+		for make, encoder in ENCODERS[codec].items():
+			if encoder in available:
+				returncode, out = RunFFmpeg(exe, ["-h", "encoder={}".format(encoder)])
+				encoders[encoder] = {
+					"usable": TestEncoder(exe, encoder),
+					"pixelFormats": ParseEncoderPixelFormats(out),
+					}
+	return {"available": available, "pixelFormats": pix_fmts, "encoders": encoders}
+
+
+def GetCapabilities(exe=None):
+	# Probe results for this ffmpeg binary, from cache when possible
+	if exe is None:
+		exe = get_ffmpeg_exe()
+	cache = LoadCache()
+	num_versions = len(cache["versions"])
+	version = FFmpegVersion(exe, cache)
+	key = "{}|{}".format(os.path.realpath(exe), version)
+	if key not in cache["probes"]:
+		print("Probing encoders of {} ({})...".format(exe, version))
+		cache["probes"][key] = ProbeFFmpeg(exe)
+		SaveCache(cache)
+	elif len(cache["versions"]) != num_versions:
+		SaveCache(cache)
+	return cache["probes"][key]
+
+
+def IsUsable(caps, encoder):
+
+	return encoder in caps["encoders"] and caps["encoders"][encoder]["usable"]
+
+
+def SelectEncoder(cam_params, caps=None):
+	# Set gpuID/gpuMake to the fastest usable encoder for this camera, falling back to CPU
+	if cam_params["writerBackend"] == "raw" or not cam_params["encoderProbe"]:
+		return cam_params
+	if caps is None:
+		caps = GetCapabilities()
+
+	codec = str(cam_params["codec"])
+	if codec not in ENCODERS:
+		raise ValueError("codec '{}' is not supported. Use 'h264' or 'h265'.".format(codec))
+
+	if cam_params["gpuID"] != -1:
+		if cam_params["gpuMake"] == "auto":
+			makes = [m for m in GPU_MAKES if IsUsable(caps, ENCODERS[codec][m])]
+			if len(makes) > 0:
+				cam_params["gpuMake"] = makes[0]
+			else:
+				print("{}: no usable GPU encoder for {}. Falling back to CPU."\
+					.format(cam_params["cameraName"], codec))
+				cam_params["gpuID"] = -1
+		elif not IsUsable(caps, ENCODERS[codec].get(cam_params["gpuMake"], "")):
+			logging.warning("{}: encoder for gpuMake '{}' and codec '{}' is not usable with this ffmpeg. "\
+				"Falling back to CPU.".format(cam_params["cameraName"], cam_params["gpuMake"], codec))
+			cam_params["gpuID"] = -1
+
+	encoder = ENCODERS[codec]["cpu"] if cam_params["gpuID"] == -1 else ENCODERS[codec][cam_params["gpuMake"]]
+	if not IsUsable(caps, encoder):
+		raise ValueError("{}: encoder '{}' is not usable with this ffmpeg build. Check ffmpegPath and codec."\
+			.format(cam_params["cameraName"], encoder))
+
+	# Check pixel formats against what ffmpeg and the encoder accept
+	if cam_params["pixelFormatInput"] not in caps["pixelFormats"]["input"]:
+		raise ValueError("{}: pixelFormatInput '{}' is not supported by this ffmpeg."\
+			.format(cam_params["cameraName"], cam_params["pixelFormatInput"]))
+	codec_name, pix_fmt_out, gpu_params = writer.EncoderParams(cam_params)
+	supported = caps["encoders"][encoder]["pixelFormats"]
+	if len(supported) > 0 and pix_fmt_out not in supported:
+		raise ValueError("{}: encoder '{}' does not support pixelFormatOutput '{}'. Supported: {}."\
+			.format(cam_params["cameraName"], encoder, pix_fmt_out, ", ".join(supported)))
+
+	cam_params["encoder"] = encoder
+	return cam_params
+
+
+def CheckEncoders(params):
+	# Resolve encoders for every camera before the cameras are armed. Skip probing ffmpeg if no camera
+	# encodes with a probed encoder (same condition as SelectEncoder)
+	streams = [configurator.ConfigureStreamParams(params, n_cam) for n_cam in range(params["numCams"])]
+	streams = [c for c in streams if not (c["writerBackend"] == "raw" or not c["encoderProbe"])]
+	if len(streams) == 0:
+		return
+	caps = GetCapabilities()
+	for cam_params in streams:
+		SelectEncoder(cam_params, caps)
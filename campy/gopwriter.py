@@ -0,0 +1,106 @@
+"""
+GOP-parallel CPU encoding. Blocks of frames are dealt round-robin to several ffmpeg encoders
+and stitched back in frame order on close.
+"""
+
+import os, shutil, subprocess, threading, logging
+from imageio_ffmpeg import get_ffmpeg_exe
+
+
+def BlockParams(gop_length, fps, num_encoders):
+	# Output parameters forcing one keyframe and one output file per block
+	gop_length = int(gop_length)
+	return [
+		"-g", str(gop_length),
+		"-keyint_min", str(gop_length),
+		"-sc_threshold", "0",
+		"-force_key_frames", "expr:gte(n,n_forced*{})".format(gop_length),
+		"-threads", str(max(1, (os.cpu_count() or 1) // num_encoders)),
+		"-f", "segment",
+		"-segment_time", "{:.6f}".format(gop_length / fps),
+		"-segment_time_delta", "{:.6f}".format(0.5 / fps),
+		"-reset_timestamps", "1",
+		"-segment_format", "mp4",
+		]
+
+
+class GopWriter(object):
+	'''
+	Usage:
+	writer = GopWriter(open_stream, full_file_name, num_encoders, gop_length, fps)
+	writer.send(img)
+	writer.close() # stitches blocks into full_file_name
+
+	open_stream(file_name, extra_params) must return an encoder with send(img) and close().
+	'''
+	def __init__(self, open_stream, full_file_name, num_encoders, gop_length, fps, ffmpeg_log_level="warning"):
+		self.full_file_name = full_file_name
+		self.numEncoders = int(num_encoders)
+		self.gopLength = int(gop_length)
+		self.ffmpegLogLevel = ffmpeg_log_level
+		self.framesWritten = 0
+
+		# Blocks are written to a hidden folder next to the output file
+		folder_name, file_name = os.path.split(full_file_name)
+		stem, self.ext = os.path.splitext(file_name)
+		self.block_folder = os.path.join(folder_name, ".{}_blocks".format(stem))
+		if os.path.isdir(self.block_folder):
+			shutil.rmtree(self.block_folder)
+		os.makedirs(self.block_folder)
+
+		extra_params = BlockParams(self.gopLength, fps, self.numEncoders)
+		self.encoders = []
+		for k in range(self.numEncoders):
+			pattern = os.path.join(self.block_folder, "enc{}_%06d{}".format(k, self.ext))
+			self.encoders.append(open_stream(pattern, extra_params))
+
+	def BlockFileName(self, block):
+		# Encoder k writes blocks k, k+K, k+2K, ... as its output files 0, 1, 2, ...
+		k = block % self.numEncoders
+		i = block // self.numEncoders
+		return os.path.join(self.block_folder, "enc{}_{:06d}{}".format(k, i, self.ext))
+
+	def send(self, img):
+		block = self.framesWritten // self.gopLength
+		self.encoders[block % self.numEncoders].send(img)
+		self.framesWritten += 1
+
+	def close(self):
+		# Flush all encoders in parallel, then stitch
+		threads = [threading.Thread(target=e.close) for e in self.encoders]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		if self.framesWritten > 0:
+			self.Stitch()
+		else:
+			shutil.rmtree(self.block_folder, ignore_errors=True)
+
+	def Stitch(self):
+		num_blocks = (self.framesWritten + self.gopLength - 1) // self.gopLength
+		list_file_name = os.path.join(self.block_folder, "blocks.txt")
+		with open(list_file_name, "w") as f:
+			f.write("ffconcat version 1.0\n")
+			for block in range(num_blocks):
+				block_file_name = self.BlockFileName(block)
+				if not os.path.isfile(block_file_name):
+					raise IOError("Missing encoded block {} ({}).".format(block, block_file_name))
+				f.write("file '{}'\n".format(os.path.basename(block_file_name)))
+
+		cmd = [
+			get_ffmpeg_exe(), "-y",
+			"-v", self.ffmpegLogLevel,
+			"-f", "concat", "-safe", "0",
+			"-i", list_file_name,
+			"-c", "copy",
+			self.full_file_name,
+			]
+		result = subprocess.run(cmd)
+		if result.returncode == 0:
+			shutil.rmtree(self.block_folder)
+			print("Stitched {} blocks from {} encoders into {}.".format(
+				num_blocks, self.numEncoders, self.full_file_name))
+		else:
+			logging.error("Caught error at gopwriter.py Stitch: ffmpeg exited with code {}. "\
+				"Encoded blocks are kept in {}.".format(result.returncode, self.block_folder))
@@ -0,0 +1,209 @@
+"""
+Crash-safe journal of per-frame metadata (frameJournal: True), flushed in the background while grabbing.
+Recover frametimes and metadata from a partial journal with "campy-recover ./videos/session1".
+"""
+
+import os, json, glob, zlib, struct, threading, logging
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import numpy as np
+
+MAGIC = b"CAMPYJNL"
+BLOCK_MAGIC = b"CJB1"
+HEADER_SIZE = 4096
+BLOCK_FRAMES = 1024
+FILE_NAME = "frametimes.journal"
+
+# File header: MAGIC, data offset and length of the JSON header that follows
+FILE_HEADER = struct.Struct("<II")
+# One record per frame, same columns as unicam.FRAME_COLUMNS
+RECORD = np.dtype([("frameNumber", "<i8"), ("timeStamp", "<f8"), ("hostTime", "<f8"), ("frameID", "<i8")])
+# Blocks of BLOCK_FRAMES records follow the header, each with magic, block index, record count and CRC32.
+# Only the last, partial block is rewritten at each flush, so a torn write loses only the newest frames
+BLOCK_HEADER = struct.Struct("<4sIII")
+BLOCK_SIZE = BLOCK_HEADER.size + BLOCK_FRAMES*RECORD.itemsize
+
+
+def JournalFileName(cam_params):
+
+	return os.path.join(cam_params["videoFolder"], cam_params["cameraName"], FILE_NAME)
+
+
+def OpenJournal(cam_params, grabdata):
+	# Start journaling grabdata. Returns None if disabled
+	if not cam_params["frameJournal"]:
+		return None
+	try:
+		journal = FrameJournal(JournalFileName(cam_params), cam_params, grabdata)
+		journal.Start()
+	except Exception as e:
+		logging.error("Caught exception at journal.py OpenJournal: {}".format(e))
+		return None
+	return journal
+
+
+def EncodeBlock(index, records):
+	payload = records.tobytes()
+	crc = zlib.crc32(payload)
+	header = BLOCK_HEADER.pack(BLOCK_MAGIC, index, len(records), crc)
+	return header + payload + bytes(BLOCK_SIZE - len(header) - len(payload))
+
+
+class FrameJournal(object):
+	'''
+	Usage:
+	journal = FrameJournal(file_name, cam_params, grabdata)
+	journal.Start() # flushes new frames from grabdata in a background thread
+	journal.close() # final flush
+	'''
+	def __init__(self, file_name, cam_params, grabdata, interval=1.0):
+		self.file_name = file_name
+		self.grabdata = grabdata
+		self.interval = interval
+		self.blocksDone = 0
+		self.framesFlushed = 0
+		self.stopping = threading.Event()
+		self.thread = None
+		self.lock = threading.Lock()
+
+		# Camera parameters that can be saved to metadata.csv
+		params = {k: v for k, v in cam_params.items() if isinstance(v, (list, str, int, float))}
+		blob = json.dumps({"blockFrames": BLOCK_FRAMES, "camParams": params}, default=str).encode()
+		self.dataOffset = HEADER_SIZE*((len(MAGIC) + FILE_HEADER.size + len(blob)) // HEADER_SIZE + 1)
+
+		os.makedirs(os.path.dirname(file_name), exist_ok=True)
+		self.f = open(file_name, "w+b")
+		self.f.write(MAGIC + FILE_HEADER.pack(self.dataOffset, len(blob)) + blob)
+		self.f.flush()
+
+	def Start(self):
+		self.thread = threading.Thread(target=self.Run, daemon=True)
+		self.thread.start()
+
+	def Run(self):
+		while not self.stopping.wait(self.interval):
+			try:
+				self.Flush()
+			except Exception as e:
+				logging.error("Caught exception at journal.py Run: {}".format(e))
+
+	def Records(self, start, stop):
+		# Copy records [start, stop) out of grabdata. stop is read before the arrays,
+		# since the grab thread may replace them with larger ones
+		records = np.empty(stop - start, dtype=RECORD)
+		for key in RECORD.names:
+			records[key] = self.grabdata[key][start:stop]
+		return records
+
+	def Flush(self):
+		with self.lock:
+			n = self.grabdata["numFrames"]
+			if n == self.framesFlushed:
+				return
+			# Complete blocks not yet written, then the partial block (rewritten in place)
+			last = n // BLOCK_FRAMES
+			for block in range(self.blocksDone, last + 1):
+				start = block*BLOCK_FRAMES
+				stop = min(n, start + BLOCK_FRAMES)
+				if stop <= start:
+					break
+				self.f.seek(self.dataOffset + block*BLOCK_SIZE)
+				self.f.write(EncodeBlock(block, self.Records(start, stop)))
+			self.blocksDone = last
+			self.framesFlushed = n
+			self.f.flush()
+			os.fsync(self.f.fileno())
+
+	def close(self):
+		self.stopping.set()
+		if self.thread is not None:
+			self.thread.join()
+		self.Flush()
+		self.f.close()
+
+
+def ReadJournal(file_name):
+	# Returns (cam_params, records) with all frames from intact blocks
+	with open(file_name, "rb") as f:
+		if f.read(len(MAGIC)) != MAGIC:
+			raise ValueError("{} is not a campy frame journal.".format(file_name))
+		data_offset, length = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+		header = json.loads(f.read(length).decode())
+		block_frames = header["blockFrames"]
+		block_size = BLOCK_HEADER.size + block_frames*RECORD.itemsize
+
+		chunks = []
+		block = 0
+		f.seek(data_offset)
+		while True:
+			buf = f.read(block_size)
+			if len(buf) < BLOCK_HEADER.size:
+				break
+			magic, index, count, crc = BLOCK_HEADER.unpack_from(buf)
+			payload = buf[BLOCK_HEADER.size:BLOCK_HEADER.size + count*RECORD.itemsize]
+			if magic != BLOCK_MAGIC or index != block or count > block_frames \
+				or len(payload) != count*RECORD.itemsize or zlib.crc32(payload) != crc:
+				logging.warning("{}: block {} is incomplete or corrupt. Recovered frames up to there."\
+					.format(file_name, block))
+				break
+			chunks.append(np.frombuffer(payload, dtype=RECORD))
+			if count < block_frames:
+				break
+			block += 1
+
+	records = np.concatenate(chunks) if len(chunks) > 0 else np.empty(0, dtype=RECORD)
+	return header["camParams"], records
+
+
+def Recover(file_name, force=False):
+	# Rebuild frametimes.npy, frametimes.mat and metadata.csv next to the journal
+	from campy.cameras import unicam
+	folder_name = os.path.dirname(os.path.abspath(file_name))
+	if os.path.isfile(os.path.join(folder_name, "frametimes.npy")) and not force:
+		print("Skipping {}: frametimes.npy exists (use --force to overwrite).".format(folder_name))
+		return False
+
+	cam_params, records = ReadJournal(file_name)
+	if len(records) == 0:
+		print("No frames recovered from {}.".format(file_name))
+		return False
+
+	# Write outputs next to the journal, wherever the session folder was moved
+	cam_params["videoFolder"] = os.path.dirname(folder_name)
+	cam_params["cameraName"] = os.path.basename(folder_name)
+	cam_params["recoveredFromJournal"] = True
+	grabdata = {"numFrames": len(records)}
+	for key in RECORD.names:
+		grabdata[key] = np.array(records[key])
+	unicam.SaveMetadata(cam_params, grabdata)
+	print("Recovered {} frames from {}.".format(len(records), file_name))
+	return True
+
+
+def Main():
+	parser = ArgumentParser(description="Rebuild campy frame metadata from frame-time journals",
+						formatter_class=ArgumentDefaultsHelpFormatter,)
+	parser.add_argument("paths", nargs="+",
+		help="Journal files, or folders searched recursively for {}.".format(FILE_NAME))
+	parser.add_argument("--force", action="store_true",
+		help="Overwrite existing frametimes.npy, frametimes.mat and metadata.csv.")
+	args = parser.parse_args()
+
+	journals = []
+	for path in args.paths:
+		if os.path.isdir(path):
+			journals += sorted(glob.glob(os.path.join(path, "**", FILE_NAME), recursive=True))
+		else:
+			journals.append(path)
+	if len(journals) == 0:
+		print("No frame journals found.")
+		return
+
+	for file_name in journals:
+		try:
+			Recover(file_name, args.force)
+		except Exception as e:
+			logging.error("Caught exception at journal.py recovering {}: {}".format(file_name, e))
+
+
+if __name__ == "__main__":
+	Main()
@@ -0,0 +1,172 @@
+"""
+Per-frame latency tracing (traceLatency: True). Times each pipeline stage with the host clock into
+streaming log-binned histograms, saved to metadata.csv and latency.csv.
+"""
+
+import os, csv, math, time, logging
+
+MIN_LATENCY = 1e-6
+MAX_LATENCY = 100.0
+BINS_PER_DECADE = 20
+MAX_DRIFT = 1e-3 # camera clock drift tracked by deviceToHost (seconds per second)
+PERCENTILES = [50, 90, 99]
+
+# Stages timed on the grab side (grab and display threads) and on the writer side
+GRAB_STAGES = ["deviceToHost", "hostToQueue", "displayed"]
+WRITE_STAGES = ["queueWait", "encoderSend", "hostToEncoded"]
+
+
+def OpenTracer(cam_params, stages):
+	# Returns None if latency tracing is disabled
+	if not cam_params["traceLatency"]:
+		return None
+	return LatencyTracer(cam_params["cameraName"], stages, cam_params["chunkLengthInSec"])
+
+
+class Histogram(object):
+	'''
+	Usage:
+	h = Histogram()
+	h.Record(seconds)
+	h.Percentile(99) # seconds, upper edge of the bin holding the 99th percentile
+	'''
+	LOG_MIN = math.log10(MIN_LATENCY)
+	NUM_BINS = int(round(math.log10(MAX_LATENCY / MIN_LATENCY)*BINS_PER_DECADE))
+
+	def __init__(self):
+		# Bin 0 holds values below MIN_LATENCY, the last bin values above MAX_LATENCY
+		self.counts = [0]*(self.NUM_BINS + 2)
+		self.window = [0]*(self.NUM_BINS + 2)
+		self.count = 0
+		self.max = 0.0
+		self.windowMax = 0.0
+
+	def Record(self, seconds):
+		if seconds < MIN_LATENCY:
+			i = 0
+		else:
+			i = min(self.NUM_BINS + 1, int((math.log10(seconds) - self.LOG_MIN)*BINS_PER_DECADE) + 1)
+		self.counts[i] += 1
+		self.window[i] += 1
+		self.count += 1
+		if seconds > self.max:
+			self.max = seconds
+		if seconds > self.windowMax:
+			self.windowMax = seconds
+
+	def Edge(self, i):
+		# Upper edge of bin i in seconds
+		return 10**(self.LOG_MIN + i / BINS_PER_DECADE)
+
+	def Percentile(self, q, counts=None, maximum=None):
+		counts = self.counts if counts is None else counts
+		maximum = self.max if maximum is None else maximum
+		n = sum(counts)
+		if n == 0:
+			return float("nan")
+		rank = math.ceil(q / 100 * n)
+		cumulative = 0
+		for i, c in enumerate(counts):
+			cumulative += c
+			if cumulative >= rank:
+				return min(self.Edge(i), maximum)
+		return maximum
+
+	def ResetWindow(self):
+		self.window = [0]*len(self.window)
+		self.windowMax = 0.0
+
+
+class LatencyTracer(object):
+	'''
+	Usage:
+	tracer = LatencyTracer(cameraName, GRAB_STAGES, interval)
+	tracer.Record("hostToQueue", time.perf_counter() - hostTime)
+	tracer.Report() # prints percentiles every interval seconds
+	tracer.Summary() # percentiles of the whole recording, for metadata
+	tracer.Save(file_name)
+	'''
+	def __init__(self, camera_name, stages, interval=5):
+		self.cameraName = camera_name
+		self.stages = list(stages)
+		self.histograms = {stage: Histogram() for stage in self.stages}
+		self.interval = interval
+		self.lastReport = time.perf_counter()
+
+		# Lower envelope of (host receive - camera timestamp)
+		self.deviceOffset = None
+		self.deviceOffsetTime = 0.0
+
+	def Record(self, stage, seconds):
+		self.histograms[stage].Record(seconds)
+
+	def RecordDevice(self, timeStamp, hostTime):
+		# Camera and host clocks differ by an unknown offset, which may drift slowly
+		offset = hostTime - timeStamp
+		if self.deviceOffset is None:
+			self.deviceOffset = offset
+		else:
+			self.deviceOffset = min(offset, self.deviceOffset + MAX_DRIFT*(hostTime - self.deviceOffsetTime))
+		self.deviceOffsetTime = hostTime
+		self.Record("deviceToHost", offset - self.deviceOffset)
+
+	def Report(self):
+		# Print percentiles since the previous report, every interval seconds
+		now = time.perf_counter()
+		if now - self.lastReport < self.interval:
+			return
+		self.lastReport = now
+		parts = []
+		for stage in self.stages:
+			h = self.histograms[stage]
+			if sum(h.window) == 0:
+				continue
+			parts.append("{} {}".format(stage, "/".join("{:.2f}".format(1e3*h.Percentile(q, h.window, h.windowMax))
+				for q in PERCENTILES + [100])))
+			h.ResetWindow()
+		if len(parts) > 0:
+			print("{} latency (ms, p{}/max): {}.".format(self.cameraName,
+				"/p".join(str(q) for q in PERCENTILES), ", ".join(parts)))
+
+	def Summary(self):
+		# Percentiles and max of each stage in ms, e.g. {"latencyQueueWaitMs": [p50, p90, p99, max]}
+		summary = {"latencyPercentiles": ",".join("p{}".format(q) for q in PERCENTILES) + ",max"}
+		for stage in self.stages:
+			h = self.histograms[stage]
+			if h.count == 0:
+				continue
+			key = "latency{}{}Ms".format(stage[0].upper(), stage[1:])
+			summary[key] = [round(1e3*float(h.Percentile(q)), 3) for q in PERCENTILES] + [round(1e3*float(h.max), 3)]
+		return summary
+
+	def Save(self, file_name, append=False):
+		# Non-empty histogram bins of each stage
+		try:
+			new_file = not append or not os.path.isfile(file_name)
+			with open(file_name, "a" if append else "w", newline="") as f:
+				w = csv.writer(f)
+				if new_file:
+					w.writerow(["stage", "binLowerMs", "binUpperMs", "count"])
+				for stage in self.stages:
+					h = self.histograms[stage]
+					for i, c in enumerate(h.counts):
+						if c > 0:
+							lower = 0.0 if i == 0 else 1e3*h.Edge(i - 1)
+							upper = 1e3*h.Edge(i) if i <= h.NUM_BINS else float("inf")
+							w.writerow([stage, round(lower, 6), round(upper, 6), c])
+		except Exception as e:
+			logging.error("Caught exception at latency.py Save: {}".format(e))
+
+
+def AppendSummary(cam_params, tracer):
+	# Save the writer side after the grabber wrote metadata.csv and latency.csv
+	folder_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"])
+	tracer.Save(os.path.join(folder_name, "latency.csv"), append=True)
+	try:
+		with open(os.path.join(folder_name, "metadata.csv"), "a", newline="") as f:
+			w = csv.writer(f, delimiter=",", quoting=csv.QUOTE_ALL)
+			for key, value in tracer.Summary().items():
+				if key != "latencyPercentiles":
+					w.writerow([key, value])
+	except Exception as e:
+		logging.error("Caught exception at latency.py AppendSummary: {}".format(e))
@@ -0,0 +1,184 @@
+"""
+Live pipeline metrics of one camera, served in Prometheus text format at
+http://localhost:<metricsPort + camera index>/metrics.
+"""
+
+import os, sys, time, threading, logging
+from multiprocessing.sharedctypes import RawArray
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+
+def OpenMetrics(cam_params, writeQueue):
+	# Start the metrics endpoint for this camera. Returns None if metrics are disabled
+	if cam_params["metricsPort"] <= 0:
+		return None
+	port = int(cam_params["metricsPort"]) + int(cam_params["n_cam"])
+	try:
+		metrics = Metrics(cam_params["cameraName"], writeQueue)
+		metrics.Serve(port)
+		print("{} metrics at http://localhost:{}/metrics".format(cam_params["cameraName"], port))
+	except Exception as e:
+		logging.warning("Could not start metrics endpoint on port {}: {}".format(port, e))
+		return None
+	return metrics
+
+
+def ResidentMemory():
+	# Current resident set size in bytes (peak RSS where /proc is not available)
+	try:
+		with open("/proc/self/statm") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+	except Exception:
+		pass
+	if resource is not None:
+		rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		return rss if sys.platform == "darwin" else rss*1024
+	return float("nan")
+
+
+# Counters updated by the grab and write loops
+COUNTERS = ["framesGrabbed", "grabErrors", "cameraDroppedFrames", "framesWritten", "bytesWritten",
+	"degradeLevel", "framesDecimated"]
+
+
+def Counter(name):
+	# Attribute stored in the shared counter array
+	index = COUNTERS.index(name)
+	return property(lambda self: self.counters[index],
+		lambda self, value: self.counters.__setitem__(index, value))
+
+
+class Metrics(object):
+	'''
+	Usage:
+	metrics = Metrics(cameraName, writeQueue)
+	metrics.Serve(port)
+
+	# Other process updating the same counters
+	metrics = Metrics(cameraName, writeQueue, counters=<metrics.counters from the serving process>)
+
+	# Grab loop
+	metrics.framesGrabbed += 1
+	metrics.grabErrors += 1
+
+	# Write loop
+	metrics.framesWritten += 1
+	metrics.bytesWritten += img.nbytes
+	'''
+	framesGrabbed = Counter("framesGrabbed")
+	grabErrors = Counter("grabErrors")
+	cameraDroppedFrames = Counter("cameraDroppedFrames")
+	framesWritten = Counter("framesWritten")
+	bytesWritten = Counter("bytesWritten")
+	degradeLevel = Counter("degradeLevel")
+	framesDecimated = Counter("framesDecimated")
+
+	def __init__(self, camera_name, writeQueue, counters=None):
+		self.cameraName = camera_name
+		self.writeQueue = writeQueue
+		self.server = None
+
+		if counters is None:
+			counters = RawArray("d", len(COUNTERS))
+		self.counters = counters
+
+		# Previous sample for rates
+		self.lock = threading.Lock()
+		self.sample = (time.perf_counter(), 0, 0)
+		self.grabFPS = 0.0
+		self.writeFPS = 0.0
+
+	def Rates(self):
+		# Grab and write rates since the previous scrape (at least 0.5 s apart)
+		with self.lock:
+			now = time.perf_counter()
+			t0, grabbed0, written0 = self.sample
+			if now - t0 >= 0.5:
+				self.grabFPS = (self.framesGrabbed - grabbed0) / (now - t0)
+				self.writeFPS = (self.framesWritten - written0) / (now - t0)
+				self.sample = (now, self.framesGrabbed, self.framesWritten)
+			return self.grabFPS, self.writeFPS
+
+	def Collect(self):
+		# List of (name, type, help, value)
+		ring = self.writeQueue
+		grab_fps, write_fps = self.Rates()
+		depth = len(ring)
+		frame_bytes = ring.nbytes // ring.capacity
+
+		# Encoder lag in frames (including the one being written) and in camera time
+		lag_frames = ring.backlog()
+		lag = 0.0
+		if lag_frames > 0:
+			lag = max(0.0, ring.lastTimeStamp - ring.timeStamp)
+
+		cpu = os.times()
+		return [
+			("campy_frames_grabbed_total", "counter", "Frames grabbed from the camera.", self.framesGrabbed),
+			("campy_frames_written_total", "counter", "Frames sent to the encoder.", self.framesWritten),
+			("campy_bytes_written_total", "counter", "Uncompressed bytes sent to the encoder.", self.bytesWritten),
+			("campy_grab_fps", "gauge", "Grab rate since the previous scrape.", grab_fps),
+			("campy_write_fps", "gauge", "Write rate since the previous scrape.", write_fps),
+			("campy_queue_depth", "gauge", "Frames waiting in the write buffer.", depth),
+			("campy_queue_capacity", "gauge", "Slots in the write buffer.", ring.capacity),
+			("campy_queue_bytes", "gauge", "Bytes of frames waiting in the write buffer.", depth*frame_bytes),
+			("campy_queue_high_water_mark", "gauge", "Most frames ever waiting in the write buffer.",
+				ring.highWaterMark),
+			("campy_buffer_allocations_total", "counter", "Frame buffer allocations (1 at startup, none per frame).",
+				ring.allocations),
+			("campy_frames_dropped_total", "counter", "Frames dropped by the write buffer overflow policy.",
+				ring.dropped),
+			("campy_camera_dropped_frames_total", "counter", "Gaps in camera frame IDs (checked every chunkLengthInSec).",
+				self.cameraDroppedFrames),
+			("campy_grab_errors_total", "counter", "Failed or incomplete grabs.", self.grabErrors),
+			("campy_degrade_level", "gauge", "Adaptive degradation level (0 = configured settings).",
+				self.degradeLevel),
+			("campy_frames_decimated_total", "counter", "Frames skipped by adaptive degradation.",
+				self.framesDecimated),
+			("campy_encoder_lag_frames", "gauge", "Frames grabbed but not yet sent to the encoder.", lag_frames),
+			("campy_encoder_lag_seconds", "gauge", "Camera time between newest grabbed and written frame.", lag),
+			("campy_process_cpu_seconds_total", "counter", "CPU time of the camera process.", cpu.user + cpu.system),
+			("campy_process_resident_memory_bytes", "gauge", "Resident memory of the camera process.",
+				ResidentMemory()),
+			]
+
+	def Render(self):
+		# Prometheus text exposition format
+		lines = []
+		label = '{{camera="{}"}}'.format(self.cameraName)
+		for name, kind, text, value in self.Collect():
+			lines.append("# HELP {} {}".format(name, text))
+			lines.append("# TYPE {} {}".format(name, kind))
+			lines.append("{}{} {}".format(name, label, float(value)))
+		return "\n".join(lines) + "\n"
+
+	def Serve(self, port):
+		metrics = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path.split("?")[0] not in ["/", "/metrics"]:
+					self.send_error(404)
+					return
+				body = metrics.Render().encode()
+				self.send_response(200)
+				self.send_header("Content-Type", "text/plain; version=0.0.4")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+
+		self.server = HTTPServer(("127.0.0.1", port), Handler)
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+	def close(self):
+		if self.server is not None:
+			self.server.shutdown()
+			self.server.server_close()
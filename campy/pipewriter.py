@@ -0,0 +1,137 @@
+"""
+Video writer that pipes frames straight from numpy buffers to ffmpeg's stdin (writerBackend: "pipe").
+"""
+
+import os, sys, subprocess, logging
+import numpy as np
+from imageio_ffmpeg import get_ffmpeg_exe
+
+# fcntl commands for pipe capacity (Linux only)
+F_SETPIPE_SZ = 1031
+F_GETPIPE_SZ = 1032
+
+
+def FFmpegCommand(full_file_name, size, fps, codec, pix_fmt_in, pix_fmt_out,
+					ffmpeg_log_level="warning", input_params=[], output_params=[]):
+	# Same command line as imageio-ffmpeg write_frames, reading raw frames from stdin
+	cmd = [
+		get_ffmpeg_exe(),
+		"-y",
+		"-f", "rawvideo",
+		"-vcodec", "rawvideo",
+		"-s", "{}x{}".format(int(size[0]), int(size[1])),
+		"-pix_fmt", pix_fmt_in,
+		"-r", "{:.02f}".format(fps),
+		]
+	cmd += input_params
+	cmd += ["-i", "-", "-an"]
+	cmd += ["-vcodec", codec, "-pix_fmt", pix_fmt_out]
+	cmd += ["-v", ffmpeg_log_level]
+	cmd += output_params
+	cmd.append(full_file_name)
+	return cmd
+
+
+def PopenKwargs():
+	# Keep Ctrl^C from reaching ffmpeg, so campy can close the file cleanly
+	if sys.platform == "win32":
+		return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+	else:
+		return {"start_new_session": True}
+
+
+def SetPipeSize(fd, pipe_size):
+	# Enlarge pipe buffer up to the system limit. Returns the resulting size, or None if unsupported
+	if not sys.platform.startswith("linux"):
+		return None
+	try:
+		import fcntl
+		try:
+			with open("/proc/sys/fs/pipe-max-size") as f:
+				pipe_size = min(pipe_size, int(f.read()))
+		except Exception:
+			pass
+		fcntl.fcntl(fd, F_SETPIPE_SZ, pipe_size)
+		return fcntl.fcntl(fd, F_GETPIPE_SZ)
+	except Exception as e:
+		logging.warning("Could not set ffmpeg pipe size: {}".format(e))
+		return None
+
+
+def OpenPipeWriter(full_file_name, size, fps, codec, pix_fmt_in, pix_fmt_out,
+					ffmpeg_log_level="warning", input_params=[], output_params=[],
+					pipe_size=8000000, frames_per_write=1):
+	cmd = FFmpegCommand(full_file_name, size, fps, codec, pix_fmt_in, pix_fmt_out,
+					ffmpeg_log_level, input_params, output_params)
+	return PipeWriter(cmd, pipe_size, frames_per_write)
+
+
+class PipeWriter(object):
+	'''
+	Usage:
+	writer = PipeWriter(cmd, pipe_size, frames_per_write)
+	writer.send(img) # numpy array, written without copying
+	writer.close()
+	'''
+	def __init__(self, cmd, pipe_size=8000000, frames_per_write=1):
+		self.cmd = cmd
+		self.process = subprocess.Popen(
+			cmd,
+			stdin=subprocess.PIPE,
+			stdout=subprocess.DEVNULL,
+			stderr=None,
+			bufsize=0,
+			**PopenKwargs()
+			)
+		self.fd = self.process.stdin.fileno()
+		self.pipeSize = SetPipeSize(self.fd, pipe_size)
+
+		# Staging buffer for coalescing several frames into one write, allocated on first frame
+		self.framesPerWrite = max(1, frames_per_write)
+		self.staging = None
+		self.staged = 0
+		self.frameBytes = 0
+		self.framesWritten = 0
+
+	def send(self, img):
+		if self.framesPerWrite == 1:
+			self._write(memoryview(np.ascontiguousarray(img)).cast("B"))
+		else:
+			if self.staging is None:
+				self.frameBytes = img.nbytes
+				self.staging = np.empty(self.frameBytes*self.framesPerWrite, dtype=np.uint8)
+			offset = self.staged*self.frameBytes
+			self.staging[offset:offset+self.frameBytes] = np.ascontiguousarray(img).reshape(-1).view(np.uint8)
+			self.staged += 1
+			if self.staged == self.framesPerWrite:
+				self.flush()
+		self.framesWritten += 1
+
+	def flush(self):
+		if self.staged > 0:
+			self._write(memoryview(self.staging[:self.staged*self.frameBytes]))
+			self.staged = 0
+
+	def _write(self, buf):
+		# os.write may return after a partial write, so loop until the whole frame is in the pipe
+		try:
+			while len(buf) > 0:
+				n = os.write(self.fd, buf)
+				buf = buf[n:]
+		except (BrokenPipeError, OSError) as e:
+			returncode = self.process.poll()
+			raise IOError("ffmpeg pipe broke (exit code {}): {}. Command: {}"\
+				.format(returncode, e, " ".join(self.cmd)))
+
+	def close(self):
+		try:
+			self.flush()
+		finally:
+			try:
+				self.process.stdin.close()
+			except Exception:
+				pass
+			self.process.wait()
+			if self.process.returncode != 0:
+				logging.error("ffmpeg exited with code {} for command: {}"\
+					.format(self.process.returncode, " ".join(self.cmd)))
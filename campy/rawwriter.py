@@ -0,0 +1,148 @@
+"""
+Raw capture writer. Writes uncompressed frames to a preallocated, memory-mapped file per camera.
+Transcode them to video afterwards with "campy-transcode".
+"""
+
+import os, json, mmap, errno, struct, logging
+import numpy as np
+from campy import ringbuffer
+
+# Header block (magic, JSON length, JSON with shape, dtype, frameBytes, dataOffset and numFrames),
+# then frames back to back from dataOffset. A frame-offset index is saved next to the file on close
+MAGIC = b"CAMPYRAW"
+HEADER_SIZE = 4096
+
+
+def IndexFileName(full_file_name):
+
+	return full_file_name + ".idx.npy"
+
+
+def WriteHeader(f, header):
+	f.seek(0)
+	blob = json.dumps(header).encode()
+	if len(blob) + len(MAGIC) + 4 > HEADER_SIZE:
+		raise ValueError("Raw file header too large.")
+	f.write(MAGIC + struct.pack("<I", len(blob)) + blob)
+
+
+def ReadHeader(full_file_name):
+	with open(full_file_name, "rb") as f:
+		magic = f.read(len(MAGIC))
+		if magic != MAGIC:
+			raise ValueError("{} is not a campy raw file.".format(full_file_name))
+		length = struct.unpack("<I", f.read(4))[0]
+		header = json.loads(f.read(length).decode())
+	return header
+
+
+def OpenRawReader(full_file_name):
+	# Returns header and a read-only (numFrames, H, W[, C]) memory-mapped array of the frames
+	header = ReadHeader(full_file_name)
+	numFrames = header["numFrames"]
+
+	# Recover the frame count from the file size if recording did not close cleanly
+	if numFrames < 0:
+		numFrames = (os.path.getsize(full_file_name) - header["dataOffset"]) // header["frameBytes"]
+		logging.warning("{} was not closed cleanly. Reading {} frames (may include unwritten frames)."\
+			.format(full_file_name, numFrames))
+
+	frames = np.memmap(full_file_name, dtype=header["dtype"], mode="r",
+		offset=header["dataOffset"], shape=(numFrames,) + tuple(header["shape"]))
+	return header, frames
+
+
+def OpenRawWriter(cam_params, full_file_name, num_frames):
+	shape, dtype = ringbuffer.FrameShape(cam_params)
+	header = {
+		"shape": list(shape),
+		"dtype": dtype.name,
+		"pixelFormatInput": cam_params["pixelFormatInput"],
+		"frameRate": cam_params["frameRate"],
+		"frameWidth": cam_params["frameWidth"],
+		"frameHeight": cam_params["frameHeight"],
+		"cameraName": cam_params["cameraName"],
+		}
+	return RawWriter(full_file_name, header, num_frames)
+
+
+class RawWriter(object):
+	'''
+	Usage:
+	writer = RawWriter(full_file_name, header, num_frames)
+	writer.send(img)
+	writer.close()
+	'''
+	def __init__(self, full_file_name, header, num_frames):
+		self.full_file_name = full_file_name
+		self.header = dict(header)
+		self.shape = tuple(header["shape"])
+		self.dtype = np.dtype(header["dtype"])
+		self.frameBytes = int(np.prod(self.shape)) * self.dtype.itemsize
+		self.header["frameBytes"] = self.frameBytes
+		self.header["dataOffset"] = HEADER_SIZE
+		self.header["numFrames"] = -1 # Set on close
+
+		self.framesWritten = 0
+		self.growFrames = max(1, int(num_frames))
+
+		self.f = open(full_file_name, "w+b")
+		WriteHeader(self.f, self.header)
+		self.mm = None
+		try:
+			self.Allocate(max(1, int(num_frames)))
+		except OSError:
+			self.f.close()
+			raise
+
+	def Allocate(self, capacity):
+		# Reserve disk space for capacity frames and (re)map the file
+		size = HEADER_SIZE + capacity*self.frameBytes
+		self.f.flush()
+		self.Reserve(size)
+		if self.mm is not None:
+			self.frames = None
+			self.mm.close()
+		self.mm = mmap.mmap(self.f.fileno(), size)
+		if hasattr(self.mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+			self.mm.madvise(mmap.MADV_SEQUENTIAL)
+		self.frames = np.ndarray((capacity,) + self.shape, dtype=self.dtype,
+			buffer=self.mm, offset=HEADER_SIZE)
+		self.capacity = capacity
+
+	def Reserve(self, size):
+		# Allocate the file's blocks now. A sparse file would crash the writer (SIGBUS) once the disk fills
+		if hasattr(os, "posix_fallocate"):
+			try:
+				os.posix_fallocate(self.f.fileno(), 0, size)
+				return
+			except OSError as e:
+				if e.errno == errno.ENOSPC:
+					raise OSError(errno.ENOSPC, "Not enough disk space for {} ({} MB).".format(
+						self.full_file_name, size >> 20)) from e
+				if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+					raise
+		# File system cannot preallocate
+		self.f.truncate(size)
+
+	def send(self, img):
+		if self.framesWritten == self.capacity:
+			self.Allocate(self.capacity + self.growFrames)
+		self.frames[self.framesWritten][...] = img
+		self.framesWritten += 1
+
+	def close(self):
+		self.frames = None
+		self.mm.flush()
+		self.mm.close()
+
+		# Trim unused preallocated space and record the frame count
+		self.f.truncate(HEADER_SIZE + self.framesWritten*self.frameBytes)
+		self.header["numFrames"] = self.framesWritten
+		WriteHeader(self.f, self.header)
+		self.f.close()
+
+		offsets = HEADER_SIZE + self.frameBytes*np.arange(self.framesWritten, dtype=np.int64)
+		np.save(IndexFileName(self.full_file_name), offsets)
+		print("Wrote {} raw frames ({:.1f} GB) to {}.".format(
+			self.framesWritten, self.framesWritten*self.frameBytes/1e9, self.full_file_name))
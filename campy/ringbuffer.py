@@ -0,0 +1,708 @@
+"""
+Bounded buffers of preallocated frame slots between the grab thread and the video writer,
+in process memory (FrameRing) or shared memory (SharedFrameRing), and display image queues.
+"""
+
+import time, queue, threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from collections import deque
+
+
+# When every slot is full: wait for the writer, discard the incoming frame, or discard the oldest queued frame
+OVERFLOW_POLICIES = ["block", "dropNewest", "dropOldest"]
+PAGE_SIZE = 4096
+
+# Pixel formats of 8-bit (uint8) and >8-bit (uint16) input streams, with number of channels
+PIXEL_FORMATS = {
+	"gray": (1, "uint8"),
+	"bayer_bggr8": (1, "uint8"),
+	"bayer_rggb8": (1, "uint8"),
+	"bayer_gbrg8": (1, "uint8"),
+	"bayer_grbg8": (1, "uint8"),
+	"rgb24": (3, "uint8"),
+	"bgr24": (3, "uint8"),
+	"rgb0": (4, "uint8"),
+	"bgr0": (4, "uint8"),
+	"rgba": (4, "uint8"),
+	"bgra": (4, "uint8"),
+	"gray10le": (1, "uint16"),
+	"gray12le": (1, "uint16"),
+	"gray16le": (1, "uint16"),
+	"bayer_bggr16le": (1, "uint16"),
+	"bayer_rggb16le": (1, "uint16"),
+	"bayer_gbrg16le": (1, "uint16"),
+	"bayer_grbg16le": (1, "uint16"),
+	"rgb48le": (3, "uint16"),
+	}
+
+
+def FrameShape(cam_params):
+	# Get numpy array shape and dtype of one frame from camera parameters
+	pix_fmt = cam_params["pixelFormatInput"]
+	if pix_fmt not in PIXEL_FORMATS:
+		raise ValueError("pixelFormatInput '{}' is not supported by the frame buffer.".format(pix_fmt))
+	channels, dtype = PIXEL_FORMATS[pix_fmt]
+	shape = (int(cam_params["frameHeight"]), int(cam_params["frameWidth"]))
+	if channels > 1:
+		shape = shape + (channels,)
+	return shape, np.dtype(dtype)
+
+
+class FrameShapeError(ValueError):
+	pass
+
+
+def CheckFrameShape(cam_params, ring):
+	# Raise if frames of the opened camera do not fit the slots of ring
+	shape, dtype = FrameShape(cam_params)
+	if shape != ring.shape or dtype != ring.dtype:
+		raise FrameShapeError("{} frames are {} {}, but the frame buffer holds {} {}."\
+			.format(cam_params["cameraName"], shape, dtype, ring.shape, ring.dtype))
+
+
+def SlotStride(shape, dtype, alignment=PAGE_SIZE):
+	# Bytes per slot, rounded up to a whole number of pages
+	frame_bytes = int(np.prod(shape))*np.dtype(dtype).itemsize
+	return -(-frame_bytes // alignment)*alignment
+
+
+def SlotArray(buffer, shape, dtype, capacity, offset=0, alignment=PAGE_SIZE):
+	# (capacity, *shape) view of buffer with every slot starting on a page boundary
+	dtype = np.dtype(dtype)
+
+	# C-contiguous strides within each slot
+	strides = []
+	step = dtype.itemsize
+	for dim in reversed(shape):
+		strides.insert(0, step)
+		step *= dim
+	return np.ndarray((capacity,) + tuple(shape), dtype=dtype, buffer=buffer, offset=offset,
+		strides=(SlotStride(shape, dtype, alignment),) + tuple(strides))
+
+
+def AlignedSlots(shape, dtype, capacity, alignment=PAGE_SIZE):
+	# (capacity, *shape) array with every slot starting on a page boundary
+	raw = np.empty(SlotStride(shape, dtype, alignment)*capacity + alignment, dtype=np.uint8)
+	offset = (-raw.ctypes.data) % alignment
+	return SlotArray(raw, shape, dtype, capacity, offset, alignment)
+
+
+def OpenFrameRing(cam_params):
+	# Allocate frame buffer for one camera stream from camera parameters
+	# Shared memory slots if the writer runs in its own process
+	shape, dtype = FrameShape(cam_params)
+	capacity = int(cam_params["bufferSize"])
+	policy = cam_params["overflowPolicy"]
+	if cam_params["writerProcess"]:
+		ring = SharedFrameRing(shape, dtype, capacity, policy)
+	else:
+		ring = FrameRing(shape, dtype, capacity, policy)
+	print("Allocated {} frame buffer: {} slots of {} {} ({:.0f} MB), overflow policy '{}'.".format(
+		cam_params["cameraName"], capacity, shape, dtype.name, ring.nbytes/1e6, policy))
+	return ring
+
+
+class FrameRing(object):
+	'''
+	Usage:
+	ring = FrameRing(shape, dtype, capacity, policy)
+
+	# Producer, copying img into a slot
+	ring.put(img, timeStamp, frameNumber)
+
+	# Or producer filling a slot in place
+	buf = ring.reserve(frameNumber)
+	if buf is not None:
+		<copy frame into buf>
+		ring.commit(timeStamp, frameNumber)
+
+	# Consumer (blocks until a frame is queued, the ring is closed, or timeout)
+	img = ring.get(timeout=0.5)
+	if img is not None:
+		<write(img, ring.timeStamp, ring.frameNumber)>
+		ring.release()
+
+	Each frame also carries its host receive time (ring.hostTime, passed to commit) and the
+	host time it was queued (ring.queueTime), for latency tracing.
+	'''
+	def __init__(self, shape, dtype, capacity, policy="block"):
+		if policy not in OVERFLOW_POLICIES:
+			raise ValueError("overflowPolicy must be one of {}.".format(OVERFLOW_POLICIES))
+		if capacity < 2:
+			raise ValueError("Frame buffer needs at least 2 slots.")
+
+		self.shape = tuple(shape)
+		self.dtype = np.dtype(dtype)
+		self.capacity = capacity
+		self.policy = policy
+
+		# Preallocate page-aligned slots and touch every page now, rather than during acquisition
+		self.frames = AlignedSlots(self.shape, self.dtype, capacity)
+		self.frames.fill(0)
+		self.frameBytes = self.frames[0].nbytes
+		self.nbytes = self.frameBytes*capacity
+		self.allocations = 1
+
+		# Camera timestamp, frame number and host times of each slot, and of the frame checked out by get()
+		self.timeStamps = np.zeros(capacity, dtype=np.float64)
+		self.frameNumbers = np.zeros(capacity, dtype=np.int64)
+		self.hostTimes = np.zeros(capacity, dtype=np.float64)
+		self.queueTimes = np.zeros(capacity, dtype=np.float64)
+		self.timeStamp = 0.0
+		self.frameNumber = 0
+		self.hostTime = 0.0
+		self.queueTime = 0.0
+		self.lastTimeStamp = 0.0
+
+		# Queued slot indices (oldest first) and free slot indices
+		self.queued = deque()
+		self.free = deque(range(capacity))
+		self.reading = None
+		self.writing = None
+
+		self.lock = threading.Lock()
+		self.not_full = threading.Condition(self.lock)
+		self.not_empty = threading.Condition(self.lock)
+		self.closed = False
+
+		# Counters for metadata
+		self.numPut = 0
+		self.numGet = 0
+		self.dropped = 0
+		self.droppedFrameNumbers = []
+		self.highWaterMark = 0
+
+	def __len__(self):
+		return len(self.queued)
+
+	def __bool__(self):
+		return len(self.queued) > 0
+
+	def backlog(self):
+		# Frames committed but not yet released by the consumer
+		return len(self.queued) + (1 if self.reading is not None else 0)
+
+	def reserve(self, frameNumber=0):
+		# Check out a free slot for the producer to fill in place. Returns None if the frame is dropped
+		# Frame numbers of dropped frames (incoming or evicted) are kept in droppedFrameNumbers
+		with self.lock:
+			if not self.free:
+				if self.policy == "dropNewest":
+					self.dropped += 1
+					self.droppedFrameNumbers.append(frameNumber)
+					return None
+				elif self.policy == "dropOldest":
+					slot = self.queued.popleft()
+					self.free.append(slot)
+					self.dropped += 1
+					self.droppedFrameNumbers.append(int(self.frameNumbers[slot]))
+				else:
+					while not self.free and not self.closed:
+						self.not_full.wait(0.1)
+					if self.closed:
+						self.dropped += 1
+						self.droppedFrameNumbers.append(frameNumber)
+						return None
+			self.writing = self.free.popleft()
+
+		# The slot is owned by the producer until committed, so it is filled outside of the lock
+		return self.frames[self.writing]
+
+	def commit(self, timeStamp=0.0, frameNumber=0, hostTime=0.0):
+		# Queue the reserved slot for the consumer
+		slot = self.writing
+		self.writing = None
+		self.timeStamps[slot] = timeStamp
+		self.frameNumbers[slot] = frameNumber
+		self.hostTimes[slot] = hostTime
+		self.queueTimes[slot] = time.perf_counter()
+		with self.lock:
+			self.queued.append(slot)
+			self.lastTimeStamp = timeStamp
+			self.numPut += 1
+			if len(self.queued) > self.highWaterMark:
+				self.highWaterMark = len(self.queued)
+			self.not_empty.notify()
+
+	def abort(self):
+		# Return the reserved slot unused (e.g. the camera frame could not be copied)
+		with self.lock:
+			if self.writing is not None:
+				self.free.appendleft(self.writing)
+				self.writing = None
+				self.not_full.notify()
+
+	def put(self, img, timeStamp=0.0, frameNumber=0, hostTime=0.0):
+		# Copy frame into a free slot. Returns False if the frame was dropped
+		if img.shape != self.shape:
+			raise ValueError("Frame shape {} does not match buffer shape {}. Check frameWidth/frameHeight."\
+				.format(img.shape, self.shape))
+		buf = self.reserve(frameNumber)
+		if buf is None:
+			return False
+		buf[...] = img
+		self.commit(timeStamp, frameNumber, hostTime)
+		return True
+
+	def get(self, timeout=None):
+		# Check out the oldest queued frame. The returned view is valid until release()
+		# Returns None if no frame arrives before timeout, or once the ring is closed and empty
+		with self.lock:
+			if not self.queued and not self.closed and timeout != 0:
+				self.not_empty.wait_for(lambda: self.queued or self.closed, timeout)
+			if not self.queued:
+				return None
+			self.reading = self.queued.popleft()
+			self.timeStamp = self.timeStamps[self.reading]
+			self.frameNumber = int(self.frameNumbers[self.reading])
+			self.hostTime = float(self.hostTimes[self.reading])
+			self.queueTime = float(self.queueTimes[self.reading])
+			self.numGet += 1
+			return self.frames[self.reading]
+
+	def release(self):
+		# Return the slot from the last get() to the free pool
+		with self.lock:
+			if self.reading is not None:
+				self.free.append(self.reading)
+				self.reading = None
+				self.not_full.notify()
+
+	def close(self):
+		# Wake up both sides: the writer drains what is left, a waiting grabber stops waiting
+		with self.lock:
+			self.closed = True
+			self.not_full.notify_all()
+			self.not_empty.notify_all()
+
+	def stats(self):
+		with self.lock:
+			return {
+				"bufferCapacity": self.capacity,
+				"bufferOverflowPolicy": self.policy,
+				"bufferDroppedFrames": self.dropped,
+				"bufferHighWaterMark": self.highWaterMark,
+				"bufferAllocations": self.allocations,
+				}
+
+
+class SharedFrameRing(object):
+	'''
+	FrameRing with slots in shared memory, for a grabber and a writer in separate processes.
+	Create it in the grabber process and pass it to the writer process (e.g. as a Process argument).
+	Free and queued slot indices travel through two multiprocessing queues. Host times are taken
+	with time.perf_counter, which uses a system-wide clock, so they compare across processes.
+
+	Usage:
+	ring = SharedFrameRing(shape, dtype, capacity, policy)
+	mp.get_context("spawn").Process(target=consumer, args=(ring,)).start()
+
+	# Producer (grabber process), same as FrameRing
+	buf = ring.reserve(frameNumber)
+	if buf is not None:
+		<copy frame into buf>
+		ring.commit(timeStamp, frameNumber)
+	ring.close() # writer drains the queued frames, then get() returns None
+	ring.unlink() # free the shared memory once the writer has exited
+
+	# Consumer (writer process), same as FrameRing
+	img = ring.get(timeout=0.5)
+	if img is not None:
+		<write(img, ring.timeStamp, ring.frameNumber)>
+		ring.release()
+	'''
+	# Shared counters, readable from both processes (e.g. for metrics)
+	COUNTERS = ["numPut", "numGet", "numReleased", "discarded", "dropped", "highWaterMark",
+		"lastTimeStamp", "timeStamp"]
+
+	def __init__(self, shape, dtype, capacity, policy="block", ctx=None):
+		if policy not in OVERFLOW_POLICIES:
+			raise ValueError("overflowPolicy must be one of {}.".format(OVERFLOW_POLICIES))
+		if capacity < 2:
+			raise ValueError("Frame buffer needs at least 2 slots.")
+		if ctx is None:
+			ctx = mp.get_context("spawn")
+
+		self.shape = tuple(shape)
+		self.dtype = np.dtype(dtype)
+		self.capacity = capacity
+		self.policy = policy
+
+		# Shared memory is page-aligned, so every slot starts on a page boundary
+		self.shm = shared_memory.SharedMemory(create=True, size=SlotStride(self.shape, self.dtype)*capacity)
+		self.owner = True
+		self.frames = SlotArray(self.shm.buf, self.shape, self.dtype, capacity)
+		self.frames.fill(0)
+		self.frameBytes = self.frames[0].nbytes
+		self.nbytes = self.frameBytes*capacity
+		self.allocations = 1
+
+		# Slots not used yet are handed out by the producer directly. Released slots come back
+		# through the free queue
+		self.unused = deque(range(capacity))
+		self.free = ctx.Queue()
+		self.queued = ctx.Queue()
+		self.stopped = ctx.Event()
+		self.counters = ctx.RawArray("d", len(self.COUNTERS))
+
+		self._init_local()
+
+	def _init_local(self):
+		# State of one side of the ring, not shared between processes
+		self.writing = None
+		self.reading = None
+		self.frameNumber = 0
+		self.hostTime = 0.0
+		self.queueTime = 0.0
+		self.drained = False
+		self.droppedFrameNumbers = []
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state["shm"], state["frames"]
+		state["shm_name"] = self.shm.name
+		return state
+
+	def __setstate__(self, state):
+		shm_name = state.pop("shm_name")
+		self.__dict__.update(state)
+		self.shm = shared_memory.SharedMemory(name=shm_name)
+		self.owner = False
+		self.unused = deque()
+		self.frames = SlotArray(self.shm.buf, self.shape, self.dtype, self.capacity)
+		self._init_local()
+
+	def _counter(self, name):
+		return self.counters[self.COUNTERS.index(name)]
+
+	def _add(self, name, value=1):
+		self.counters[self.COUNTERS.index(name)] += value
+
+	numPut = property(lambda self: int(self._counter("numPut")))
+	numGet = property(lambda self: int(self._counter("numGet")))
+	dropped = property(lambda self: int(self._counter("dropped")))
+	highWaterMark = property(lambda self: int(self._counter("highWaterMark")))
+	lastTimeStamp = property(lambda self: self._counter("lastTimeStamp"))
+	timeStamp = property(lambda self: self._counter("timeStamp"))
+
+	def __len__(self):
+		return max(0, int(self._counter("numPut") - self._counter("numGet") - self._counter("discarded")))
+
+	def __bool__(self):
+		return len(self) > 0
+
+	def backlog(self):
+		# Frames committed but not yet released by the consumer
+		return max(0, int(self._counter("numPut") - self._counter("numReleased") - self._counter("discarded")))
+
+	@property
+	def closed(self):
+		# Producer side: the writer has stopped. Consumer side: all queued frames were taken
+		return self.drained or (self.owner and self.stopped.is_set())
+
+	def reserve(self, frameNumber=0):
+		# Check out a free slot for the producer to fill in place. Returns None if the frame is dropped
+		# Frame numbers of dropped frames (incoming or evicted) are kept in droppedFrameNumbers
+		slot = None
+		try:
+			slot = self.unused.popleft() if self.unused else self.free.get_nowait()
+		except queue.Empty:
+			if self.policy == "dropNewest":
+				self._add("dropped")
+				self.droppedFrameNumbers.append(frameNumber)
+				return None
+
+		# Wait for the writer to free a slot. dropOldest takes the oldest queued slot instead, once
+		# the queue's feeder thread has delivered it
+		while slot is None:
+			if self.stopped.is_set():
+				self._add("dropped")
+				self.droppedFrameNumbers.append(frameNumber)
+				return None
+			if self.policy == "dropOldest":
+				try:
+					item = self.queued.get_nowait()
+					slot = item[0]
+					self._add("discarded")
+					self._add("dropped")
+					self.droppedFrameNumbers.append(item[2])
+					break
+				except queue.Empty:
+					pass
+			try:
+				slot = self.free.get(timeout=0.1 if self.policy == "block" else 0.001)
+			except queue.Empty:
+				pass
+
+		self.writing = slot
+		return self.frames[slot]
+
+	def commit(self, timeStamp=0.0, frameNumber=0, hostTime=0.0):
+		# Queue the reserved slot for the consumer
+		slot = self.writing
+		self.writing = None
+		self.queued.put((slot, timeStamp, frameNumber, hostTime, time.perf_counter()))
+		self.counters[self.COUNTERS.index("lastTimeStamp")] = timeStamp
+		self._add("numPut")
+		depth = len(self)
+		if depth > self._counter("highWaterMark"):
+			self.counters[self.COUNTERS.index("highWaterMark")] = depth
+
+	def abort(self):
+		# Return the reserved slot unused
+		if self.writing is not None:
+			self.free.put(self.writing)
+			self.writing = None
+
+	def put(self, img, timeStamp=0.0, frameNumber=0, hostTime=0.0):
+		# Copy frame into a free slot. Returns False if the frame was dropped
+		if img.shape != self.shape:
+			raise ValueError("Frame shape {} does not match buffer shape {}. Check frameWidth/frameHeight."\
+				.format(img.shape, self.shape))
+		buf = self.reserve(frameNumber)
+		if buf is None:
+			return False
+		buf[...] = img
+		self.commit(timeStamp, frameNumber, hostTime)
+		return True
+
+	def get(self, timeout=None):
+		# Check out the oldest queued frame. The returned view is valid until release()
+		# Returns None if no frame arrives before timeout, or once the producer closed and all frames were taken
+		if self.drained:
+			return None
+		try:
+			item = self.queued.get(block=timeout != 0, timeout=timeout)
+		except queue.Empty:
+			return None
+		if item is None:
+			self.drained = True
+			return None
+		self.reading, timeStamp, self.frameNumber, self.hostTime, self.queueTime = item
+		self.counters[self.COUNTERS.index("timeStamp")] = timeStamp
+		self._add("numGet")
+		return self.frames[self.reading]
+
+	def release(self):
+		# Return the slot from the last get() to the free pool
+		if self.reading is not None:
+			self.free.put(self.reading)
+			self.reading = None
+			self._add("numReleased")
+
+	def close(self):
+		# Producer: queue the end of stream after the last frame. Consumer: stop a waiting producer
+		if self.owner:
+			if not self.stopped.is_set():
+				self.stopped.set()
+				self.queued.put(None)
+		else:
+			self.stopped.set()
+
+	def unlink(self):
+		# Free the shared memory (producer, after the consumer process has exited)
+		self.frames = None
+		try:
+			self.shm.close()
+		except BufferError:
+			# A frame view is still referenced. The mapping goes away with the process
+			pass
+		if self.owner:
+			self.shm.unlink()
+
+	def stats(self):
+		return {
+			"bufferCapacity": self.capacity,
+			"bufferOverflowPolicy": self.policy,
+			"bufferDroppedFrames": self.dropped,
+			"bufferHighWaterMark": self.highWaterMark,
+			"bufferAllocations": self.allocations,
+			"bufferSharedMemory": True,
+			}
+
+
+class DisplayQueue(object):
+	'''
+	Short queue of the latest display images. Appending never blocks (oldest image is
+	discarded when full), and get() blocks until an image arrives or timeout.
+	get() sets queueTime to the host time the image was appended. The viewer reports when it drew an
+	image with drawn(), so the grabber can trace display latency.
+	'''
+	def __init__(self, maxlen=2):
+		self.images = deque([], maxlen)
+		self.not_empty = threading.Condition(threading.Lock())
+		self.queueTime = 0.0
+
+	def __len__(self):
+		return len(self.images)
+
+	def __bool__(self):
+		return len(self.images) > 0
+
+	def append(self, img):
+		with self.not_empty:
+			self.images.append((img, time.perf_counter()))
+			self.not_empty.notify()
+
+	def get(self, timeout=None):
+		with self.not_empty:
+			if not self.images:
+				self.not_empty.wait(timeout)
+			if not self.images:
+				return None
+			img, self.queueTime = self.images.popleft()
+			return img
+
+	def close(self):
+		# Nothing to free, same interface as DisplaySlot
+		pass
+
+
+class DisplaySlot(object):
+	'''
+	Newest display image of one camera in named shared memory, for a viewer in another process.
+	The grabber overwrites the image in place and never waits for the viewer. A sequence number
+	(odd while the image is being written) lets the viewer detect new and torn images without locks.
+	Shared memory is allocated at the first image, sized to it.
+	get() sets queueTime to the host time the image was appended.
+
+	Usage:
+	# Grabber (camera process), same as DisplayQueue
+	slot = DisplaySlot(name)
+	slot.update(frameNumber, droppedFrames) # optional, shown by the mosaic viewer
+	slot.append(img)
+	slot.append('STOP') # tells the viewer this camera stopped
+	slot.close() # free the shared memory
+
+	# Viewer process
+	slot = DisplaySlot.attach(name) # None until the grabber sent its first image
+	img = slot.get() # newest image, or None if there is none since the previous get()
+	slot.frameNumber, slot.droppedFrames # as of the newest image
+	slot.stopped
+	slot.drawn(time.perf_counter() - slot.queueTime) # after drawing the image
+
+	# Grabber
+	slot.displayed() # newest latency reported by drawn(), or None if there is none since the last call
+	'''
+	# int64 sequence, height, width, channels, stopped; float64 queueTime; int64 frameNumber, droppedFrames;
+	# float64 displayed latency; int64 displayed count (written by the viewer)
+	HEADER_SIZE = 128
+
+	def __init__(self, name, shm=None):
+		self.name = name
+		self.shm = None
+		self.owner = shm is None
+		self.seq = 0
+		self.queueTime = 0.0
+		self.frameNumber = 0
+		self.droppedFrames = 0
+		self.skipped = 0
+		self.drawCount = 0
+		if shm is not None:
+			self._map(shm)
+
+	def _map(self, shm):
+		self.shm = shm
+		self.header = np.ndarray((10,), dtype=np.int64, buffer=shm.buf)
+		self.times = np.ndarray((1,), dtype=np.float64, buffer=shm.buf, offset=40)
+		self.latency = np.ndarray((1,), dtype=np.float64, buffer=shm.buf, offset=64)
+		self.data = np.ndarray((shm.size - self.HEADER_SIZE,), dtype=np.uint8, buffer=shm.buf,
+			offset=self.HEADER_SIZE)
+
+	@classmethod
+	def attach(cls, name):
+		try:
+			return cls(name, shared_memory.SharedMemory(name=name))
+		except FileNotFoundError:
+			return None
+
+	def _create(self, nbytes):
+		try:
+			shm = shared_memory.SharedMemory(name=self.name, create=True, size=self.HEADER_SIZE + nbytes)
+		except FileExistsError:
+			# Left over from a crashed recording
+			stale = shared_memory.SharedMemory(name=self.name)
+			stale.close()
+			stale.unlink()
+			shm = shared_memory.SharedMemory(name=self.name, create=True, size=self.HEADER_SIZE + nbytes)
+		self._map(shm)
+		self.header[:] = 0
+
+	def update(self, frameNumber, droppedFrames):
+		# Counters of the grabber, sent with the next image
+		self.frameNumber = frameNumber
+		self.droppedFrames = droppedFrames
+
+	def append(self, img):
+		if isinstance(img, str):
+			if img == 'STOP' and self.shm is not None:
+				self.header[4] = 1
+			return
+		img = np.asarray(img)
+		if self.shm is None:
+			self._create(img.nbytes)
+		if img.dtype != np.uint8 or img.nbytes > len(self.data):
+			# Display images are 8-bit, and never grow after the first one
+			self.skipped += 1
+			return
+
+		seq = int(self.header[0])
+		self.header[0] = seq + 1
+		self.header[1:4] = img.shape[0], img.shape[1], img.shape[2] if img.ndim == 3 else 1
+		np.copyto(self.data[:img.nbytes].reshape(img.shape), img)
+		self.times[0] = time.perf_counter()
+		self.header[6:8] = self.frameNumber, self.droppedFrames
+		self.header[0] = seq + 2
+
+	def get(self):
+		for attempt in range(3):
+			seq = int(self.header[0])
+			if seq == self.seq:
+				return None
+			if seq % 2 == 1:
+				# Grabber is writing this image right now
+				time.sleep(0.001)
+				continue
+			height, width, channels = (int(x) for x in self.header[1:4])
+			shape = (height, width) if channels == 1 else (height, width, channels)
+			img = self.data[:height*width*channels].reshape(shape).copy()
+			queueTime = float(self.times[0])
+			frameNumber, droppedFrames = (int(x) for x in self.header[6:8])
+			if int(self.header[0]) == seq:
+				self.seq = seq
+				self.queueTime = queueTime
+				self.frameNumber, self.droppedFrames = frameNumber, droppedFrames
+				return img
+		return None
+
+	def drawn(self, latency):
+		# Viewer: latency is written before the count, so a new count always has its latency
+		if self.shm is None:
+			return
+		self.latency[0] = latency
+		self.header[9] += 1
+
+	def displayed(self):
+		if self.shm is None:
+			return None
+		count = int(self.header[9])
+		if count == self.drawCount:
+			return None
+		self.drawCount = count
+		return float(self.latency[0])
+
+	@property
+	def stopped(self):
+		return self.shm is not None and bool(self.header[4])
+
+	def close(self):
+		# Grabber: free the shared memory (a viewer keeps its mapping until it detaches). Viewer: detach
+		if self.shm is None:
+			return
+		self.header = self.times = self.latency = self.data = None
+		self.shm.close()
+		if self.owner:
+			self.shm.unlink()
+		self.shm = None
@@ -0,0 +1,171 @@
+"""
+Segmented recording. Rotates the output file every N frames, naming segments "start_end.mp4" by frame range,
+with the next encoder opened and the previous one closed in the background.
+"""
+
+import os, glob, threading, logging
+
+
+def SegmentLength(cam_params):
+	# Segment length in frames. 0 disables segmenting
+	if cam_params["segmentLengthInFrames"] > 0:
+		return int(cam_params["segmentLengthInFrames"])
+	elif cam_params["segmentLengthInSec"] > 0:
+		return int(round(cam_params["segmentLengthInSec"]*cam_params["frameRate"]))
+	else:
+		return 0
+
+
+def SegmentFileName(folder_name, start, end, ext):
+
+	return os.path.join(folder_name, "{}_{}{}".format(start, end, ext))
+
+
+def RenameSegment(file_name, final_name):
+	# Rename a closed segment together with its companion files (e.g. raw index, timestamps)
+	if final_name == file_name:
+		return
+	for companion in glob.glob(glob.escape(file_name) + ".*"):
+		os.replace(companion, final_name + companion[len(file_name):])
+	os.replace(file_name, final_name)
+
+
+def RemoveSegment(file_name):
+	for f in [file_name] + glob.glob(glob.escape(file_name) + ".*"):
+		if os.path.isfile(f):
+			os.remove(f)
+
+
+class SegmentWriter(object):
+	'''
+	Usage:
+	writer = SegmentWriter(open_encoder, folder_name, ".mp4", segment_length, lead_frames)
+	writer.send(img)
+	writer.request_rotation() # optional, start a new segment as soon as its encoder is open
+	writer.close()
+
+	open_encoder(full_file_name) must return an encoder with send(img) and close().
+	Extra send() arguments (e.g. timestamps) are passed on to the encoder.
+	'''
+	def __init__(self, open_encoder, folder_name, ext, segment_length, lead_frames=100):
+		self.open_encoder = open_encoder
+		self.folder_name = folder_name
+		self.ext = ext
+		self.segmentLength = int(segment_length)
+		self.leadFrames = max(1, min(int(lead_frames), self.segmentLength // 2))
+
+		self.start = 0
+		self.framesInSegment = 0
+		self.segments = []
+		self.closing = []
+
+		# Encoder being opened ahead of the next rotation
+		self.next = None
+		self.rotationRequested = False
+		self.numRequests = 0
+
+		# Open the first segment synchronously, so broken configs fail right away
+		self.file_name = self._file_name(self.start)
+		self.current = self.open_encoder(self.file_name)
+
+	def _file_name(self, start):
+
+		return SegmentFileName(self.folder_name, start, start + self.segmentLength - 1, self.ext)
+
+	def _open_next(self, pending):
+		try:
+			pending["encoder"] = self.open_encoder(pending["file_name"])
+		except Exception as e:
+			pending["error"] = e
+
+	def _close_segment(self, encoder, file_name, final_name=None):
+		try:
+			encoder.close()
+			if final_name is not None:
+				RenameSegment(file_name, final_name)
+		except Exception as e:
+			logging.error("Caught exception at segments.py closing {}: {}".format(file_name, e))
+
+	def _discard(self, pending):
+		# Close and delete a pre-opened encoder that will not be used
+		pending["thread"].join()
+		if pending["encoder"] is not None:
+			self._close_segment(pending["encoder"], pending["file_name"])
+		RemoveSegment(pending["file_name"])
+
+	def _prepare_next(self, start, file_name=None):
+		# File is named for a full segment from start, and renamed on close if it ends up different
+		if file_name is None:
+			file_name = self._file_name(start)
+		pending = {"file_name": file_name, "encoder": None, "error": None}
+		pending["thread"] = threading.Thread(target=self._open_next, args=(pending,), daemon=True)
+		pending["thread"].start()
+		self.next = pending
+
+	def request_rotation(self):
+		# Start a new segment with a freshly opened encoder, without waiting for the boundary
+		if self.next is not None:
+			t = threading.Thread(target=self._discard, args=(self.next,), daemon=True)
+			t.start()
+			self.closing.append(t)
+		# Unique provisional name, as requests may come faster than encoders open
+		self.numRequests += 1
+		start = self.start + self.framesInSegment
+		file_name = os.path.join(self.folder_name, "{}_pending{}{}".format(start, self.numRequests, self.ext))
+		self._prepare_next(start, file_name)
+		self.rotationRequested = True
+
+	def rotate(self):
+		# Hand off to the pre-opened encoder and close the finished segment in the background
+		if self.next is None:
+			self._prepare_next(self.start + self.framesInSegment)
+		pending = self.next
+		self.next = None
+		self.rotationRequested = False
+		pending["thread"].join()
+		if pending["error"] is not None:
+			raise pending["error"]
+
+		end = self.start + self.framesInSegment - 1
+		final_name = SegmentFileName(self.folder_name, self.start, end, self.ext)
+		t = threading.Thread(target=self._close_segment, args=(self.current, self.file_name, final_name), daemon=True)
+		t.start()
+		self.closing.append(t)
+		self.segments.append(final_name)
+
+		self.start += self.framesInSegment
+		self.framesInSegment = 0
+		self.file_name, self.current = pending["file_name"], pending["encoder"]
+
+	def send(self, img, *args):
+		# Rotate at the boundary, or early once a requested encoder is ready
+		if self.framesInSegment == self.segmentLength:
+			self.rotate()
+		elif self.rotationRequested and self.framesInSegment > 0 and not self.next["thread"].is_alive():
+			self.rotate()
+		self.current.send(img, *args)
+		self.framesInSegment += 1
+
+		# Spin up the next encoder ahead of the boundary
+		if self.next is None and self.framesInSegment == self.segmentLength - self.leadFrames:
+			self._prepare_next(self.start + self.segmentLength)
+
+	def close(self):
+		# Close the last segment and rename it to the frame range actually written
+		if self.framesInSegment > 0:
+			end = self.start + self.framesInSegment - 1
+			final_name = SegmentFileName(self.folder_name, self.start, end, self.ext)
+			self._close_segment(self.current, self.file_name, final_name)
+			self.segments.append(final_name)
+		else:
+			self._close_segment(self.current, self.file_name)
+			RemoveSegment(self.file_name)
+
+		# Discard the pre-opened encoder if recording ended before the boundary
+		if self.next is not None:
+			self._discard(self.next)
+			self.next = None
+
+		for t in self.closing:
+			t.join()
+		print("Wrote {} segments to {}.".format(len(self.segments), self.folder_name))
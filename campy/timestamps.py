@@ -0,0 +1,108 @@
+"""
+Variable-frame-rate output (variableFrameRate: True). Saves camera timestamps to a timecode file next to
+each video, and muxes them into the video on close with mp4fpsmod (.mp4/.mov) or mkvmerge (.mkv) if found.
+"""
+
+import os, shutil, subprocess, logging
+
+SUFFIX = ".timestamps.txt"
+HEADER = "# timecode format v2\n"
+
+# Only remind about missing muxing tools once per process
+warned = False
+
+
+def TimecodeFileName(full_file_name):
+
+	return full_file_name + SUFFIX
+
+
+def ReadTimecodes(file_name):
+	# Frame times in seconds from a timecode v2 file
+	times = []
+	with open(file_name, "r") as f:
+		for line in f:
+			line = line.strip()
+			if len(line) > 0 and not line.startswith("#"):
+				times.append(float(line)*1e-3)
+	return times
+
+
+def MuxCommand(full_file_name, timecode_file_name, out_file_name):
+	# Command applying timecodes to a finished video, or None if no tool is available
+	ext = os.path.splitext(full_file_name)[1].lower()
+	if ext in [".mp4", ".mov", ".m4v"] and shutil.which("mp4fpsmod") is not None:
+		return ["mp4fpsmod", "-t", timecode_file_name, "-o", out_file_name, full_file_name]
+	elif ext == ".mkv" and shutil.which("mkvmerge") is not None:
+		return ["mkvmerge", "-q", "-o", out_file_name, "--timestamps", "0:" + timecode_file_name, full_file_name]
+	return None
+
+
+def ApplyTimecodes(full_file_name, timecode_file_name):
+	# Rewrite the video's presentation timestamps in place. Returns True if applied
+	root, ext = os.path.splitext(full_file_name)
+	tmp_file_name = root + ".vfr" + ext
+	cmd = MuxCommand(full_file_name, timecode_file_name, tmp_file_name)
+	if cmd is None:
+		global warned
+		if not warned:
+			print("Saving frame timestamps next to the video ('*{}'). Install mp4fpsmod (mp4) or "\
+				"mkvmerge (mkv) to apply them to the video.".format(SUFFIX))
+			warned = True
+		return False
+
+	result = subprocess.run(cmd, stdout=subprocess.DEVNULL)
+	if result.returncode == 0 and os.path.isfile(tmp_file_name):
+		os.replace(tmp_file_name, full_file_name)
+		return True
+	else:
+		logging.error("Caught error at timestamps.py ApplyTimecodes: {} exited with code {}. "\
+			"Timestamps are kept in {}.".format(cmd[0], result.returncode, timecode_file_name))
+		if os.path.isfile(tmp_file_name):
+			os.remove(tmp_file_name)
+		return False
+
+
+class TimestampWriter(object):
+	'''
+	Usage:
+	writer = TimestampWriter(encoder, full_file_name)
+	writer.send(img, timeStamp) # timeStamp in seconds (camera clock)
+	writer.close() # closes the encoder, then muxes timestamps into full_file_name
+
+	encoder must have send(img) and close().
+	'''
+	def __init__(self, encoder, full_file_name, apply_timecodes=True):
+		self.encoder = encoder
+		self.full_file_name = full_file_name
+		self.timecode_file_name = TimecodeFileName(full_file_name)
+		self.applyTimecodes = apply_timecodes
+		self.firstTimeStamp = None
+		self.lastTime = None
+		self.framesWritten = 0
+		self.f = None
+
+	def send(self, img, timeStamp):
+		# Sidecar is opened on the first frame, so unused encoders leave no file behind
+		if self.f is None:
+			self.f = open(self.timecode_file_name, "w")
+			self.f.write(HEADER)
+			self.firstTimeStamp = timeStamp
+
+		# Timestamps must increase. Nudge repeated or out-of-order camera timestamps by 1 us
+		t = (timeStamp - self.firstTimeStamp)*1e3
+		if self.lastTime is not None and t <= self.lastTime:
+			t = self.lastTime + 1e-3
+		self.lastTime = t
+
+		self.encoder.send(img)
+		self.f.write("{:.3f}\n".format(t))
+		self.framesWritten += 1
+
+	def close(self):
+		self.encoder.close()
+		if self.f is None:
+			return
+		self.f.close()
+		if self.applyTimecodes and self.framesWritten > 1:
+			ApplyTimecodes(self.full_file_name, self.timecode_file_name)
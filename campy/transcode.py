@@ -0,0 +1,84 @@
+"""
+Transcodes raw captures (writerBackend: "raw") to video with the encoder settings of the same config.
+
+Usage:
+campy-transcode ./configs/campy_config.yaml
+"""
+
+import os, glob, time, logging
+import multiprocessing as mp
+from campy import configurator, rawwriter, writer, timestamps
+
+
+def FindRawFiles(params):
+	# List (cam_params, raw file) tasks for every camera folder in the config
+	tasks = []
+	for n_cam in range(params["numCams"]):
+		cam_params = configurator.ConfigureStreamParams(params, n_cam)
+		folder_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"])
+		for raw_file_name in sorted(glob.glob(os.path.join(folder_name, "*.raw"))):
+			tasks.append((cam_params, raw_file_name))
+	return tasks
+
+
+def TranscodeOne(task):
+	cam_params, raw_file_name = task
+	try:
+		header, frames = rawwriter.OpenRawReader(raw_file_name)
+
+		# Frame geometry comes from the raw file, encoder settings from the config
+		cam_params["frameWidth"] = header["frameWidth"]
+		cam_params["frameHeight"] = header["frameHeight"]
+		cam_params["pixelFormatInput"] = header["pixelFormatInput"]
+		cam_params["frameRate"] = header["frameRate"]
+		if cam_params["writerBackend"] == "raw":
+			cam_params["writerBackend"] = "pipe"
+
+		ext = os.path.splitext(cam_params["videoFilename"])[1]
+		video_file_name = os.path.splitext(raw_file_name)[0] + ext
+
+		# Camera timestamps recorded with the raw file become presentation timestamps of the video
+		timecode_file_name = timestamps.TimecodeFileName(raw_file_name)
+		times = None
+		if cam_params["variableFrameRate"] and os.path.isfile(timecode_file_name):
+			times = timestamps.ReadTimecodes(timecode_file_name) or None
+		cam_params["variableFrameRate"] = times is not None
+
+		t0 = time.perf_counter()
+		video_writer = writer.OpenEncoder(cam_params, video_file_name)
+		for i in range(len(frames)):
+			if times is not None:
+				# Sidecar may be short if recording did not close cleanly. Continue at nominal rate
+				t = times[i] if i < len(times) else times[-1] + (i - len(times) + 1)/cam_params["frameRate"]
+				video_writer.send(frames[i], t)
+			else:
+				video_writer.send(frames[i])
+		video_writer.close()
+		elapsed = time.perf_counter() - t0
+
+		print("Transcoded {} frames from {} at {:.1f} fps.".format(
+			len(frames), raw_file_name, len(frames)/max(elapsed, 1e-9)))
+		return video_file_name
+
+	except Exception as e:
+		logging.error("Caught exception at transcode.py TranscodeOne {}: {}".format(raw_file_name, e))
+		return None
+
+
+def Main():
+	params = configurator.ConfigureParams()
+	tasks = FindRawFiles(params)
+	if len(tasks) == 0:
+		print("No raw files found in {}.".format(params["videoFolder"]))
+		return
+
+	print("Transcoding {} raw files...".format(len(tasks)))
+	p = mp.get_context("spawn").Pool(min(len(tasks), params["numCams"]))
+	results = p.map(TranscodeOne, tasks)
+	p.close()
+	p.join()
+
+	failed = [tasks[i][1] for i in range(len(tasks)) if results[i] is None]
+	if len(failed) > 0:
+		print("Failed to transcode: {}".format(failed))
+	print("Done.")
@@ -0,0 +1,222 @@
+"""
+Multi-camera timestamp alignment ("campy-align"). Fits each camera clock to a reference camera
+and saves a synchronized frame map (framemap.npy, alignment.csv) in the session folder.
+
+Usage:
+campy-align ./videos/session1 --reference Camera0
+framemap, cameras, tick_times = LoadFrameMap("./videos/session1")
+"""
+
+import os, re, csv, ast, logging
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import numpy as np
+from scipy import io as sio
+
+# framemap.npy: int32 (sync ticks x cameras), the video frame index of each camera at each tick of the reference
+# clock, or -1. Camera clocks are fitted to host receive times (frametimes.mat hostTime)
+FRAME_MAP = "framemap.npy"
+ALIGNMENT = "alignment.csv"
+
+# Frames in frametimes.npy that are not in the video: dropped by the write buffer (older recordings) and decimated
+SKIPPED_FRAMES = ["dropped_frames.npy", "decimated_frames.npy"]
+
+# Frames processed at once, and at most this many frames (evenly spaced) used to fit each clock
+CHUNK_FRAMES = 1 << 20
+FIT_FRAMES = 100000
+
+
+def FindCameras(folder_name):
+	# Camera folders with frametimes.npy, in natural order (Camera2 before Camera10)
+	names = [d for d in os.listdir(folder_name)
+		if os.path.isfile(os.path.join(folder_name, d, "frametimes.npy"))]
+	return sorted(names, key=lambda s: [int(t) if t.isdigit() else t.lower() for t in re.split(r"(\d+)", s)])
+
+
+def LoadTimeStamps(camera_folder):
+	# Camera timestamps (s, from the first frame) of frametimes.npy, memory-mapped
+	return np.load(os.path.join(camera_folder, "frametimes.npy"), mmap_mode="r")[1]
+
+
+def LoadWrittenFrames(camera_folder):
+	# Mask of the frametimes.npy frames that are in the video, or None if all are
+	skipped = [np.load(os.path.join(camera_folder, f)) for f in SKIPPED_FRAMES
+		if os.path.isfile(os.path.join(camera_folder, f))]
+	if len(skipped) == 0:
+		return None
+	frameNumber = np.load(os.path.join(camera_folder, "frametimes.npy"), mmap_mode="r")[0]
+	return ~np.isin(frameNumber, np.concatenate(skipped))
+
+
+def LoadHostTimes(camera_folder):
+	# Absolute host receive times (s), or None if the recording did not save them
+	meta_file = os.path.join(camera_folder, "metadata.csv")
+	mat_file = os.path.join(camera_folder, "frametimes.mat")
+	if not os.path.isfile(meta_file) or not os.path.isfile(mat_file):
+		return None
+	with open(meta_file, newline="") as f:
+		meta = {row[0]: row[1] for row in csv.reader(f) if len(row) >= 2}
+	if "hostTimeStart" not in meta:
+		return None
+	mat = sio.loadmat(mat_file, variable_names=["hostTime"])
+	if "hostTime" not in mat:
+		return None
+	return mat["hostTime"].ravel() + ast.literal_eval(meta["hostTimeStart"])
+
+
+def FitClock(timeStamps, hostTimes):
+	# host ~= a + b*timeStamp, fitted to the earliest-received half of the frames
+	stride = max(1, len(timeStamps) // FIT_FRAMES)
+	n = min(len(timeStamps), len(hostTimes))
+	x = np.asarray(timeStamps[:n:stride], dtype=np.float64)
+	y = np.asarray(hostTimes[:n:stride], dtype=np.float64)
+	if len(x) < 2:
+		return (float(y[0] - x[0]) if len(x) > 0 else 0.0), 1.0
+	b, a = np.polyfit(x, y, 1)
+	residual = y - (a + b*x)
+	low = residual <= np.median(residual)
+	if low.sum() >= 2:
+		b, a = np.polyfit(x[low], y[low], 1)
+	return float(a), float(b)
+
+
+def TickPeriod(timeStamps):
+	# Median frame interval of the reference camera
+	diffs = np.diff(np.asarray(timeStamps[:CHUNK_FRAMES], dtype=np.float64))
+	diffs = diffs[diffs > 0]
+	if len(diffs) == 0:
+		raise ValueError("Reference camera needs at least 2 frames with increasing timestamps.")
+	return float(np.median(diffs))
+
+
+def MapFrames(aligned, period, first_tick, num_ticks, tolerance, written=None):
+	# Nearest tick of each frame (chunk of aligned times). Returns (ticks, frame indices) with the
+	# closest frame per tick, for frames within tolerance*period of a tick (and in the video, if written is given)
+	position = aligned / period - first_tick
+	ticks = np.rint(position).astype(np.int64)
+	error = np.abs(position - ticks)
+	keep = (error <= tolerance) & (ticks >= 0) & (ticks < num_ticks)
+	if written is not None:
+		keep &= written
+	frames = np.flatnonzero(keep)
+	ticks, error = ticks[keep], error[keep]
+	order = np.lexsort((error, ticks))
+	ticks, first = np.unique(ticks[order], return_index=True)
+	return ticks, frames[order][first]
+
+
+def Align(folder_name, reference=None, tolerance=0.5):
+	# Fit camera clocks and build the frame map. Returns (framemap, alignment rows)
+	cameras = FindCameras(folder_name)
+	if len(cameras) == 0:
+		raise FileNotFoundError("No camera folders with frametimes.npy in {}.".format(folder_name))
+	reference = cameras[0] if reference is None else reference
+	if reference not in cameras:
+		raise ValueError("Reference camera {} not found. Cameras: {}.".format(reference, ", ".join(cameras)))
+
+	timeStamps = {c: LoadTimeStamps(os.path.join(folder_name, c)) for c in cameras}
+	hostTimes = {c: LoadHostTimes(os.path.join(folder_name, c)) for c in cameras}
+	written = {c: LoadWrittenFrames(os.path.join(folder_name, c)) for c in cameras}
+	use_host = all(h is not None for h in hostTimes.values())
+	if not use_host:
+		logging.warning("Host times missing for some cameras. Assuming all cameras started together.")
+
+	# Camera clock to reference clock: t_ref = offset + (1 + drift)*t_cam
+	clocks = {}
+	if use_host:
+		a_ref, b_ref = FitClock(timeStamps[reference], hostTimes[reference])
+		for c in cameras:
+			a, b = FitClock(timeStamps[c], hostTimes[c])
+			clocks[c] = ((a - a_ref) / b_ref, b / b_ref - 1)
+	else:
+		clocks = {c: (0.0, 0.0) for c in cameras}
+
+	# Sync ticks at the reference frame period, spanning all cameras
+	period = TickPeriod(timeStamps[reference])
+	starts = [clocks[c][0] + (1 + clocks[c][1])*float(timeStamps[c][0]) for c in cameras if len(timeStamps[c]) > 0]
+	ends = [clocks[c][0] + (1 + clocks[c][1])*float(timeStamps[c][-1]) for c in cameras if len(timeStamps[c]) > 0]
+	first_tick = int(np.floor(min(starts) / period + 0.5))
+	num_ticks = int(np.floor(max(ends) / period + 0.5)) - first_tick + 1
+
+	framemap = np.full((num_ticks, len(cameras)), -1, dtype=np.int32)
+	rows = []
+	for col, c in enumerate(cameras):
+		offset, drift = clocks[c]
+		video_start = 0
+		for start in range(0, len(timeStamps[c]), CHUNK_FRAMES):
+			chunk = np.asarray(timeStamps[c][start:start + CHUNK_FRAMES], dtype=np.float64)
+			chunk_written = None if written[c] is None else written[c][start:start + CHUNK_FRAMES]
+			ticks, frames = MapFrames(offset + (1 + drift)*chunk, period, first_tick, num_ticks, tolerance,
+				chunk_written)
+			# Frame times rows to video frames, leaving out skipped frames
+			if chunk_written is not None:
+				frames = np.cumsum(chunk_written)[frames] - 1
+			# A tick at a chunk boundary keeps the frame of the first chunk
+			free = framemap[ticks, col] == -1
+			framemap[ticks[free], col] = frames[free] + video_start
+			video_start += len(chunk) if chunk_written is None else int(chunk_written.sum())
+		mapped = int((framemap[:, col] >= 0).sum())
+		rows.append({
+			"camera": c,
+			"column": col,
+			"reference": c == reference,
+			"offsetInSec": offset,
+			"driftPpm": round(1e6*drift, 3),
+			"frames": len(timeStamps[c]) if written[c] is None else int(written[c].sum()),
+			"skippedFrames": 0 if written[c] is None else int((~written[c]).sum()),
+			"mappedFrames": mapped,
+			"missingTicks": num_ticks - mapped,
+			"tickPeriodInSec": period,
+			"firstTickInSec": first_tick*period,
+			"hostTimeFit": use_host,
+			})
+	return framemap, rows
+
+
+def SaveAlignment(folder_name, framemap, rows):
+	np.save(os.path.join(folder_name, FRAME_MAP), framemap)
+	with open(os.path.join(folder_name, ALIGNMENT), "w", newline="") as f:
+		w = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+		w.writeheader()
+		w.writerows(rows)
+
+
+def LoadFrameMap(folder_name, mmap_mode="r"):
+	# Returns (framemap, camera names in column order, tick times on the reference clock)
+	framemap = np.load(os.path.join(folder_name, FRAME_MAP), mmap_mode=mmap_mode)
+	with open(os.path.join(folder_name, ALIGNMENT), newline="") as f:
+		rows = list(csv.DictReader(f))
+	cameras = [r["camera"] for r in sorted(rows, key=lambda r: int(r["column"]))]
+	period, first = float(rows[0]["tickPeriodInSec"]), float(rows[0]["firstTickInSec"])
+	tick_times = first + period*np.arange(framemap.shape[0])
+	return framemap, cameras, tick_times
+
+
+def Main():
+	parser = ArgumentParser(description="Align campy camera timestamps and save a synchronized frame map",
+						formatter_class=ArgumentDefaultsHelpFormatter,)
+	parser.add_argument("folders", nargs="+",
+		help="Recording session folders (containing one folder per camera).")
+	parser.add_argument("--reference", dest="reference", default=None,
+		help="Reference camera folder name (default: first camera).")
+	parser.add_argument("--tolerance", dest="tolerance", type=float, default=0.5,
+		help="Largest distance of a frame from its sync tick, in frame periods.")
+	args = parser.parse_args()
+
+	for folder_name in args.folders:
+		try:
+			framemap, rows = Align(folder_name, args.reference, args.tolerance)
+			SaveAlignment(folder_name, framemap, rows)
+		except Exception as e:
+			logging.error("Caught exception at utils/align.py aligning {}: {}".format(folder_name, e))
+			continue
+
+		print("{}: {} sync ticks at {:.3f} fps, reference {}.".format(folder_name, framemap.shape[0],
+			1 / rows[0]["tickPeriodInSec"], [r["camera"] for r in rows if r["reference"]][0]))
+		for r in rows:
+			print("  {:>12} offset {:+.6f} s, drift {:+.3f} ppm, {} of {} frames mapped, {} ticks missing."\
+				.format(r["camera"], r["offsetInSec"], r["driftPpm"], r["mappedFrames"], r["frames"],
+					r["missingTicks"]))
+
+
+if __name__ == "__main__":
+	Main()
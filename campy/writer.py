@@ -2,114 +2,210 @@
 """
 from imageio_ffmpeg import write_frames
 import os, sys, time, logging
+from collections import deque
+from campy import pipewriter, rawwriter, segments, gopwriter, timestamps, degrade, metrics, affinity, latency
 from campy.utils.utils import QueueKeyboardInterrupt
 
-def OpenWriter(cam_params, queue):
+def OpenWriter(cam_params, queue, policy=None):
 	try:
 		writing = False
 		folder_name = os.path.join(cam_params["videoFolder"], cam_params["cameraName"])
 		file_name = cam_params["videoFilename"]
+		if cam_params["writerBackend"] == "raw":
+			file_name = os.path.splitext(file_name)[0] + ".raw"
 		full_file_name = os.path.join(folder_name, file_name)
 
 		if not os.path.isdir(folder_name):
 			os.makedirs(folder_name)
 			print("Made directory {}.".format(folder_name))
 
-		# Flip blue and red for flir camera input
-		if cam_params["pixelFormatInput"] == "bayer_bggr8" and cam_params["cameraMake"] == "flir":
-			cam_params["pixelFormatInput"] == "bayer_rggb8"
+		# Optionally, rotate output files every segment ("start_end.mp4")
+		# With adaptive degradation, each segment uses the encoder settings of the current level
+		segment_length = segments.SegmentLength(cam_params)
+		if segment_length > 0:
+			writer = segments.SegmentWriter(
+				lambda segment_file_name: OpenEncoder(
+					policy.EncoderParams() if policy is not None else cam_params, segment_file_name),
+				folder_name,
+				os.path.splitext(file_name)[1],
+				segment_length,
+				lead_frames=int(cam_params["frameRate"]),
+				)
+		else:
+			writer = OpenEncoder(cam_params, full_file_name)
+		writing = True
 
-		# Load encoding parameters from cam_params
-		pix_fmt_out = cam_params["pixelFormatOutput"]
-		codec = str(cam_params["codec"])
-		quality = str(cam_params["quality"])
-		preset = str(cam_params["preset"])
-		frameRate = str(cam_params["frameRate"])
-		gpuID = str(cam_params["gpuID"])
+	except Exception as e:
+		logging.error("Caught exception at writer.py OpenWriter: {}".format(e))
+		raise
 
-		# Load defaults
-		gpu_params = []
+	# Initialize read queue object to signal interrupt
+	readQueue = {}
+	readQueue["queue"] = queue
+	readQueue["message"] = "STOP"
 
-		# CPU compression
-		if cam_params["gpuID"] == -1:
-			print("Opened: {} using CPU to compress the stream.".format(full_file_name))
+	return writer, writing, readQueue
+
+
+def EncoderParams(cam_params):
+	# Flip blue and red for flir camera input
+	if cam_params["pixelFormatInput"] == "bayer_bggr8" and cam_params["cameraMake"] == "flir":
+		cam_params["pixelFormatInput"] == "bayer_rggb8"
+
+	# Load encoding parameters from cam_params
+	pix_fmt_out = cam_params["pixelFormatOutput"]
+	codec = str(cam_params["codec"])
+	quality = str(cam_params["quality"])
+	preset = str(cam_params["preset"])
+	frameRate = str(cam_params["frameRate"])
+	gpuID = str(cam_params["gpuID"])
+
+	# Load defaults
+	gpu_params = []
+
+	# CPU compression
+	if cam_params["gpuID"] == -1:
+		if preset == "None":
+			preset = "fast"
+		gpu_params = [
+			"-preset", preset,
+			"-tune", "fastdecode",
+			"-crf", quality,
+			"-bufsize", "20M",
+			"-maxrate", "10M",
+			"-bf:v", "4",
+			]
+		if pix_fmt_out == "rgb0" or pix_fmt_out == "bgr0":
+			pix_fmt_out = "yuv420p"
+		if cam_params["codec"] == "h264":
+			codec = "libx264"
+			gpu_params.append("-x264-params")
+			gpu_params.append("nal-hrd=cbr")
+		elif cam_params["codec"] == "h265":
+			codec = "libx265"
+
+	# GPU compression
+	else:
+		# Nvidia GPU (NVENC) encoder optimized parameters
+		if cam_params["gpuMake"] == "nvidia":
 			if preset == "None":
 				preset = "fast"
 			gpu_params = [
-				"-preset", preset,
-				"-tune", "fastdecode",
-				"-crf", quality,
-				"-bufsize", "20M",
-				"-maxrate", "10M",
-				"-bf:v", "4",
+				"-preset", preset, # set to "fast", "llhp", or "llhq" for h264 or hevc
+				"-qp", quality,
+				"-bf:v", "0",
+				"-gpu", gpuID,
 				]
+			if cam_params["codec"] == "h264":
+				codec = "h264_nvenc"
+			elif cam_params["codec"] == "h265":
+				codec = "hevc_nvenc"
+
+		# AMD GPU (AMF/VCE) encoder optimized parameters
+		elif cam_params["gpuMake"] == "amd":
+			# Preset not supported by AMF
+			gpu_params = [
+				"-usage", "lowlatency",
+				"-rc", "cqp", # constant quantization parameter
+				"-qp_i", quality,
+				"-qp_p", quality,
+				"-qp_b", quality,
+				"-bf:v", "0",
+				"-hwaccel_device", gpuID,]
 			if pix_fmt_out == "rgb0" or pix_fmt_out == "bgr0":
 				pix_fmt_out = "yuv420p"
 			if cam_params["codec"] == "h264":
-				codec = "libx264"
-				gpu_params.append("-x264-params")
-				gpu_params.append("nal-hrd=cbr")
+				codec = "h264_amf"
 			elif cam_params["codec"] == "h265":
-				codec = "libx265"
+				codec = "hevc_amf"
 
-		# GPU compression
-		else:
-			# Nvidia GPU (NVENC) encoder optimized parameters
-			print("Opened: {} using GPU {} to compress the stream.".format(full_file_name, cam_params["gpuID"]))
-			if cam_params["gpuMake"] == "nvidia":
-				if preset == "None":
-					preset = "fast"
-				gpu_params = [
-					"-preset", preset, # set to "fast", "llhp", or "llhq" for h264 or hevc
-					"-qp", quality,
-					"-bf:v", "0",
-					"-gpu", gpuID,
-					]
-				if cam_params["codec"] == "h264":
-					codec = "h264_nvenc"
-				elif cam_params["codec"] == "h265":
-					codec = "hevc_nvenc"
-
-			# AMD GPU (AMF/VCE) encoder optimized parameters
-			elif cam_params["gpuMake"] == "amd":
-				# Preset not supported by AMF
-				gpu_params = [
-					"-usage", "lowlatency",
-					"-rc", "cqp", # constant quantization parameter
-					"-qp_i", quality,
-					"-qp_p", quality,
-					"-qp_b", quality,
+		# Intel iGPU encoder (Quick Sync) optimized parameters				
+		elif cam_params["gpuMake"] == "intel":
+			if preset == "None":
+				preset = "faster"
+			gpu_params = [
 					"-bf:v", "0",
-					"-hwaccel_device", gpuID,]
-				if pix_fmt_out == "rgb0" or pix_fmt_out == "bgr0":
-					pix_fmt_out = "yuv420p"
-				if cam_params["codec"] == "h264":
-					codec = "h264_amf"
-				elif cam_params["codec"] == "h265":
-					codec = "hevc_amf"
-
-			# Intel iGPU encoder (Quick Sync) optimized parameters				
-			elif cam_params["gpuMake"] == "intel":
-				if preset == "None":
-					preset = "faster"
-				gpu_params = [
-						"-bf:v", "0",
-						"-preset", preset,
-						"-q", str(int(quality)+1),]
-				if pix_fmt_out == "rgb0" or pix_fmt_out == "bgr0":
-					pix_fmt_out = "nv12"
-				if cam_params["codec"] == "h264":
-					codec = "h264_qsv"
-				elif cam_params["codec"] == "h265":
-					codec = "hevc_qsv"
+					"-preset", preset,
+					"-q", str(int(quality)+1),]
+			if pix_fmt_out == "rgb0" or pix_fmt_out == "bgr0":
+				pix_fmt_out = "nv12"
+			if cam_params["codec"] == "h264":
+				codec = "h264_qsv"
+			elif cam_params["codec"] == "h265":
+				codec = "hevc_qsv"
+
+	return codec, pix_fmt_out, gpu_params
+
+
+def OpenEncoder(cam_params, full_file_name):
+	# Open the encoder(s) writing to full_file_name. Returned writer has send(frame) and close()
+	if cam_params["writerBackend"] == "raw":
+		print("Opened: {} to capture uncompressed frames.".format(full_file_name))
+	elif cam_params["gpuID"] == -1:
+		print("Opened: {} using CPU to compress the stream.".format(full_file_name))
+	else:
+		print("Opened: {} using GPU {} to compress the stream.".format(full_file_name, cam_params["gpuID"]))
+
+	try:
+		# Optionally, split CPU encoding across several ffmpeg processes, one GOP-aligned block each
+		if cam_params["writerBackend"] == "raw":
+			# Uncompressed capture to a preallocated memory-mapped file (transcode later)
+			num_frames = segments.SegmentLength(cam_params)
+			if num_frames == 0:
+				num_frames = int(round(cam_params["recTimeInSec"]*cam_params["frameRate"]))
+			writer = rawwriter.OpenRawWriter(cam_params, full_file_name, num_frames)
+
+		elif cam_params["gpuID"] == -1 and cam_params["numEncoders"] > 1:
+			print("Encoding {} with {} parallel CPU encoders, {}-frame blocks.".format(
+				cam_params["cameraName"], cam_params["numEncoders"], cam_params["gopLengthInFrames"]))
+			writer = gopwriter.GopWriter(
+				lambda block_file_name, block_params: OpenStream(cam_params, block_file_name, block_params),
+				full_file_name,
+				cam_params["numEncoders"],
+				cam_params["gopLengthInFrames"],
+				cam_params["frameRate"],
+				ffmpeg_log_level=cam_params["ffmpegLogLevel"],
+				)
+		else:
+			writer = OpenStream(cam_params, full_file_name)
+
+		# Optionally, record camera timestamps and mux them as presentation timestamps on close
+		# Raw captures only keep the sidecar, which campy-transcode applies to the video
+		if cam_params["variableFrameRate"]:
+			writer = timestamps.TimestampWriter(writer, full_file_name,
+				apply_timecodes=cam_params["writerBackend"] != "raw")
 
 	except Exception as e:
-		logging.error("Caught exception at writer.py OpenWriter: {}".format(e))
+		logging.error("Caught exception at writer.py OpenEncoder: {}".format(e))
 		raise
 
-	# Initialize writer object (imageio-ffmpeg)
-	while(True):
-		try:
+	return writer
+
+
+def OpenStream(cam_params, full_file_name, extra_params=[]):
+	# Open a single ffmpeg process, with extra output parameters appended to the encoder parameters
+	codec, pix_fmt_out, gpu_params = EncoderParams(cam_params)
+	gpu_params = gpu_params + extra_params
+
+	try:
+		# Direct ffmpeg pipe (large pipe buffer, frames written from numpy memory without copies)
+		if cam_params["writerBackend"] == "pipe":
+			writer = pipewriter.OpenPipeWriter(
+				full_file_name,
+				[cam_params["frameWidth"], cam_params["frameHeight"]], # size [W,H]
+				fps=cam_params["frameRate"],
+				codec=codec,
+				pix_fmt_in=cam_params["pixelFormatInput"],
+				pix_fmt_out=pix_fmt_out,
+				ffmpeg_log_level=cam_params["ffmpegLogLevel"],
+				input_params=[],
+				output_params=gpu_params,
+				pipe_size=int(cam_params["pipeBufferSizeInMB"]*1e6),
+				frames_per_write=int(cam_params["framesPerWrite"]),
+				)
+
+		# Initialize writer object (imageio-ffmpeg)
+		else:
 			writer = write_frames(
 				full_file_name,
 				[cam_params["frameWidth"], cam_params["frameHeight"]], # size [W,H]
@@ -124,40 +220,87 @@ def OpenWriter(cam_params, queue):
 				output_params=gpu_params,
 				)
 			writer.send(None) # Initialize the generator
-			writing = True
-			break
-			
-		except Exception as e:
-			logging.error("Caught exception at writer.py OpenWriter: {}".format(e))
-			raise
-			break
 
-	# Initialize read queue object to signal interrupt
-	readQueue = {}
-	readQueue["queue"] = queue
-	readQueue["message"] = "STOP"
+	except Exception as e:
+		logging.error("Caught exception at writer.py OpenStream: {}".format(e))
+		raise
+
+	return writer
+
+
+def WriteFramesProcess(cam_params, writeQueue, counters=None):
+	# Writer process of a camera stream (writerProcess: True), taking frames from shared memory
+	# The grabber closes writeQueue when it stops, so no stop messages are needed here
+	cam_metrics = None
+	if counters is not None:
+		cam_metrics = metrics.Metrics(cam_params["cameraName"], writeQueue, counters)
+	WriteFrames(cam_params, writeQueue, deque([],1), deque([],1), cam_metrics)
 
-	return writer, writing, readQueue
 
-def WriteFrames(cam_params, writeQueue, stopReadQueue, stopWriteQueue):
+def WriteFrames(cam_params, writeQueue, stopReadQueue, stopWriteQueue, metrics=None):
+	# Optionally, keep the writer and its encoders on the writer CPUs
+	affinity.PinWriterThread(cam_params)
+
+	# Optionally, degrade encoding step by step if the write buffer fills up
+	policy = degrade.OpenDegradePolicy(cam_params, writeQueue)
+
+	# Optionally, time each frame from the write buffer to the encoder
+	tracer = latency.OpenTracer(cam_params, latency.WRITE_STAGES)
+
 	# Start ffmpeg video writer 
-	writer, writing, readQueue = OpenWriter(cam_params, stopReadQueue)
+	writer, writing, readQueue = OpenWriter(cam_params, stopReadQueue, policy)
+
+	# Variable frame rate writers also take the camera timestamp of each frame
+	vfr = cam_params["variableFrameRate"]
 
 	with QueueKeyboardInterrupt(readQueue):
 		# Write until interrupted and/or stop message received
 		while(writing):
-			if writeQueue:
-				writer.send(writeQueue.popleft())
+			# Wait for the next frame. Timeout only serves to re-check the stop message
+			img = writeQueue.get(timeout=0.5)
+			if img is not None:
+				if tracer is not None:
+					dequeueTime = time.perf_counter()
+					tracer.Record("queueWait", dequeueTime - writeQueue.queueTime)
+				if policy is not None:
+					if policy.Update(writeQueue.frameNumber, writeQueue.timeStamp) \
+						and hasattr(writer, "request_rotation"):
+						writer.request_rotation()
+					if metrics is not None:
+						metrics.degradeLevel = policy.level
+						metrics.framesDecimated = len(policy.decimated)
+					if policy.Skip(writeQueue.frameNumber):
+						writeQueue.release()
+						continue
+				if vfr:
+					writer.send(img, writeQueue.timeStamp)
+				else:
+					writer.send(img)
+				if tracer is not None:
+					encodedTime = time.perf_counter()
+					tracer.Record("encoderSend", encodedTime - dequeueTime)
+					tracer.Record("hostToEncoded", encodedTime - writeQueue.hostTime)
+					tracer.Report()
+				writeQueue.release()
+				if metrics is not None:
+					metrics.framesWritten += 1
+					metrics.bytesWritten += img.nbytes
 			else:
 				# Once queue is depleted and grabber stops, then stop writing
-				if stopWriteQueue:
+				if stopWriteQueue or writeQueue.closed:
 					writing = False
-				# Otherwise continue writing
-				time.sleep(0.01)
 
 	# Close up...
+	# Unblock the grabber in case it is waiting for a free slot
+	writeQueue.close()
 	print("Closing video writer for {}. Please wait...".format(cam_params["cameraName"]))
 	time.sleep(1)
 	writer.close()
+	if policy is not None:
+		policy.close()
+	if tracer is not None:
+		latency.AppendSummary(cam_params, tracer)
+	if metrics is not None:
+		metrics.close()
     
 
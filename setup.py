@@ -14,7 +14,12 @@
 					],
 	entry_points={
 		"console_scripts": [
-			"campy-acquire = campy.campy:Main"
+			"campy-acquire = campy.campy:Main",
+			"campy-transcode = campy.transcode:Main",
+			"campy-recover = campy.journal:Main",
+			"campy-bench-encode = campy.bench.encode:Main",
+			"campy-bench = campy.bench.acquire:Main",
+			"campy-align = campy.utils.align:Main",
 		]
 	}
 )
\ No newline at end of file
@@ -0,0 +1,53 @@
+import os
+from campy import affinity
+
+
+def FakeTopology(tmp_path, monkeypatch):
+	# Two NUMA nodes of 4 CPUs, with 2 hyperthreads per physical core
+	for node, cpus in [(0, "0-3"), (1, "4-7")]:
+		os.makedirs(str(tmp_path / "node{}".format(node)))
+		(tmp_path / "node{}".format(node) / "cpulist").write_text(cpus + "\n")
+	for c in range(8):
+		os.makedirs(str(tmp_path / "cpu{}".format(c) / "topology"))
+		first = c - c % 2
+		(tmp_path / "cpu{}".format(c) / "topology" / "thread_siblings_list").write_text(
+			"{}-{}\n".format(first, first + 1))
+	monkeypatch.setattr(affinity, "SYSFS_NODES", str(tmp_path / "node[0-9]*"))
+	monkeypatch.setattr(affinity, "SYSFS_CPU", str(tmp_path / "cpu{}" / "topology" / "thread_siblings_list"))
+
+
+def test_parse_and_format_cpu_lists():
+	assert affinity.ParseCpuList("0-3, 8,10-11") == [0, 1, 2, 3, 8, 10, 11]
+	assert affinity.ParseCpuList([3, "0-1"]) == [0, 1, 3]
+	assert affinity.ParseCpuList(5) == [5]
+	assert affinity.ParseCpuList("None") == []
+	assert affinity.ParseCpuList("auto") == []
+	assert affinity.FormatCpuList([11, 0, 1, 2, 3, 8, 10]) == "0-3,8,10-11"
+
+
+def test_auto_placement_one_core_per_grab_thread(tmp_path, monkeypatch):
+	FakeTopology(tmp_path, monkeypatch)
+	available = set(range(8))
+
+	# Cameras alternate between nodes. Each grab thread gets a physical core, its writer the rest of the node
+	assert affinity.AutoPlacement(0, 2, available) == (0, [0, 1], [2, 3])
+	assert affinity.AutoPlacement(1, 2, available) == (1, [4, 5], [6, 7])
+
+
+def test_auto_placement_with_few_cores(tmp_path, monkeypatch):
+	FakeTopology(tmp_path, monkeypatch)
+	available = set(range(8))
+
+	# Two cameras per node with two cores each: grab threads share cores, writers use the other cores
+	assert affinity.AutoPlacement(0, 4, available) == (0, [0, 1], [2, 3])
+	assert affinity.AutoPlacement(2, 4, available) == (0, [2, 3], [0, 1])
+
+	# Only CPUs available to campy are used
+	assert affinity.AutoPlacement(0, 1, {0, 1, 2}) == (0, [0, 1], [2])
+
+
+def test_place_camera_without_placement():
+	cam_params = {"cameraName": "Camera0", "grabCores": "None", "writerCores": "None", "n_cam": 0, "numCams": 1}
+	cam_params = affinity.PlaceCamera(cam_params)
+	assert cam_params["grabCpus"] == "None"
+	assert cam_params["writerCpus"] == "None"
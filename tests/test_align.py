@@ -0,0 +1,24 @@
+import os
+import numpy as np
+from campy.utils import align
+
+
+def SaveFrameTimes(folder_name, camera, n, skipped=None):
+	camera_folder = os.path.join(folder_name, camera)
+	os.makedirs(camera_folder)
+	np.save(os.path.join(camera_folder, "frametimes.npy"), np.array([np.arange(1, n + 1), np.arange(n) / 100]))
+	if skipped is not None:
+		np.save(os.path.join(camera_folder, "decimated_frames.npy"), np.array(skipped))
+
+
+def test_frame_map_skips_frames_missing_from_video(tmp_path):
+	SaveFrameTimes(str(tmp_path), "Camera0", 10)
+	SaveFrameTimes(str(tmp_path), "Camera1", 10, skipped=[3, 4])
+
+	framemap, rows = align.Align(str(tmp_path))
+	assert list(framemap[:, 0]) == list(range(10))
+	# Frames 3 and 4 were not written, so frame 5 is video frame 2
+	assert list(framemap[:, 1]) == [0, 1, -1, -1, 2, 3, 4, 5, 6, 7]
+	assert rows[1]["frames"] == 8
+	assert rows[1]["skippedFrames"] == 2
+	assert rows[1]["missingTicks"] == 2
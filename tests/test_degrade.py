@@ -0,0 +1,89 @@
+import numpy as np
+from campy import degrade, ringbuffer
+
+
+def CamParams(tmp_path, **kwargs):
+	cam_params = {
+		"cameraName": "Camera0",
+		"videoFolder": str(tmp_path),
+		"adaptiveDegrade": True,
+		"degradeThresholds": [0.5, 0.7, 0.9],
+		"degradeHoldInSec": 0,
+		"degradeDecimation": 2,
+		"preset": "veryslow",
+		"quality": 21,
+		"gpuID": -1,
+		"gpuMake": "nvidia",
+		"segmentLengthInSec": 0,
+		"segmentLengthInFrames": 0,
+		"frameRate": 100,
+		"writerBackend": "imageio",
+		}
+	cam_params.update(kwargs)
+	return cam_params
+
+
+def Fill(ring, n):
+	for i in range(n):
+		ring.put(np.zeros((4, 4), np.uint8), float(i), i + 1)
+
+
+def test_unsegmented_policy_decimates_without_new_segment(tmp_path):
+	ring = ringbuffer.FrameRing((4, 4), np.uint8, 10, "dropNewest")
+	policy = degrade.OpenDegradePolicy(CamParams(tmp_path), ring)
+	assert policy.levels == [0, 3]
+
+	# Level 0 -> 3 must not ask the writer for a new segment
+	Fill(ring, 9)
+	assert policy.Update(1, 0.0) is False
+	assert policy.level == 3
+	assert [policy.Skip(f) for f in range(1, 5)] == [False, True, False, True]
+
+	# Back to level 0 once the buffer drained
+	while ring.get(timeout=0) is not None:
+		ring.release()
+	policy.Update(5, 0.05)
+	assert policy.Update(6, 0.06) is False
+	assert policy.level == 0
+
+
+def test_segmented_policy_starts_new_segment_for_encoder_changes(tmp_path):
+	ring = ringbuffer.FrameRing((4, 4), np.uint8, 10, "dropNewest")
+	policy = degrade.OpenDegradePolicy(CamParams(tmp_path, segmentLengthInSec=60), ring)
+	assert policy.levels == [0, 1, 2, 3]
+
+	Fill(ring, 5)
+	assert policy.Update(1, 0.0) is True
+	assert policy.EncoderParams()["preset"] == "slow"
+	Fill(ring, 4)
+	assert policy.Update(2, 0.01) is True
+	assert policy.Update(3, 0.02) is False
+	assert policy.level == 3
+
+
+def test_escalation_waits_for_hold(tmp_path):
+	ring = ringbuffer.FrameRing((4, 4), np.uint8, 10, "dropNewest")
+	policy = degrade.OpenDegradePolicy(CamParams(tmp_path, segmentLengthInSec=60, degradeHoldInSec=60), ring)
+
+	# A full buffer on consecutive frames steps up once, then holds
+	Fill(ring, 9)
+	assert policy.Update(1, 0.0) is True
+	assert policy.Update(2, 0.01) is False
+	assert policy.Update(3, 0.02) is False
+	assert policy.level == 1
+
+
+def test_faster_preset_stays_within_encoder_presets(tmp_path):
+	cpu = CamParams(tmp_path)
+	nvidia = CamParams(tmp_path, gpuID=0, gpuMake="nvidia")
+	intel = CamParams(tmp_path, gpuID=0, gpuMake="intel")
+	amd = CamParams(tmp_path, gpuID=0, gpuMake="amd")
+
+	assert degrade.FasterPreset(dict(cpu, preset="veryfast")) == "ultrafast"
+	assert degrade.FasterPreset(dict(intel, preset="faster")) == "veryfast"
+	assert degrade.FasterPreset(dict(nvidia, preset="None")) == "hp"
+	assert degrade.FasterPreset(dict(nvidia, preset="slow")) == "fast"
+	assert degrade.FasterPreset(dict(nvidia, preset="hq")) == "hp"
+	assert degrade.FasterPreset(dict(nvidia, preset="llhq")) == "llhp"
+	assert degrade.FasterPreset(dict(nvidia, preset="p4")) == "p2"
+	assert degrade.FasterPreset(dict(amd, preset="quality")) == "quality"
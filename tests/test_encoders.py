@@ -0,0 +1,19 @@
+from campy import encoders
+
+
+PIX_FMTS = """Pixel formats:
+I.... = Supported Input  format for conversion
+.O... = Supported Output format for conversion
+..H.. = Hardware accelerated format
+FLAGS NAME            NB_COMPONENTS BITS_PER_PIXEL BIT_DEPTHS
+-----
+IO... yuv420p                3             12      8-8-8
+I.... bayer_rggb8            3              8      2-4-2
+..H.. cuda                   0              0      0
+"""
+
+
+def test_parse_pixel_formats_skips_header():
+	pix_fmts = encoders.ParsePixelFormats(PIX_FMTS)
+	assert pix_fmts["input"] == ["yuv420p", "bayer_rggb8"]
+	assert pix_fmts["output"] == ["yuv420p"]
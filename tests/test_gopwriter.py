@@ -0,0 +1,48 @@
+import os
+import numpy as np
+import imageio
+from imageio_ffmpeg import write_frames
+from campy import gopwriter
+
+
+class ListEncoder(object):
+	def __init__(self, file_name, extra_params):
+		self.frames = []
+
+	def send(self, img):
+		self.frames.append(img)
+
+	def close(self):
+		pass
+
+
+def OpenStream(file_name, extra_params):
+	writer = write_frames(file_name, [64, 48], fps=30, codec="libx264", pix_fmt_in="gray",
+		pix_fmt_out="yuv420p", ffmpeg_log_level="error", output_params=["-qp", "0"] + extra_params)
+	writer.send(None)
+	return writer
+
+
+def test_blocks_are_dealt_round_robin(tmp_path):
+	writer = gopwriter.GopWriter(ListEncoder, os.path.join(str(tmp_path), "0.mp4"), 2, 3, 30)
+	for img in range(10):
+		writer.send(img)
+	assert writer.encoders[0].frames == [0, 1, 2, 6, 7, 8]
+	assert writer.encoders[1].frames == [3, 4, 5, 9]
+	assert os.path.basename(writer.BlockFileName(3)) == "enc1_000001.mp4"
+	assert os.path.basename(writer.BlockFileName(4)) == "enc0_000002.mp4"
+
+
+def test_stitched_video_keeps_frame_order(tmp_path):
+	# Each frame has its own gray level, so the stitched video shows whether blocks are in order
+	file_name = os.path.join(str(tmp_path), "0.mp4")
+	writer = gopwriter.GopWriter(OpenStream, file_name, 3, 4, 30, ffmpeg_log_level="error")
+	levels = 20 + 15*np.arange(14)
+	for level in levels:
+		writer.send(np.full((48, 64), level, dtype=np.uint8))
+	writer.close()
+
+	frames = [img.mean() for img in imageio.get_reader(file_name)]
+	assert len(frames) == len(levels)
+	assert np.allclose(frames, levels, atol=3)
+	assert not os.path.isdir(os.path.join(str(tmp_path), ".0_blocks"))
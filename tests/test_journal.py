@@ -0,0 +1,77 @@
+import os
+import numpy as np
+from campy import journal
+
+
+def GrabData(n):
+	return {
+		"numFrames": n,
+		"frameNumber": np.arange(1, n + 1),
+		"timeStamp": np.arange(n) / 100,
+		"hostTime": np.arange(n) / 100 + 0.5,
+		"frameID": np.arange(n),
+		}
+
+
+def WriteJournal(tmp_path, n):
+	cam_params = {"cameraName": "Camera0", "videoFolder": str(tmp_path), "frameRate": 100}
+	file_name = os.path.join(str(tmp_path), "Camera0", journal.FILE_NAME)
+	frame_journal = journal.FrameJournal(file_name, cam_params, GrabData(n))
+	frame_journal.close()
+	return file_name
+
+
+def test_read_journal(tmp_path):
+	n = 2*journal.BLOCK_FRAMES + 100
+	cam_params, records = journal.ReadJournal(WriteJournal(tmp_path, n))
+	assert cam_params["cameraName"] == "Camera0"
+	assert len(records) == n
+	assert (records["frameNumber"] == np.arange(1, n + 1)).all()
+	assert (records["hostTime"] == np.arange(n) / 100 + 0.5).all()
+
+
+def test_read_journal_with_torn_tail_block(tmp_path):
+	n = 2*journal.BLOCK_FRAMES + 100
+	file_name = WriteJournal(tmp_path, n)
+
+	# Cut the partial last block in the middle of its records, as a crash during its rewrite would
+	size = os.path.getsize(file_name) - journal.BLOCK_SIZE + journal.BLOCK_HEADER.size + 40*journal.RECORD.itemsize
+	with open(file_name, "r+b") as f:
+		f.truncate(size)
+	cam_params, records = journal.ReadJournal(file_name)
+	assert len(records) == 2*journal.BLOCK_FRAMES
+	assert (records["frameNumber"] == np.arange(1, 2*journal.BLOCK_FRAMES + 1)).all()
+
+
+def test_read_journal_with_corrupt_tail_block(tmp_path):
+	n = 2*journal.BLOCK_FRAMES + 100
+	file_name = WriteJournal(tmp_path, n)
+
+	# Overwrite records of the last block without updating its CRC
+	with open(file_name, "r+b") as f:
+		f.seek(-journal.BLOCK_SIZE + journal.BLOCK_HEADER.size, os.SEEK_END)
+		f.write(b"\xff"*journal.RECORD.itemsize)
+	cam_params, records = journal.ReadJournal(file_name)
+	assert len(records) == 2*journal.BLOCK_FRAMES
+
+
+def test_read_journal_with_header_on_page_boundary(tmp_path):
+	# Pad cam_params so the file header ends just before, on, and just after HEADER_SIZE
+	file_name = os.path.join(str(tmp_path), "Camera0", journal.FILE_NAME)
+
+	def Write(pad):
+		cam_params = {"cameraName": "Camera0", "videoFolder": str(tmp_path), "frameRate": 100, "pad": "x"*pad}
+		frame_journal = journal.FrameJournal(file_name, cam_params, GrabData(10))
+		frame_journal.close()
+		with open(file_name, "rb") as f:
+			f.seek(len(journal.MAGIC))
+			data_offset, length = journal.FILE_HEADER.unpack(f.read(journal.FILE_HEADER.size))
+		return len(journal.MAGIC) + journal.FILE_HEADER.size + length
+
+	base = Write(0)
+	for extra in range(-2, 3):
+		pad = journal.HEADER_SIZE - base + extra
+		assert Write(pad) == journal.HEADER_SIZE + extra
+		cam_params, records = journal.ReadJournal(file_name)
+		assert len(cam_params["pad"]) == pad
+		assert (records["frameNumber"] == np.arange(1, 11)).all()
@@ -0,0 +1,64 @@
+import csv
+import math
+from campy import latency
+
+
+def test_histogram_bins_by_decade_fraction():
+	h = latency.Histogram()
+	for seconds in [5e-7, 1.5e-3, 250.0]:
+		h.Record(seconds)
+	bins = [i for i, c in enumerate(h.counts) if c > 0]
+
+	# Below MIN_LATENCY and above MAX_LATENCY go to the first and last bins
+	assert bins[0] == 0
+	assert bins[-1] == h.NUM_BINS + 1
+	assert h.NUM_BINS == 8*latency.BINS_PER_DECADE
+	i = bins[1]
+	assert h.Edge(i - 1) <= 1.5e-3 < h.Edge(i)
+	assert math.isclose(h.Edge(i) / h.Edge(i - 1), 10**(1 / latency.BINS_PER_DECADE))
+
+
+def test_histogram_percentiles():
+	h = latency.Histogram()
+	for n in range(90):
+		h.Record(1.1e-3)
+	for n in range(10):
+		h.Record(0.05)
+
+	# Upper edge of the percentile's bin, capped at the largest value recorded
+	assert 1.1e-3 < h.Percentile(50) < 1.1e-3*10**(1 / latency.BINS_PER_DECADE)
+	assert h.Percentile(90) == h.Percentile(50)
+	assert h.Percentile(99) == 0.05
+	assert math.isnan(latency.Histogram().Percentile(50))
+
+
+def test_window_resets_without_losing_totals():
+	h = latency.Histogram()
+	h.Record(0.01)
+	h.ResetWindow()
+	h.Record(0.002)
+	assert sum(h.window) == 1
+	assert h.windowMax == 0.002
+	assert sum(h.counts) == 2
+	assert h.max == 0.01
+
+
+def test_device_latency_relative_to_lowest_offset(tmp_path):
+	tracer = latency.LatencyTracer("Camera0", latency.GRAB_STAGES)
+	# Host clock 10 s ahead of the camera, frames delayed by 1, 3 and 1 ms
+	for timeStamp, delay in [(0.0, 1e-3), (0.01, 3e-3), (0.02, 1e-3)]:
+		tracer.RecordDevice(timeStamp, 10.0 + timeStamp + delay)
+	h = tracer.histograms["deviceToHost"]
+	assert h.count == 3
+	# Less the drift allowed since the first frame (MAX_DRIFT x 12 ms)
+	assert math.isclose(h.max, 2e-3 - latency.MAX_DRIFT*0.012, rel_tol=1e-6)
+
+	file_name = str(tmp_path / "latency.csv")
+	tracer.Save(file_name)
+	with open(file_name, newline="") as f:
+		rows = list(csv.DictReader(f))
+	assert sum(int(r["count"]) for r in rows if r["stage"] == "deviceToHost") == 3
+	assert all(float(r["binLowerMs"]) < float(r["binUpperMs"]) for r in rows)
+	summary = tracer.Summary()
+	assert summary["latencyPercentiles"] == "p50,p90,p99,max"
+	assert summary["latencyDeviceToHostMs"][-1] == 1.988
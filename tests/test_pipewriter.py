@@ -0,0 +1,48 @@
+import sys
+import numpy as np
+import imageio
+from campy import pipewriter
+
+
+def Frames(n):
+	return [np.full((48, 64), 20 + 15*i, dtype=np.uint8) for i in range(n)]
+
+
+def test_staged_writes_keep_every_byte_in_order(tmp_path):
+	# Child process copying its stdin to a file instead of ffmpeg
+	out_file_name = str(tmp_path / "out.bin")
+	cmd = [sys.executable, "-c",
+		"import sys, shutil; shutil.copyfileobj(sys.stdin.buffer, open(sys.argv[1], 'wb'))", out_file_name]
+	writer = pipewriter.PipeWriter(cmd, frames_per_write=3)
+
+	# 7 frames: two full staging writes, and one partial write on close. Every other column, so frames are not contiguous
+	frames = [np.arange(96, dtype=np.uint8).reshape(8, 12)[:, ::2] + i for i in range(7)]
+	for img in frames:
+		writer.send(img)
+	writer.close()
+
+	assert writer.framesWritten == 7
+	assert writer.process.returncode == 0
+	with open(out_file_name, "rb") as f:
+		assert f.read() == b"".join(np.ascontiguousarray(img).tobytes() for img in frames)
+
+
+def test_pipe_writer_encodes_video(tmp_path):
+	file_name = str(tmp_path / "0.mp4")
+	writer = pipewriter.OpenPipeWriter(file_name, [64, 48], 30, "libx264", "gray", "yuv420p",
+		ffmpeg_log_level="error", output_params=["-qp", "0"], frames_per_write=2)
+	for img in Frames(5):
+		writer.send(img)
+	writer.close()
+
+	assert writer.process.returncode == 0
+	frames = [img.mean() for img in imageio.get_reader(file_name)]
+	assert np.allclose(frames, [img.mean() for img in Frames(5)], atol=3)
+
+
+def test_ffmpeg_command_reads_raw_frames_from_stdin():
+	cmd = pipewriter.FFmpegCommand("0.mp4", [64, 48], 30, "libx264", "gray", "yuv420p",
+		output_params=["-crf", "21"])
+	assert cmd[cmd.index("-s") + 1] == "64x48"
+	assert cmd[cmd.index("-i") + 1] == "-"
+	assert cmd[-3:] == ["-crf", "21", "0.mp4"]
@@ -0,0 +1,76 @@
+import os
+import numpy as np
+import imageio
+from campy import configurator, rawwriter, transcode
+
+
+def Params(tmp_path):
+	params = configurator.DefaultParams()
+	params.update({
+		"numCams": 1,
+		"cameraNames": ["Camera0"],
+		"videoFolder": str(tmp_path),
+		"writerBackend": "raw",
+		"frameWidth": 64,
+		"frameHeight": 48,
+		"frameRate": 30,
+		"pixelFormatInput": "gray",
+		"pixelFormatOutput": "yuv420p",
+		"quality": 0,
+		"ffmpegLogLevel": "error",
+		})
+	return params
+
+
+def WriteRaw(params, levels, num_frames):
+	cam_params = configurator.ConfigureStreamParams(params, 0)
+	folder_name = os.path.join(params["videoFolder"], "Camera0")
+	os.makedirs(folder_name, exist_ok=True)
+	file_name = os.path.join(folder_name, "0.raw")
+	raw_writer = rawwriter.OpenRawWriter(cam_params, file_name, num_frames)
+	for level in levels:
+		raw_writer.send(np.full((48, 64), level, dtype=np.uint8))
+	return raw_writer, file_name
+
+
+def test_raw_header_and_frames_round_trip(tmp_path):
+	# Fewer preallocated frames than written, so the file grows
+	levels = 20 + 15*np.arange(7)
+	raw_writer, file_name = WriteRaw(Params(tmp_path), levels, 3)
+	raw_writer.close()
+
+	header, frames = rawwriter.OpenRawReader(file_name)
+	assert header["numFrames"] == 7
+	assert header["shape"] == [48, 64]
+	assert header["dtype"] == "uint8"
+	assert header["pixelFormatInput"] == "gray"
+	assert (frames[:, 0, 0] == levels).all()
+	offsets = np.load(rawwriter.IndexFileName(file_name))
+	assert list(offsets) == [rawwriter.HEADER_SIZE + 48*64*i for i in range(7)]
+	assert os.path.getsize(file_name) == offsets[-1] + 48*64
+
+
+def test_raw_reader_recovers_unclosed_file(tmp_path):
+	raw_writer, file_name = WriteRaw(Params(tmp_path), [50, 60], 4)
+	raw_writer.mm.flush()
+
+	# Frame count is not in the header yet, so all preallocated frames are read
+	header, frames = rawwriter.OpenRawReader(file_name)
+	assert header["numFrames"] == -1
+	assert len(frames) == 4
+	assert list(frames[:2, 0, 0]) == [50, 60]
+	raw_writer.close()
+
+
+def test_transcode_raw_to_video(tmp_path):
+	params = Params(tmp_path)
+	levels = 20 + 15*np.arange(10)
+	raw_writer, file_name = WriteRaw(params, levels, 10)
+	raw_writer.close()
+
+	tasks = transcode.FindRawFiles(params)
+	assert [t[1] for t in tasks] == [file_name]
+	video_file_name = transcode.TranscodeOne(tasks[0])
+	assert video_file_name == os.path.join(str(tmp_path), "Camera0", "0.mp4")
+	frames = [img.mean() for img in imageio.get_reader(video_file_name)]
+	assert np.allclose(frames, levels, atol=3)
@@ -0,0 +1,116 @@
+import os, time, threading
+import numpy as np
+import pytest
+from campy import ringbuffer
+
+
+def test_display_slot_reports_viewer_latency():
+	slot = ringbuffer.DisplaySlot("campytest{}".format(os.getpid()))
+	try:
+		slot.update(5, 1)
+		slot.append(np.full((4, 6), 7, dtype=np.uint8))
+		viewer = ringbuffer.DisplaySlot.attach(slot.name)
+		img = viewer.get()
+		assert img.shape == (4, 6) and (img == 7).all()
+		assert (viewer.frameNumber, viewer.droppedFrames) == (5, 1)
+		assert viewer.get() is None
+
+		assert slot.displayed() is None
+		viewer.drawn(0.25)
+		assert slot.displayed() == 0.25
+		assert slot.displayed() is None
+
+		slot.append('STOP')
+		assert viewer.stopped
+		viewer.close()
+	finally:
+		slot.close()
+
+
+def Frame(value):
+	return np.full((2, 3), value, dtype=np.uint8)
+
+
+def Drain(ring, timeout=0):
+	# Frame numbers and pixel values of the queued frames, oldest first
+	frames = []
+	while True:
+		img = ring.get(timeout=timeout)
+		if img is None:
+			return frames
+		frames.append((ring.frameNumber, int(img[0, 0])))
+		ring.release()
+
+
+def test_drop_newest_keeps_queued_frames():
+	ring = ringbuffer.FrameRing((2, 3), np.uint8, 3, "dropNewest")
+	results = [ring.put(Frame(n), n, n) for n in range(1, 6)]
+	assert results == [True, True, True, False, False]
+	assert ring.dropped == 2 and ring.highWaterMark == 3
+	assert ring.droppedFrameNumbers == [4, 5]
+	assert Drain(ring) == [(1, 1), (2, 2), (3, 3)]
+
+
+def test_drop_oldest_keeps_newest_frames():
+	ring = ringbuffer.FrameRing((2, 3), np.uint8, 3, "dropOldest")
+	results = [ring.put(Frame(n), n, n) for n in range(1, 6)]
+	assert all(results)
+	assert ring.dropped == 2
+	assert ring.droppedFrameNumbers == [1, 2]
+	assert Drain(ring) == [(3, 3), (4, 4), (5, 5)]
+
+
+def test_block_waits_for_the_writer():
+	ring = ringbuffer.FrameRing((2, 3), np.uint8, 2, "block")
+	ring.put(Frame(1), 1, 1)
+	ring.put(Frame(2), 2, 2)
+	producer = threading.Thread(target=ring.put, args=(Frame(3), 3, 3))
+	producer.start()
+	producer.join(0.2)
+	assert producer.is_alive()
+
+	img = ring.get(timeout=1)
+	assert ring.frameNumber == 1
+	ring.release()
+	producer.join(1)
+	assert not producer.is_alive()
+	assert ring.dropped == 0
+	assert Drain(ring) == [(2, 2), (3, 3)]
+
+
+def test_block_stops_waiting_when_closed():
+	ring = ringbuffer.FrameRing((2, 3), np.uint8, 2, "block")
+	ring.put(Frame(1), 1, 1)
+	ring.put(Frame(2), 2, 2)
+	closer = threading.Timer(0.1, ring.close)
+	closer.start()
+	assert ring.put(Frame(3), 3, 3) is False
+	assert ring.dropped == 1
+	assert ring.droppedFrameNumbers == [3]
+	assert Drain(ring) == [(1, 1), (2, 2)]
+
+
+def test_shared_ring_drop_oldest():
+	ring = ringbuffer.SharedFrameRing((2, 3), np.uint8, 2, "dropOldest")
+	try:
+		for n in range(1, 5):
+			buf = ring.reserve(n)
+			buf[...] = Frame(n)
+			ring.commit(n, n)
+			# Queued slots reach the queue's pipe in a feeder thread
+			time.sleep(0.1)
+		assert ring.dropped == 2
+		assert ring.droppedFrameNumbers == [1, 2]
+		assert Drain(ring, 0.1) == [(3, 3), (4, 4)]
+	finally:
+		ring.close()
+		ring.unlink()
+
+
+def test_check_frame_shape():
+	cam_params = {"cameraName": "Camera0", "pixelFormatInput": "rgb24", "frameWidth": 320, "frameHeight": 240}
+	ring = ringbuffer.FrameRing((240, 320, 3), np.uint8, 2)
+	ringbuffer.CheckFrameShape(cam_params, ring)
+	cam_params["frameWidth"] = 336
+	with pytest.raises(ringbuffer.FrameShapeError):
+		ringbuffer.CheckFrameShape(cam_params, ring)
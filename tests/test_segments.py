@@ -0,0 +1,60 @@
+import os
+from campy import segments
+
+
+class ListEncoder(object):
+	# Writes the frames it was sent to its file on close
+	def __init__(self, file_name):
+		self.file_name = file_name
+		self.frames = []
+		open(file_name, "w").close()
+
+	def send(self, img):
+		self.frames.append(img)
+
+	def close(self):
+		with open(self.file_name, "w") as f:
+			f.write(",".join(str(img) for img in self.frames))
+
+
+def ReadSegments(folder_name):
+	segment_files = {}
+	for name in os.listdir(folder_name):
+		with open(os.path.join(folder_name, name)) as f:
+			segment_files[name] = [int(img) for img in f.read().split(",")]
+	return segment_files
+
+
+def test_segment_length():
+	cam_params = {"segmentLengthInFrames": 0, "segmentLengthInSec": 2.5, "frameRate": 100}
+	assert segments.SegmentLength(cam_params) == 250
+	assert segments.SegmentLength(dict(cam_params, segmentLengthInFrames=40)) == 40
+	assert segments.SegmentLength(dict(cam_params, segmentLengthInSec=0)) == 0
+
+
+def test_segments_roll_over_and_are_named_by_frame_range(tmp_path):
+	writer = segments.SegmentWriter(ListEncoder, str(tmp_path), ".mp4", 4, lead_frames=1)
+	for img in range(10):
+		writer.send(img)
+	writer.close()
+
+	# The last segment is renamed to the frames it holds, and the pre-opened encoder is removed
+	assert ReadSegments(str(tmp_path)) == {
+		"0_3.mp4": [0, 1, 2, 3],
+		"4_7.mp4": [4, 5, 6, 7],
+		"8_9.mp4": [8, 9],
+		}
+	assert [os.path.basename(f) for f in writer.segments] == ["0_3.mp4", "4_7.mp4", "8_9.mp4"]
+
+
+def test_requested_rotation_starts_segment_early(tmp_path):
+	writer = segments.SegmentWriter(ListEncoder, str(tmp_path), ".mp4", 100)
+	for img in range(3):
+		writer.send(img)
+	writer.request_rotation()
+	writer.next["thread"].join()
+	for img in range(3, 5):
+		writer.send(img)
+	writer.close()
+
+	assert ReadSegments(str(tmp_path)) == {"0_2.mp4": [0, 1, 2], "3_4.mp4": [3, 4]}
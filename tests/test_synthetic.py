@@ -0,0 +1,28 @@
+import time
+import numpy as np
+from campy.cameras import synthetic
+
+
+def Camera(buffer_frames):
+	frames = synthetic.SyntheticFrames((4, 6), np.uint8, 4)
+	return synthetic.SyntheticCamera(frames, 1000, buffer_frames=buffer_frames)
+
+
+def test_late_grab_overwrites_old_frames():
+	camera = Camera(5)
+	camera.Start()
+	time.sleep(0.05)
+	grabResult = camera.Grab(1.0)
+	# Only the newest 5 frames are left on the camera
+	assert grabResult.frameID >= 46
+	assert camera.numOverwritten == grabResult.frameID - 1
+	assert grabResult.timeStamp == camera.ExposureTime(grabResult.frameID)
+	assert camera.Grab(1.0).frameID == grabResult.frameID + 1
+
+
+def test_unbounded_buffer_keeps_every_frame():
+	camera = Camera(0)
+	camera.Start()
+	time.sleep(0.05)
+	assert [camera.Grab(1.0).frameID for n in range(3)] == [1, 2, 3]
+	assert camera.numOverwritten == 0
@@ -0,0 +1,47 @@
+import os
+import numpy as np
+from campy import timestamps
+
+
+class ListEncoder(object):
+	def __init__(self):
+		self.frames = []
+		self.closed = False
+
+	def send(self, img):
+		self.frames.append(img)
+
+	def close(self):
+		self.closed = True
+
+
+def test_timecode_v2_file(tmp_path):
+	file_name = os.path.join(str(tmp_path), "0.mp4")
+	encoder = ListEncoder()
+	writer = timestamps.TimestampWriter(encoder, file_name, apply_timecodes=False)
+
+	# Repeated and out-of-order camera timestamps are nudged forward by 1 us
+	for i, t in enumerate([100.0, 100.01, 100.01, 100.005, 100.05]):
+		writer.send(i, t)
+	writer.close()
+
+	assert encoder.frames == [0, 1, 2, 3, 4]
+	assert encoder.closed
+	with open(timestamps.TimecodeFileName(file_name)) as f:
+		assert f.read() == timestamps.HEADER + "0.000\n10.000\n10.001\n10.002\n50.000\n"
+	times = timestamps.ReadTimecodes(timestamps.TimecodeFileName(file_name))
+	assert np.allclose(times, [0.0, 0.01, 0.010001, 0.010002, 0.05])
+
+
+def test_unused_writer_leaves_no_timecode_file(tmp_path):
+	file_name = os.path.join(str(tmp_path), "0.mp4")
+	writer = timestamps.TimestampWriter(ListEncoder(), file_name)
+	writer.close()
+	assert not os.path.exists(timestamps.TimecodeFileName(file_name))
+
+
+def test_mux_command_by_container(monkeypatch):
+	monkeypatch.setattr(timestamps.shutil, "which", lambda name: "/usr/bin/" + name)
+	assert timestamps.MuxCommand("0.mp4", "0.mp4.timestamps.txt", "0.vfr.mp4")[0] == "mp4fpsmod"
+	assert timestamps.MuxCommand("0.mkv", "0.mkv.timestamps.txt", "0.vfr.mkv")[0] == "mkvmerge"
+	assert timestamps.MuxCommand("0.avi", "0.avi.timestamps.txt", "0.vfr.avi") is None
@@ -0,0 +1,26 @@
+import os
+import numpy as np
+from campy.cameras import unicam
+
+
+def test_save_metadata_leaves_out_buffer_drops(tmp_path):
+	cam_params = {"cameraName": "Camera0", "videoFolder": str(tmp_path)}
+	os.makedirs(os.path.join(str(tmp_path), "Camera0"))
+	n = 10
+	grabdata = {
+		"numFrames": n,
+		"frameNumber": np.arange(1, n + 1),
+		"timeStamp": np.arange(n) / 100 + 5,
+		"hostTime": np.arange(n) / 100 + 7,
+		"frameID": np.arange(n),
+		"bufferDroppedFrameNumbers": [7, 3, 4],
+		}
+	unicam.SaveMetadata(cam_params, grabdata)
+
+	folder_name = os.path.join(str(tmp_path), "Camera0")
+	frametimes = np.load(os.path.join(folder_name, "frametimes.npy"))
+	assert list(frametimes[0]) == [1, 2, 5, 6, 8, 9, 10]
+	assert np.allclose(frametimes[1], (frametimes[0] - 1) / 100)
+	assert list(np.load(os.path.join(folder_name, "dropped_frames.npy"))) == [3, 4, 7]
+	assert cam_params["totalFrames"] == n
+	assert cam_params["cameraDroppedFrames"] == 0